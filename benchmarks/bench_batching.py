@@ -0,0 +1,32 @@
+"""
+Round trips per driver operation with and without command batching.
+run with `python -m benchmarks.bench_batching`
+"""
+from benchmarks.loopback import LoopbackDW, UnbatchedLoopbackDW
+
+OPERATIONS = {
+    'read_registers(0, 32)': lambda dw: dw.read_registers(0, 32),
+    'write_registers(r24..r31)': lambda dw: dw.write_registers(bytes(8), 24),
+    'read_sram(0x60, 64)': lambda dw: dw.read_sram(0x60, 64),
+    'write_sram(0x60, 64)': lambda dw: dw.write_sram(bytes(64), 0x60),
+    'read_flash(0, 64)': lambda dw: dw.read_flash(0, 64),
+}
+
+
+def measure(dw, operation):
+    dw.reset_stats()
+    operation(dw)
+    return dw.round_trips, dw.modeled_time()
+
+
+def main():
+    before, after = UnbatchedLoopbackDW(), LoopbackDW()
+    print(f"{'operation':<28}{'rt before':>10}{'rt after':>10}{'ms before':>11}{'ms after':>10}")
+    for name, operation in OPERATIONS.items():
+        rt_b, t_b = measure(before, operation)
+        rt_a, t_a = measure(after, operation)
+        print(f"{name:<28}{rt_b:>10}{rt_a:>10}{t_b * 1000:>11.2f}{t_a * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
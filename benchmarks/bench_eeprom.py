@@ -0,0 +1,72 @@
+"""
+Dumping and writing the whole eeprom, per byte register setup (as the driver used to) vs block read
+and diff-aware write. both writers are bound by the wire time, which covers the eeprom write time
+(the diff-aware one pads its chained stream for it), so the model needs no EEPE timing.
+run with `python -m benchmarks.bench_eeprom`
+"""
+import os
+
+from benchmarks.loopback import LoopbackDW
+from dwire import CNTXT_WRT_FLASH
+from dwire.avr import REG_Y, REG_X, OUT, IN
+
+
+def legacy_read_eeprom(dw, addr, len):
+    """
+    the previous read_eeprom: register setup, context switch and six exec for every byte
+    """
+    buf = b''
+    for i in range(len):
+        dw.write_registers(b'\x01\x01' + int.to_bytes(addr + i, 2, 'little'), REG_Y)
+        dw._dw_set_cntxt(CNTXT_WRT_FLASH, True)
+        dw.exec(OUT(dw.dev.EEARH, 31))
+        dw.exec(OUT(dw.dev.EEARL, 30))
+        dw.exec(OUT(dw.dev.EECR, 28))
+        dw.exec(IN(0, dw.dev.EEDR))
+        dw.exec(OUT(dw.dev.DWRD, 0))
+        buf += dw.read(1)
+    return buf
+
+
+def legacy_write_eeprom(dw, data, addr):
+    """
+    the previous write_eeprom: register setup for every byte, atomic erase+write, no EEPE polling
+    """
+    for i in range(len(data)):
+        dw.write_registers(b'\x04\x02\x01\x01' + int.to_bytes(addr + i, 2, 'little'), REG_X)
+        dw._dw_set_cntxt(CNTXT_WRT_FLASH, True)
+        dw.exec(OUT(dw.dev.EEARH, 31))
+        dw.exec(OUT(dw.dev.EEARL, 30))
+        dw.exec(IN(0, dw.dev.DWRD), aux=bytes([data[i]]))
+        dw.exec(OUT(dw.dev.EEDR, 0))
+        dw.exec(OUT(dw.dev.EECR, 26))
+        dw.exec(OUT(dw.dev.EECR, 27))
+
+
+def measure(dw, operation):
+    dw.reset_stats()
+    operation()
+    return dw.round_trips, dw.modeled_time()
+
+
+def main():
+    for latency in (0.001, 0.004, 0.016):
+        dw = LoopbackDW(latency=latency)
+        size = dw.dev.EEPROM_SIZE
+        blob = os.urandom(size)  # the loopback target never holds the blob: every byte is written
+        update = bytes(blob[i] | 1 if i % 16 == 0 else 0 for i in range(size))  # the loopback eeprom reads 0x00
+        print(f"{size} bytes eeprom, {latency * 1000:.0f}ms latency")
+        rt_b, t_b = measure(dw, lambda: legacy_read_eeprom(dw, 0, size))
+        rt_a, t_a = measure(dw, lambda: dw.read_eeprom(0, size))
+        print(f"\tread per byte setup: {rt_b} round trips, {t_b:.2f} s modeled")
+        print(f"\tread block:          {rt_a} round trips, {t_a:.2f} s modeled (x{t_b / t_a:.1f})")
+        rt_b, t_b = measure(dw, lambda: legacy_write_eeprom(dw, blob, 0))
+        rt_a, t_a = measure(dw, lambda: dw.write_eeprom(blob, 0))
+        print(f"\twrite per byte setup: {rt_b} round trips, {t_b:.2f} s modeled")
+        print(f"\twrite diff-aware:     {rt_a} round trips, {t_a:.2f} s modeled (x{t_b / t_a:.1f})")
+        rt_a, t_a = measure(dw, lambda: dw.write_eeprom(update, 0))
+        print(f"\tupdate 1 byte in 16:  {rt_a} round trips, {t_a:.2f} s modeled (x{t_b / t_a:.1f})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Programming a full flash image, per command (as the driver used to) vs streamed pages.
+run with `python -m benchmarks.bench_flash`
+"""
+import os
+
+from benchmarks.loopback import LoopbackDW
+from dwire import CTRL_REG_PC, CNTXT_WRT_FLASH
+from dwire.avr import REG_X, MOVW, OUT, SPM, IN, ADIW, LDI
+
+
+def legacy_write_flash_page(dw, data, addr):
+    """
+    the previous write_flash_page: one dw_cmd per instruction
+    """
+    dw.write_registers(b'\x03\x01\x05\x40' + int.to_bytes(addr, 2, 'little'), REG_X)
+    dw._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00')
+    dw._dw_set_cntxt(CNTXT_WRT_FLASH, True)
+    dw.exec(MOVW(24, 30))
+    dw.exec(OUT(dw.dev.SPMCSR, 26))
+    dw.exec(SPM(), True)
+    dw._dw_cmd_set_baud_rate(dw.divisor)
+    dw._dw_set_cntxt(CNTXT_WRT_FLASH)
+    for i in [data[i:i + 2] for i in range(0, len(data), 2)]:
+        dw._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00')
+        dw.exec(IN(0, dw.dev.DWRD), aux=bytes([i[0]]))
+        dw.exec(IN(1, dw.dev.DWRD), aux=bytes([i[1]]))
+        dw.exec(OUT(dw.dev.SPMCSR, 27))
+        dw.exec(SPM())
+        dw.exec(ADIW(3, 2))
+    dw._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00')
+    dw.exec(MOVW(30, 24))
+    dw.exec(OUT(dw.dev.SPMCSR, 28))
+    dw.exec(SPM(), True)
+    dw._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00')
+    dw.exec(LDI(28, 0x11))
+    dw.exec(OUT(dw.dev.SPMCSR, 28))
+    dw.exec(SPM(), True)
+    dw._dw_cmd_set_baud_rate(dw.divisor)
+
+
+def program(dw, image, write_page, finish=None):
+    dw.reset_stats()
+    page_size = dw.dev.FLASH_PAGEEND
+    for addr in range(0, len(image), page_size):
+        write_page(image[addr:addr + page_size], addr)
+    if finish is not None:
+        finish()
+    return dw.round_trips, dw.modeled_time()
+
+
+def main():
+    for latency in (0.001, 0.004, 0.016):  # FT232 latency timer range (16ms is the default)
+        dw = LoopbackDW(latency=latency)
+        image = os.urandom(dw.dev.FLASH_SIZE)
+        rt_b, t_b = program(dw, image, lambda data, addr: legacy_write_flash_page(dw, data, addr))
+        rt_a, t_a = program(dw, image, lambda data, addr: dw.write_flash_page(data, addr, clear_wrt_buf=False),
+                            dw.enable_rww) # as write_firmware: one RWWSRE at the end
+        print(f"{len(image)} bytes image, {len(image) // dw.dev.FLASH_PAGEEND} pages, {latency * 1000:.0f}ms latency")
+        print(f"\tper command: {rt_b} round trips, {t_b:.2f} s modeled")
+        print(f"\tstreamed:    {rt_a} round trips, {t_a:.2f} s modeled")
+        print(f"\tspeedup x{t_b / t_a:.1f}")
+        dw._dw_cmd_set_baud_rate(16) # the line speed bounds the streamed pages at low latency
+        rt_f, t_f = program(dw, image, lambda data, addr: dw.write_flash_page(data, addr, clear_wrt_buf=False),
+                            dw.enable_rww)
+        print(f"\tstreamed at target/16 baud: {rt_f} round trips, {t_f:.2f} s modeled, x{t_b / t_f:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+gdb remote protocol codec throughput on large memory dumps, previous byte-by-byte codec vs current one.
+run with `python -m benchmarks.bench_rsp`
+"""
+import asyncio
+import os
+import time
+from binascii import hexlify
+
+from gdb.GDBUtils import escape, unescape, PacketReader
+
+
+def legacy_escape(data: bytes):
+    ret = b''
+    checksum = 0
+    for c in data:
+        if bytes([c]) in [b'#', b'$', b'}']:
+            ret += b'}' + bytes([c ^ 0x20])
+            checksum += 125 + c ^ 0x20
+        else:
+            ret += bytes([c])
+            checksum += c
+    return ret, checksum % 256
+
+
+def legacy_unescape(data: bytes):
+    ret = b''
+    escape = False
+    checksum = 0
+    data_checksum = 0
+    for c in data:
+        checksum += c
+        if bytes([c]) == b'}':
+            escape = True
+            continue
+        if escape:
+            c = c ^ 0x20
+            escape = False
+        ret += bytes([c])
+        data_checksum += c
+    return ret, checksum % 256, data_checksum % 256
+
+
+def throughput(function, data, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(data)
+    return len(data) * repeat / (time.perf_counter() - start) / 1e6
+
+
+async def read_packets(stream, count):
+    reader = asyncio.StreamReader()
+    reader.feed_data(stream)
+    reader.feed_eof()
+    packets = PacketReader(reader)
+    for _ in range(count):
+        await packets.read_packet()
+
+
+def main():
+    dumps = {
+        'hex flash dump 16KB': hexlify(os.urandom(8192)),
+        'hex erased flash 16KB': b'f' * 16384,
+        'binary X write 16KB': os.urandom(16384),
+    }
+    print(f"{'payload':<24}{'enc old MB/s':>13}{'enc new MB/s':>13}{'dec old MB/s':>13}{'dec new MB/s':>13}{'wire bytes':>11}")
+    for name, data in dumps.items():
+        encoded, _ = escape(data, rle=True)
+        assert unescape(encoded)[0] == data
+        print(f"{name:<24}{throughput(legacy_escape, data):>13.2f}{throughput(lambda d: escape(d, rle=True), data):>13.2f}"
+              f"{throughput(legacy_unescape, legacy_escape(data)[0]):>13.2f}{throughput(unescape, encoded):>13.2f}{len(encoded):>11}")
+
+    encoded, checksum = escape(hexlify(os.urandom(64)))
+    packet = b'+$' + encoded + b'#' + b'%02x' % checksum
+    count = 5000
+    start = time.perf_counter()
+    asyncio.run(read_packets(packet * count, count))
+    print(f"buffered reader: {count / (time.perf_counter() - start):.0f} packets/s ({len(packet)} bytes each)")
+
+
+if __name__ == '__main__':
+    main()
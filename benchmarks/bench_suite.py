@@ -0,0 +1,93 @@
+"""
+Driver benchmarks against the emulated ATtiny85: round trips, bytes on the wire and modeled wall time per operation.
+run with `python -m benchmarks.bench_suite [results.json] [--baseline previous.json]`, regressions against the
+baseline (more round trips or bytes, modeled time over 5% higher) make it exit with status 1.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from dwire.DWInterface import DWInterface
+from dwire.SerialDW import SerialDW
+from dwire.SerialDW.Emulator import EmulatedTransport
+from gdb.RegisterSnapshot import RegisterSnapshot
+
+LATENCY = 0.004 # s, FT232 with a lowered latency timer
+
+
+def gdb_g(dw):
+    snapshot = RegisterSnapshot(dw)
+    return snapshot.get_all()
+
+
+OPERATIONS = {
+    'read_registers(0, 32)': lambda dw, _: dw.read_registers(0, 32),
+    'read_sram(0x60, 128)': lambda dw, _: dw.read_ram(0x60, 128),
+    'write_sram(0x60, 64)': lambda dw, _: dw.write_ram(0x60, bytes(range(64))),
+    'read_eeprom(0, 64)': lambda dw, _: dw.read_eeprom(0, 64),
+    'write_eeprom(0, 16)': lambda dw, _: dw.write_eeprom(0, bytes(range(16))),
+    'write_flash_page(0)': lambda dw, _: dw.write_flash_page(0, bytes(range(64))),
+    'write_firmware(2KB)': lambda dw, path: dw.write_firmware(path),
+    'gdb g': lambda dw, _: gdb_g(dw),
+}
+
+
+def measure(operation, firmware):
+    """
+    runs an operation on a freshly connected emulated target
+    """
+    transport = EmulatedTransport(latency=LATENCY)
+    dw = DWInterface(SerialDW(transport, 8000000, True, True), shadow_dir=tempfile.mkdtemp())
+    transport.reset_stats()
+    round_trips = dw.device.round_trips
+    start = time.perf_counter()
+    operation(dw, firmware)
+    host = time.perf_counter() - start
+    return {'round_trips': dw.device.round_trips - round_trips, 'bytes': transport.bytes_on_wire,
+            'modeled_ms': round(transport.modeled_time * 1000, 3), 'host_ms': round(host * 1000, 3)}
+
+
+def regressions(results, baseline):
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['round_trips'] > before['round_trips'] or result['bytes'] > before['bytes'] \
+                or result['modeled_ms'] > before['modeled_ms'] * 1.05:
+            found.append(name)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', nargs='?', help="json file the results are saved to")
+    parser.add_argument('--baseline', help="json results of a previous run to compare with")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+        f.write(os.urandom(2048))
+    try:
+        results = {name: measure(operation, f.name) for name, operation in OPERATIONS.items()}
+    finally:
+        os.unlink(f.name)
+
+    print(f"{'operation':<24}{'round trips':>12}{'bytes':>8}{'modeled ms':>12}{'host ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<24}{r['round_trips']:>12}{r['bytes']:>8}{r['modeled_ms']:>12.2f}{r['host_ms']:>10.2f}")
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump({'latency': LATENCY, 'results': results}, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f)['results'])
+        for name in found:
+            print(f"REGRESSION: {name}")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+from dwire.FlightRecorder import FlightRecorder
+from dwire.SerialDW import SerialDW, DWTransaction
+from dwire.SerialDW.Transport import Transport
+from dwire.SerialDW.devices import devices
+
+
+class LoopbackTransport(Transport):
+    """
+    Line where every written byte is echoed back, bytes the target would send are filled with the break answer
+    pattern (0x00 0x55).
+    """
+    def __init__(self, baudrate):
+        self.baudrate = baudrate
+        self.timeout = None
+        self.is_open = True
+        self.bytes_on_wire = 0
+        self._rx = bytearray()
+
+    def write(self, data):
+        self._rx += data
+        self.bytes_on_wire += len(data)
+        return len(data)
+
+    def read(self, size=1):
+        ret = bytes(self._rx[:size])
+        del self._rx[:size]
+        missing = size - len(ret)
+        self.bytes_on_wire += missing
+        return ret + (b'\x00\x55' * missing)[:missing]
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def send_break(self, duration=0.25):
+        self._rx += b'\x00\x55'
+
+    def close(self):
+        self.is_open = False
+
+
+class LoopbackDW(SerialDW):
+    """
+    Stand-in for a SerialDW attached to a target, on a LoopbackTransport (no connection handshake).
+    Round trips and bytes are counted and a wall time is modeled from the adapter latency and the baudrate.
+    """
+    def __init__(self, target_frequency=8000000, latency=0.004, fingerprint=b'\x93\x0b'):
+        self.transport = LoopbackTransport(int(target_frequency / 128))
+        self.target_freq = target_frequency
+        self.divisor = 128
+        self.is_running = False
+        self.round_trips = 0
+        self._flash_programmer = None
+        self.flight = FlightRecorder()
+        self.latency = latency
+        self.device_fingerprint = fingerprint
+        self.dev = devices[fingerprint]
+
+    @property
+    def bytes_on_wire(self):
+        return self.transport.bytes_on_wire
+
+    def reset_stats(self):
+        self.round_trips = 0
+        self.transport.bytes_on_wire = 0
+
+    def modeled_time(self):
+        """
+        :return: seconds spent on the wire (adapter latency per round trip + 10 bit per byte)
+        """
+        return self.round_trips * self.latency + self.bytes_on_wire * 10 / (self.target_freq / self.divisor)
+
+
+class UnbatchedTransaction(DWTransaction):
+    """
+    Sends every queued command on its own, as the driver did before batching.
+    """
+    def commit(self):
+        self.results = [self.device.dw_cmd(cmd, response_length) for cmd, response_length in self.commands]
+        self.commands = []
+        return self.results
+
+
+class UnbatchedLoopbackDW(LoopbackDW):
+    def transaction(self):
+        return UnbatchedTransaction(self)
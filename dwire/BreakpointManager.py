@@ -0,0 +1,210 @@
+import logging
+
+from dwire.avr import BREAK, FLASH_INSTRUCTION
+
+log = logging.getLogger(__name__)
+
+
+class BreakpointManager:
+    """
+    Software breakpoints (BREAK written in flash) and the hardware breakpoint requested by the user.
+    Insertions and removals are only recorded: they are written to the target when it resumes, with one page
+    write per changed flash page. Inserted breakpoints stay in flash across stops, so removing and inserting
+    the same breakpoint while halted (as gdb does at each stop) costs nothing.
+    When neither the user nor the debugger needs the hw breakpoint, it serves the most volatile sw breakpoint
+    (the one hit or toggled most often): a breakpoint in the hw slot is toggled without page writes.
+    Breakpoints move between flash and the slot only when that is expected to save page writes.
+    """
+    def __init__(self, dw):
+        self.dw = dw
+        self.requested = set()  # sw breakpoint memory addresses wanted in flash
+        self.inserted = {}  # memory address -> original instruction, BREAKs currently in flash
+        self.temporary = set()  # sw breakpoints inserted by the debugger itself (run to an address)
+        self.hw = None  # instruction address of the user hw breakpoint
+        self.slot = None  # memory address of the sw breakpoint served by the hw breakpoint
+        self.committed = set()  # requested breakpoints at the last commit
+        self.hits = {}  # memory address -> times the target halted there
+        self.toggles = {}  # memory address -> times it was inserted or removed between two commits
+        self.conditions = {}  # memory address -> {source: [conditions]}, the target stops if any of each source is true
+        self.ignore_counts = {}  # memory address -> hits still to be skipped
+        self.page_writes = 0  # flash pages written for breakpoints in this session
+
+    def insert(self, address: int):
+        """
+        :param address: memory address (not instruction address)
+        """
+        self.requested.add(address)
+        self.temporary.discard(address)
+
+    def remove(self, address: int):
+        self.requested.discard(address)
+        self.temporary.discard(address)
+
+    def insert_temporary(self, address: int):
+        """
+        inserts a breakpoint for the debugger itself, removed by release_temporary
+        """
+        if address not in self.requested:
+            self.requested.add(address)
+            self.temporary.add(address)
+
+    def release_temporary(self):
+        """
+        to be called when the target halts: the temporary breakpoints are removed at the next commit
+        (unless inserted again before)
+        """
+        self.requested -= self.temporary
+        self.temporary.clear()
+
+    def insert_hw(self, address: int):
+        """
+        :param address: instruction address
+        :return: False if the hw breakpoint is already used
+        """
+        if self.hw is not None and self.hw != address:
+            return False
+        self.hw = address
+        return True
+
+    def remove_hw(self, address: int):
+        if self.hw == address:
+            self.hw = None
+
+    def hit(self, address: int):
+        """
+        to be called when the target halts at address
+        """
+        if address in self.requested:
+            self.hits[address] = self.hits.get(address, 0) + 1
+
+    def set_conditions(self, address: int, conditions, source='user'):
+        """
+        :param conditions: objects with evaluate(read, pc) and a reads list (e.g. Expression), empty to remove them
+        :param source: who set the conditions (gdb sends them again at each insertion)
+        """
+        sources = self.conditions.setdefault(address, {})
+        if conditions:
+            sources[source] = list(conditions)
+        else:
+            sources.pop(source, None)
+            if not sources:
+                self.conditions.pop(address)
+
+    def set_ignore_count(self, address: int, count: int):
+        if count > 0:
+            self.ignore_counts[address] = count
+        else:
+            self.ignore_counts.pop(address, None)
+
+    def should_stop(self, address: int, evaluate):
+        """
+        applies the ignore count and the conditions of the breakpoint at address
+        :param evaluate: callable evaluating a condition on the halted target
+        :return: False if the target has to be resumed without reporting the hit
+        """
+        if self.ignore_counts.get(address, 0) > 0:
+            self.ignore_counts[address] -= 1
+            return False
+        for conditions in self.conditions.get(address, {}).values():
+            try:
+                if not any(evaluate(c) for c in conditions):
+                    return False
+            except (ValueError, ArithmeticError, IndexError) as e:
+                log.warning("Condition of the breakpoint at %#06x failed: %s", address, e)
+        return True
+
+    def volatility(self, address: int):
+        return self.hits.get(address, 0) + self.toggles.get(address, 0)
+
+    def remove_all(self):
+        self.requested.clear()
+        self.temporary.clear()
+        self.hw = None
+
+    @property
+    def pending(self):
+        """
+        memory addresses of the breakpoints to be inserted in or removed from flash
+        """
+        return (self.requested - {self.slot}).symmetric_difference(self.inserted)
+
+    def original(self, address: int):
+        """
+        :return: the instruction the BREAK at address replaced, None if there is no BREAK in flash there
+        """
+        return self.inserted.get(address)
+
+    def overlay(self, address: int, data: bytes):
+        """
+        replaces the BREAKs in flash content read from address with the original instructions
+        """
+        data = bytearray(data)
+        for bp, instruction in self.inserted.items():
+            for i in range(2):
+                if address <= bp + i < address + len(data):
+                    data[bp + i - address] = instruction[i]
+        return bytes(data)
+
+    def _schedule(self, page_size):
+        """
+        chooses the sw breakpoint served by the hw slot. moving a breakpoint costs a page write unless its page is
+        written anyway: a swap happens when the volatility gained (expected future page writes saved) is
+        greater than the page writes it costs now.
+        """
+        if self.slot not in self.requested:
+            self.slot = None
+        dirty = {a // page_size for a in self.pending}
+        def cost_in_flash(address): # page writes to have address in flash now
+            return 0 if address in self.inserted or address // page_size in dirty else 1
+        def cost_in_slot(address): # page writes to have address in the slot now
+            return 0 if address not in self.inserted or address // page_size in dirty else 1
+
+        candidates = [a for a in self.requested if a != self.slot and cost_in_slot(a) == 0]
+        if not candidates:
+            return
+        best = max(candidates, key=lambda a: (self.volatility(a), -a))
+        if self.slot is None:
+            self.slot = best
+        elif self.volatility(best) - self.volatility(self.slot) > cost_in_flash(self.slot) - cost_in_flash(best):
+            log.debug("hw breakpoint moved from %#06x to %#06x", self.slot, best)
+            self.slot = best
+
+    def commit(self, arm_hw=True):
+        """
+        writes the pending sw breakpoints, one page at a time, and arms the hw breakpoint (the user one or the
+        sw breakpoint scheduled in the slot).
+        :param arm_hw: writes the hw breakpoint (not wanted when the caller uses it: the slot is freed)
+        :return: True if the hw breakpoint has been armed
+        """
+        page_size = self.dw.device.dev.FLASH_PAGEEND
+        for address in self.requested.symmetric_difference(self.committed):
+            self.toggles[address] = self.toggles.get(address, 0) + 1
+        self.committed = set(self.requested)
+        if not arm_hw or self.hw is not None:
+            self.slot = None
+        else:
+            self._schedule(page_size)
+
+        pending = self.pending
+        for page_idx in sorted({a // page_size for a in pending}):
+            base = page_idx * page_size
+            page = bytearray(self.dw.read_flash(base, page_size))
+            for address in sorted(a for a in pending if a // page_size == page_idx):
+                offset = address - base
+                if address not in self.inserted: # requested, not in flash yet
+                    self.inserted[address] = bytes(page[offset:offset + 2])
+                    page[offset:offset + 2] = FLASH_INSTRUCTION(BREAK())
+                else:
+                    assert page[offset:offset + 2] == FLASH_INSTRUCTION(BREAK())
+                    page[offset:offset + 2] = self.inserted.pop(address)
+            clean = not any(a // page_size == page_idx for a in self.inserted)
+            self.dw.write_flash_page(base, bytes(page), shadow=clean) # no BREAKs in the persisted shadow
+            self.page_writes += 1
+        if pending:
+            log.debug("Breakpoints committed: %d changes, %d page writes in this session", len(pending), self.page_writes)
+        if not arm_hw:
+            return False
+        if self.hw is not None or self.slot is not None:
+            self.dw.set_hw_breakpoint(self.hw if self.hw is not None else self.slot // 2)
+            return True
+        return False
@@ -1,14 +1,26 @@
+import logging
 import os
-from binascii import hexlify
-from functools import partial
+import time
+from array import array
+from functools import partial, wraps
 from math import ceil
 
 from serial import Serial
-from tqdm import tqdm
 
 from dwire import *
+from dwire.BreakpointManager import BreakpointManager
+from dwire.Firmware import FirmwareImage, load_firmware
+from dwire.FlightRecorder import DW_READ
+from dwire.FlashShadow import FlashShadow, DEFAULT_SHADOW_DIR
+from dwire.HaltContext import HaltContext
+from dwire.Trace import save_trace
+from dwire.VariableLogger import VariableLogger, resolve_variables
+from dwire.MemoryPlanner import plan_data_reads, merge_ranges, IO_BASE, REGISTER_FILE_SIZE
 from dwire.SerialDW import SerialDW #todo abstraction of this class
-from dwire.avr import REG_Z, REG_Y, REG_X, BREAK, FLASH_INSTRUCTION
+from dwire.avr import REG_Z, REG_Y, REG_X, SPL, BREAK, FLASH_INSTRUCTION
+from dwire.avr.Decoder import decode, successors, instruction_length, CALL, INDIRECT_CALL
+
+log = logging.getLogger(__name__)
 
 
 def FLASH_PAGE(pages):
@@ -19,36 +31,42 @@ def INST_ADDR(memory_address):
     return int(memory_address/2)
 
 
-def _preserve_ctrl_register(reg, function):
-    def _preserve_register(self, *args, **kwargs):
-        v = self.device._dw_read_ctrl_reg_word(reg)
-        ret = function(self, *args, **kwargs)
-        self.device._dw_wrt_ctrl_reg_word(reg, v)
-        return ret
-    return _preserve_register
-
-
-def preserve_register(reg, length=1):
-    def _preserve_register(function):
-        def __preserve_register(self, *args, **kwargs):
-            v = self.device.read_registers(reg, reg + length)
-            ret = function(self, *args, **kwargs)
-            self.device.write_registers(v, reg)
-            return ret
-        return __preserve_register
-    return _preserve_register
-
-
-def preserve_pc(function):
-    return _preserve_ctrl_register(CTRL_REG_PC, function)
-
-
-def preserve_hwbp(function):
-    return _preserve_ctrl_register(CTRL_REG_HWBP, function)
-
-
-def preserve_ir(function):
-    return _preserve_ctrl_register(CTRL_REG_IR, function)
+def clobbers(*ranges):
+    """
+    the decorated operation overwrites PC, HWBP and the given register ranges.
+    they are saved in the halt context (once per halt session) and restored before the target runs again.
+    :param ranges: (first register, count) tuples
+    """
+    registers = [r for start, length in ranges for r in range(start, start + length)]
+
+    def _clobbers(function):
+        @wraps(function)
+        def __clobbers(self, *args, **kwargs):
+            self.context.clobber(registers)
+            return function(self, *args, **kwargs)
+        return __clobbers
+    return _clobbers
+
+
+def counted(function):
+    """
+    counts calls and serial round trips of the decorated operation (nested operations included),
+    and times it if the device metrics are enabled
+    """
+    @wraps(function)
+    def _counted(self, *args, **kwargs):
+        start = self.device.round_trips
+        metrics = self.device.metrics
+        began = metrics.begin(function.__name__) if metrics is not None else None
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            stats = self.round_trip_stats.setdefault(function.__name__, [0, 0])
+            stats[0] += 1
+            stats[1] += self.device.round_trips - start
+            if metrics is not None:
+                metrics.end(function.__name__, began)
+    return _counted
 
 
 def halted(function):
@@ -67,51 +85,123 @@ def running(function):
     return _running
 
 class DWInterface:
-    def __init__(self, device: SerialDW):
+    def __init__(self, device: SerialDW, shadow_dir=DEFAULT_SHADOW_DIR):
         self.device = device
-        self.cur_pc = b'\x00\x00' #the effective value of the program counter
-        self.sw_breakpoints = {} #dict address -> instruction
+        self.context = HaltContext(device) # state clobbered by the debugger while halted
+        self.breakpoints = BreakpointManager(self)
+        self.shadow_dir = shadow_dir
+        self._flash_shadow = None
+        self._flash_shadow_checked = False # the loaded shadow has been checked against the target
+        self.flash_cache = {} # page index -> page content, what the target flash holds in this session
+        self.round_trip_stats = {} # operation -> [calls, round trips]
+        self.halted_at = time.monotonic()
+        self.break_to_resume = 0 # s, total time spent halted before resuming
+        self.resumes = 0
+        self.resume_cntxt = CNTXT_GO_INDEFINITLY # context of the last resume, used to resume skipped hits
+        self.hit_to_resume = [] # s, latency of the breakpoint hits resumed without stopping (ignore count, condition)
+        self._partial_break = b'' # first byte of a break answer read by a wait_hit that timed out
+        if not self.device.is_running:
+            self.context.reset(self.device._dw_read_ctrl_reg_word(CTRL_REG_PC))
+
+    @property
+    def cur_pc(self):
+        """
+        the program counter value read at halt (one instruction ahead of the halted instruction)
+        """
+        return self.context.pc
+
+    @cur_pc.setter
+    def cur_pc(self, value):
+        self.context.pc = value
+        self.context.pc_dirty = True
+
+    @property
+    def sw_breakpoints(self):
+        """
+        dict memory address -> original instruction of the BREAKs in flash
+        """
+        return self.breakpoints.inserted
+
+    @property
+    def flash_shadow(self):
+        """
+        host copy of the target flash. loaded from disk on first use and checked against the target
+        by reading back a few random pages.
+        """
+        return self._open_flash_shadow()
+
+    def _open_flash_shadow(self, check=True):
+        """
+        :param check: checks the loaded shadow against the target, if not done yet. not needed to only update it
+        (full writes, breakpoint pages), which then costs no read
+        """
+        if self._flash_shadow is None:
+            dev = self.device.dev
+            self._flash_shadow = FlashShadow(self.device.device_fingerprint, dev.FLASH_SIZE, dev.FLASH_PAGEEND,
+                                             self.shadow_dir, self.device.transport.port)
+            self._flash_shadow_checked = not self._flash_shadow.load()
+        if check and not self._flash_shadow_checked:
+            self._flash_shadow.verify(self._read_flash_page)
+            self._flash_shadow_checked = True
+        return self._flash_shadow
 
     def halt(self):
         """
         halt the cpu by sending a break. saves the current program counter value (effective).
         :return:
         """
+        self._partial_break = b''
         self.device._dw_cmd_break()
-        self.breaked = True
-        self.cur_pc = self.device._dw_read_ctrl_reg_word(CTRL_REG_PC)
-        print(f"MCU Break. PC={hexlify(self.cur_pc).decode()}")
+        self._on_halt(self.device._dw_read_ctrl_reg_word(CTRL_REG_PC))
+        log.debug("MCU Break. PC=%s", self.cur_pc.hex())
 
     @halted
     def reset(self):
         self.device._dw_cmd_reset()
+        self.context.reset(self.device._dw_read_ctrl_reg_word(CTRL_REG_PC), keep_hwbp=False) # registers are reset too
 
     @halted
+    @counted
     def resume_execution(self, cntxt=CNTXT_GO_INDEFINITLY, pc=None, rel=False):
         """
         Resumes code execution. the context tells how to deal with breakpoints
         (mainly CNTXT_GO_INDEFINITLY and CNTXT_GO_TO_HW_BREAKPOINT), and the pc is the address
         where to resume code execution.
+        NB the pc read at halt is one instruction ahead: the halted instruction is resumed writing pc - 1,
+        except on a BREAK in flash, where the original instruction is loaded and the pc is left past it.
         :param cntxt:
-        :param pc: is the absolute address (if bytes or positive int with rel=False) or the relative address
-        :rel: if pc is int, it will be treated as a relative increment added to the current pc stored
+        :param pc: is the absolute instruction address (if bytes or positive int with rel=False) or the relative address
+        :rel: if pc is int, it will be treated as a relative increment added to the halted instruction address
         :return:
         """
-        pc_value = pc if pc is not None else self.cur_pc
-
-        if type(pc_value) is int and (pc_value < 0 or rel):
-            pc_value = int.from_bytes(self.cur_pc, 'big') + pc
+        self.resume_cntxt = cntxt
+        if self.breakpoints.commit(arm_hw=cntxt == CNTXT_GO_INDEFINITLY):
+            cntxt = CNTXT_GO_TO_HW_BREAKPOINT
+            halted_at = self.get_instruction_address()
+            if pc is None and (self.breakpoints.slot == halted_at * 2 or self.breakpoints.hw == halted_at):
+                self.step() # the hw breakpoint would stop on the halted instruction again
+                pc = self.context.resume_pc
+        original = self.breakpoints.original(self.get_instruction_address() * 2) if pc is None else None # after the commit
+        if pc is None:
+            pc_value = self.cur_pc if original is not None else self.context.resume_pc
+        elif type(pc) is int and (pc < 0 or rel):
+            pc_value = self.get_instruction_address() + pc
+        else:
+            pc_value = pc
 
         if type(pc_value) is int:
             pc_value = int.to_bytes(pc_value, 2, 'big')
 
-        print(f"Resuming execution. PC={hexlify(pc_value).decode()}")
-        if self.halt_reason() == 'swbreak':
-            self.device.load_instruction(FLASH_INSTRUCTION(self.sw_breakpoints[(int.from_bytes(self.cur_pc, 'big')*2)-2]))
-            self.device.resume_execution(pc_value, cntxt, False, cmd=CONTINUE_WITH_LOADED_INST)
-        else:
-            self.device.resume_execution(pc_value, cntxt, False, cmd=CONTINUE)
-        self.cur_pc = pc_value
+        log.debug("Resuming execution. PC=%s", pc_value.hex())
+        with self.device.transaction() as txn:
+            self.context.commit(restore_pc=False, txn=txn) # pc is set by resume
+            if original is not None:
+                self.device.load_instruction(FLASH_INSTRUCTION(original), txn=txn)
+                self.device.resume_execution(pc_value, cntxt, False, cmd=CONTINUE_WITH_LOADED_INST, txn=txn)
+            else:
+                self.device.resume_execution(pc_value, cntxt, False, cmd=CONTINUE, txn=txn)
+        self.break_to_resume += time.monotonic() - self.halted_at
+        self.resumes += 1
 
     def restart_execution(self, resume=True, context=CNTXT_GO_INDEFINITLY):
         """
@@ -122,26 +212,90 @@ class DWInterface:
         :return:
         """
         if self.device.is_running:
-            print("Halting the MCU")
+            log.debug("Halting the MCU")
             self.device._dw_cmd_break()
 
         self.device._dw_cmd_reset()
-        self.cur_pc = self.device._dw_read_ctrl_reg_word(CTRL_REG_PC)
-        print(f"PC Reset Value={hexlify(self.cur_pc).decode()}")
+        self.context.reset(self.device._dw_read_ctrl_reg_word(CTRL_REG_PC), keep_hwbp=False)
+        log.debug("PC Reset Value=%s", self.cur_pc.hex())
         if resume:
-            print(f"Resuming execution.")
+            log.debug("Resuming execution.")
             self.device.resume_execution(None, context, False)
 
-    def step_out(self, timeout=None, wait=True):
+    @halted
+    def run_to(self, address: int):
         """
-        ?
-        :param timeout:
-        :param wait:
-        :return:
+        resumes the execution until the instruction at address is reached, using the hw breakpoint or,
+        if the user holds it, a temporary sw breakpoint (released at the next stop)
         """
-        self.resume_execution(CNTXT_STEP_OUT)
-        if wait:
-            self.wait_hit(timeout)
+        if self.breakpoints.hw is None:
+            self.set_hw_breakpoint(address)
+            self.resume_execution(CNTXT_GO_TO_HW_BREAKPOINT)
+        else:
+            self.breakpoints.insert_temporary(address * 2)
+            self.resume_execution()
+
+    @halted
+    def get_sp(self):
+        return int.from_bytes(self.read_regions([('io', SPL, 2)])[0][0], 'little')
+
+    @halted
+    def call_return_point(self):
+        """
+        :return: (return address, stack pointer the return is reached with) if the halted instruction is a call, else None
+        """
+        pc = self.get_instruction_address()
+        instruction, _ = self.decode_instruction(pc)
+        if instruction.kind not in (CALL, INDIRECT_CALL):
+            return None
+        return pc + instruction.length, self.get_sp()
+
+    @halted
+    def frame_return_point(self, frame_size=0):
+        """
+        reads the return address of the current function from the stack.
+        :param frame_size: bytes pushed on the stack since the call (0 at the function entry and right before ret)
+        :return: (return address, stack pointer the return is reached with)
+        """
+        sp = self.get_sp() + frame_size
+        return int.from_bytes(self.read_ram(sp + 1, 2), 'big'), sp + 2 # the call pushes the return address low byte first
+
+    def _run_to_return_point(self, address: int, sp: int, timeout=None):
+        while True:
+            self.run_to(address)
+            if not self.wait_hit(timeout):
+                self.halt()
+                return False
+            if self.get_instruction_address() != address:
+                return False # stopped by a breakpoint
+            if self.get_sp() >= sp:
+                return True
+            self.step() # a deeper call of the same code: leave the address before running to it again
+
+    @halted
+    @counted
+    def step_over(self, timeout=None):
+        """
+        single steps, running calls to completion: the hw breakpoint is set at the return address
+        :param timeout: seconds to wait for the call to return
+        :return: False if the call did not return (breakpoint hit or timeout)
+        """
+        point = self.call_return_point()
+        if point is None:
+            self.step()
+            return True
+        return self._run_to_return_point(*point, timeout)
+
+    @halted
+    @counted
+    def step_out(self, frame_size=0, timeout=None):
+        """
+        runs until the current function returns to its caller
+        :param frame_size: bytes pushed on the stack since the call
+        :param timeout: seconds to wait for the function to return
+        :return: False if the function did not return (breakpoint hit or timeout)
+        """
+        return self._run_to_return_point(*self.frame_return_point(frame_size), timeout)
 
     @halted
     def set_hw_breakpoint(self, address: int):
@@ -154,97 +308,301 @@ class DWInterface:
         """
         if type(address) is int:
             address = int.to_bytes(address, 2, 'big')
-        self.device._dw_wrt_ctrl_reg_word(CTRL_REG_HWBP, address)
-        print(f"Set hw-breakpoint to {hexlify(address).decode()}")
+        self.context.set_hwbp(address) # written to the target before resuming
+        log.debug("Set hw-breakpoint to %s", address.hex())
+
+    @halted
+    def decode_instruction(self, address: int):
+        """
+        decodes the instruction at address from the flash cache (sw breakpoints are seen as the original instruction)
+        :param address: instruction address
+        :return: (Instruction, list of the possible next instruction addresses, None for the unknown ones)
+        """
+        size = self.device.dev.FLASH_SIZE
+        code = bytearray(self.read_flash(address * 2, min(6, size - address * 2)).ljust(6, b'\xff'))
+        for offset in range(0, 6, 2):
+            if address * 2 + offset in self.sw_breakpoints:
+                code[offset:offset + 2] = self.sw_breakpoints[address * 2 + offset]
+        word, next_word, after = (int.from_bytes(code[i:i + 2], 'little') for i in (0, 2, 4))
+        instruction = decode(word, next_word, address, size // 2)
+        return instruction, successors(instruction, address, instruction_length(next_word if instruction.length == 1 else after))
 
     @halted
+    def range_exit(self, start: int, end: int, limit=1024):
+        """
+        follows the control flow from the halted instruction to find where the execution leaves [start, end).
+        :param start: first instruction address of the range
+        :param end: instruction address past the range
+        :param limit: max number of instructions explored
+        :return: (address, inside) of the only exit, inside being True if it is an instruction of the range that has to
+        be single stepped (unknown or many successors out of the range), False if it is the only address outside the
+        range the execution can reach. None if there is no single exit.
+        """
+        pc = self.get_instruction_address()
+        landings, leaving, seen, todo = set(), set(), set(), [pc]
+        while todo:
+            address = todo.pop()
+            if address in seen:
+                continue
+            seen.add(address)
+            if len(seen) > limit:
+                return None
+            _, next_addresses = self.decode_instruction(address)
+            for n in next_addresses:
+                if n is not None and start <= n < end:
+                    todo.append(n)
+                else:
+                    leaving.add(address)
+                    landings.add(n)
+        if len(landings) == 1 and None not in landings:
+            return landings.pop(), False
+        if len(leaving) == 1 and pc not in leaving:
+            return leaving.pop(), True
+        return None
+
+    @halted
+    def advance_in_range(self, start: int, end: int):
+        """
+        one range stepping move: resumes until the range exit with the hw breakpoint if there is a single one,
+        single steps otherwise (or if the user holds the hw breakpoint).
+        :return: the address the target is running to (to be waited for), None if it single stepped
+        """
+        exit = self.range_exit(start, end) if self.breakpoints.hw is None else None
+        if exit is None:
+            self.step()
+            return None
+        self.run_to(exit[0])
+        return exit[0]
+
+    @counted
+    def range_step(self, start: int, end: int, timeout=None):
+        """
+        steps while the halted instruction is in [start, end) (instruction addresses)
+        :param timeout: seconds to wait for each run to the range exit
+        :return: True if the range was left, False if the target stopped inside it (breakpoint or timeout)
+        """
+        while start <= self.get_instruction_address() < end:
+            target = self.advance_in_range(start, end)
+            if target is None:
+                continue
+            if not self.wait_hit(timeout):
+                self.halt()
+                return False
+            if self.get_instruction_address() != target:
+                return False
+        return True
+
     def set_sw_breakpoint(self, address: int):
         """
+        the BREAK is written in flash when the target resumes
         :param address: memory address (not instruction address)
         :return:
         """
-        page_idx = int(address / self.device.dev.FLASH_PAGEEND)
-        offset = address % self.device.dev.FLASH_PAGEEND
-        page = self.read_flash(self.device.dev.FLASH_PAGEEND * page_idx, self.device.dev.FLASH_PAGEEND)
-        instruction = page[offset:offset + 2]
-        page = page[0: offset] + FLASH_INSTRUCTION(BREAK()) + page[offset + 2:]
-        self.write_flash_page(self.device.dev.FLASH_PAGEEND * page_idx, page)
-        self.sw_breakpoints[address] = instruction
-        print(f"Breakpoint set substituting instruction {instruction}@{hex(address)}")
+        self.breakpoints.insert(address)
 
-    @halted
     def remove_sw_breakpoint(self, address: int):
         """
+        the original instruction is written back when the target resumes
         :param address: memory address (not instruction address)
         :return:
         """
-        page_idx = int(address/self.device.dev.FLASH_PAGEEND)
-        offset = address % self.device.dev.FLASH_PAGEEND
-        page = self.read_flash(self.device.dev.FLASH_PAGEEND*page_idx, self.device.dev.FLASH_PAGEEND)
-        assert page[offset:offset+2] == b'\x98\x95'
-        instruction = self.sw_breakpoints[address]
-        page = page[0: offset] + instruction + page[offset+2:]
-        self.write_flash_page(self.device.dev.FLASH_PAGEEND*page_idx, page)
-        self.sw_breakpoints.pop(address)
-        print(f"Breakpoint set substituting instruction {instruction}@{hex(address)}")
+        self.breakpoints.remove(address)
 
     @running
     def wait_hit(self, timeout=None):
         """
-        waits for a break coming from the device
-        :param timeout:
-        :return:
+        waits for a break coming from the device.
+        breakpoint hits to be skipped (ignore count, false condition) are resumed here without returning.
+        :param timeout: seconds to wait (None waits forever)
+        :return: True if the target halted, False on timeout
         """
+        deadline = None if timeout is None else time.monotonic() + timeout
         t = self.device.timeout
-        self.device.timeout = timeout
-        assert self.device.read(2) == b'\x00\x55'
-        self.device.timeout = t
-        self.device.is_running = False
-        self.cur_pc = self.device._dw_read_ctrl_reg_word(CTRL_REG_PC)
+        try:
+            while True:
+                self.device.timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                r = self._partial_break + self.device.read(2 - len(self._partial_break))
+                if not r:
+                    return False
+                if len(r) == 1:
+                    r += self.device.read(1) # the break arrived across the timeout
+                    if len(r) == 1:
+                        self._partial_break = r # not hit yet: the rest comes with the next wait
+                        return False
+                self._partial_break = b''
+                hit = time.monotonic()
+                self.device.flight.record(DW_READ, r)
+                if r != b'\x00\x55':
+                    self.device.dump_flight_record(f"unexpected data while waiting for a break: {r.hex()}")
+                    assert False, f"unexpected data while waiting for a break: {r}"
+                self.device.is_running = False
+                self._on_halt(self.device._dw_read_ctrl_reg_word(CTRL_REG_PC))
+                if self.halt_reason() not in ('swbreak', 'hwbreak') or \
+                        self.breakpoints.should_stop(self.get_instruction_address() * 2, self.evaluate_condition):
+                    return True
+                self.resume_execution(self.resume_cntxt)
+                self.hit_to_resume.append(time.monotonic() - hit)
+        finally:
+            self.device.timeout = t
+
+    @halted
+    @counted
+    def evaluate_condition(self, condition):
+        """
+        evaluates a breakpoint condition on the halted target. the regions the condition read at the previous hits
+        are fetched upfront with one planned read, the others on demand (and remembered for the next hits).
+        :param condition: object with evaluate(read, pc) and a reads list of (space, address, length)
+        :return: the condition value
+        """
+        memory = {} # (space, address) -> byte
+        def fetch(regions):
+            for (space, address, length), data in zip(regions, self.read_regions(regions)[0]):
+                for i, byte in enumerate(data):
+                    memory[(space, address + i)] = byte
+
+        def read(space, address, length):
+            if any((space, address + i) not in memory for i in range(length)):
+                condition.reads.append((space, address, length))
+                fetch([(space, address, length)])
+            return bytes(memory[(space, address + i)] for i in range(length))
+
+        if condition.reads:
+            fetch(condition.reads)
+        return condition.evaluate(read, self.get_instruction_address())
+
+    def _on_halt(self, pc: bytes):
+        """
+        starts a halt session at the pc read from the target
+        """
+        self.breakpoints.release_temporary()
+        self.context.reset(pc)
+        self.breakpoints.hit(self.get_instruction_address() * 2)
+        self.halted_at = time.monotonic()
 
     @halted
     def set_com_divisor(self, divisor: int):
         self.device._dw_cmd_set_baud_rate(2**divisor)
-        print(f"Set transmission throughput to {int(self.device.target_freq/self.device.divisor)} baud")
+        log.info("Set transmission throughput to %d baud", self.device.target_freq // self.device.divisor)
 
     @halted
     def get_fingerprint(self):
         return self.device._dw_cmd_fingerprint()
     
     @halted
+    @counted
     def step(self, times=1):
-        # TODO slow loaded instruction?
-        ret = []
-        while times > 0:
-            ret.append(self.device._dw_cmd_single_step())
-            times -= 1
-        self.cur_pc = self.device._dw_read_ctrl_reg_word(CTRL_REG_PC)
+        """
+        single steps. a BREAK in flash at the halted instruction is stepped loading the original instruction,
+        so breakpoints stay in flash.
+        """
+        original = self.breakpoints.original(self.get_instruction_address() * 2)
+        with self.device.transaction() as txn:
+            self.context.commit(restore_pc=original is None, txn=txn)
+            ret = []
+            if original is not None:
+                self.device.load_instruction(FLASH_INSTRUCTION(original), txn=txn)
+                self.device._dw_wrt_ctrl_reg_word(CTRL_REG_PC, self.cur_pc, txn=txn) # past the loaded instruction
+                ret.append(self.device._dw_cmd_single_step_slow(txn=txn))
+                times -= 1
+            ret += [self.device._dw_cmd_single_step(txn=txn) for _ in range(times)]
+            pc = self.device._dw_read_ctrl_reg_word(CTRL_REG_PC, txn=txn)
+        self.context.reset(txn.results[pc])
+        ret = [txn.results[i] for i in ret]
         return ret[0] if len(ret) == 1 else ret
 
+    def _plan_steps(self, pc, limit, stop=None):
+        """
+        predicts the instructions executed by single stepping from pc, as long as the control flow is known
+        (sequential instructions, jumps, calls), up to a BREAK in flash or an address accepted by stop.
+        :return: (list of the addresses executed, predicted address after them or None if unknown)
+        """
+        planned = []
+        while len(planned) < limit:
+            if planned and pc * 2 in self.sw_breakpoints:
+                break # stepped alone, loading the original instruction
+            planned.append(pc)
+            _, next_addresses = self.decode_instruction(pc)
+            if len(next_addresses) != 1 or next_addresses[0] is None:
+                return planned, None
+            pc = next_addresses[0]
+            if stop is not None and stop(pc):
+                break
+        return planned, pc
+
+    @halted
+    @counted
+    def trace(self, steps: int, stop=None, path=None, batch=64):
+        """
+        single steps recording the address of each executed instruction.
+        the control flow is followed on the host with the instruction decoder: steps are sent in batches and the pc
+        is read once per batch, a batch ending after a branch, skip, return or indirect jump (or after batch steps).
+        cost: one round trip per batch, 2 bytes on the wire per step (0x31 and its echo) plus 4 per pc read,
+        e.g. ~0.35ms per step at 62500 baud with 64 step batches, plus the adapter latency per batch.
+        the trace takes 2 bytes per step: 100k steps are 200KB.
+        :param stop: predicate on the instruction address, the trace stops before executing an instruction it accepts
+        :param path: file the trace is written to (see dwire.Trace, it can be memory mapped with load_trace)
+        :param batch: max steps per round trip
+        :return: array('H') of the executed instruction addresses
+        """
+        trace = array('H')
+        mispredicted = 0
+        pc = self.get_instruction_address()
+        while len(trace) < steps:
+            planned, predicted = self._plan_steps(pc, min(batch, steps - len(trace)), stop)
+            self.step(len(planned))
+            trace.extend(planned)
+            pc = self.get_instruction_address()
+            if predicted is not None and pc != predicted:
+                mispredicted += 1 # an interrupt or a BREAK in flash
+            if stop is not None and stop(pc):
+                break
+        if mispredicted:
+            log.warning("Trace: %d batches did not end where predicted, their trace may be inaccurate", mispredicted)
+        if path is not None:
+            save_trace(path, trace)
+        return trace
+
+    @running
+    def log_variables(self, variables, rate=50, duration=None, samples=None, path=None, binary=False, symbols=None):
+        """
+        samples variables of the running target, halting it for one planned read per sample
+        :param variables: data symbol names, data space addresses or (space, address, length) regions
+        :param symbols: data symbols the names are resolved in (SymbolTable.load(elf or map, data=True))
+        :param path: csv (or binary) file the samples are streamed to by a background thread
+        :return: the VariableLogger, with the samples left in its ring if path is None
+        """
+        logger = VariableLogger(self, resolve_variables(variables, symbols), rate)
+        logger.run(duration, samples, path, binary)
+        if log.isEnabledFor(logging.INFO):
+            log.info("%s", logger.report())
+        return logger
+
     @halted
-    @preserve_pc
-    @preserve_hwbp
+    @counted
+    @clobbers()
     def read_registers(self, register: int, length=1):
-        return self.device.read_registers(register, register+length)
+        if all(r in self.context.registers for r in range(register, register + length)):
+            return self.context.overlay(register, bytes(length))
+        return self.context.overlay(register, self.device.read_registers(register, register+length))
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
+    @counted
+    @clobbers()
     def write_register(self, register: int, data: bytes, length=None):
+        self.context.update(register, data[:length] if length is not None else data)
         return self.device.write_registers(data, register, length)
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
-    @preserve_register(REG_Z, 2)
+    @counted
+    @clobbers((REG_Z, 2))
     def read_ram(self, address: int, len: int):
-        return self.device.read_sram(address, len)
+        return self.context.overlay(address, self.device.read_sram(address, len))
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
-    @preserve_register(REG_Z, 2)
+    @counted
+    @clobbers((REG_Z, 2))
     def write_ram(self, address: int, data: bytes, length=None):
+        self.context.update(address, data[:length] if length is not None else data)
         self.device.write_sram(data, address, length)
 
     def read_io_space(self, address: int, len: int):
@@ -260,101 +618,293 @@ class DWInterface:
         return self.write_ram(address + 0x60, data, len)
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
-    @preserve_register(REG_Y, 4)
-    @preserve_register(0)
+    @counted
+    def read_regions(self, regions, max_gap=8):
+        """
+        reads many memory regions with the minimum number of read cycles.
+        data space regions are merged, split at the cycle size limit and routed around DWDR, which is not readable
+        (r30/r31, used as the read pointer, come from the register context).
+        :param regions: list of (space, address, length), space being 'reg', 'io', 'sram' (address relative to
+        the space start, as read_io_space and read_sram), 'data' (absolute data space address), 'eeprom' or 'flash'
+        :param max_gap: data ranges closer than this are read with one cycle
+        :return: (list with the content of each region, list of (space, address) of the unreadable bytes, read as 0)
+        """
+        dev = self.device.dev
+        bases = {'reg': 0, 'data': 0, 'io': IO_BASE, 'sram': dev.SRAM_BASE}
+        dwdr = IO_BASE + dev.DWRD
+
+        data_ranges = [(bases[space] + addr, bases[space] + addr + length) for space, addr, length in regions if space in bases]
+        plan = plan_data_reads(data_ranges, forbidden=(dwdr,), max_gap=max_gap)
+        memory = bytearray(dev.SRAM_BASE + dev.SRAM_SIZE)
+        if plan:
+            self.context.clobber()
+            # Z, the sram read pointer, is saved from a register cycle of this same plan if there is one
+            z_from_cycle = REG_Z not in self.context.registers and any(kind == 'reg' and start <= REG_Z and end >= REG_Z + 2 for kind, start, end in plan)
+            if any(kind == 'sram' for kind, _, _ in plan) and not z_from_cycle:
+                self.context.clobber([REG_Z, REG_Z + 1])
+            with self.device.transaction() as txn:
+                cycles = [(start, self.device.read_registers(start, end, txn=txn) if kind == 'reg'
+                           else self.device.read_mem(start, end - start, SerialDW.TRGT_SRAM_R, txn=txn))
+                          for kind, start, end in plan]
+            for start, idx in cycles:
+                memory[start:start + len(txn.results[idx])] = txn.results[idx]
+            if z_from_cycle and any(kind == 'sram' for kind, _, _ in plan):
+                self.context.save(REG_Z, memory[REG_Z:REG_Z + 2])
+            memory[0:REGISTER_FILE_SIZE] = self.context.overlay(0, memory[0:REGISTER_FILE_SIZE])
+
+        eeprom = {}
+        for start, end in merge_ranges([(addr, addr + length) for space, addr, length in regions if space == 'eeprom']):
+            eeprom[start] = self.read_eeprom(start, end - start)
+
+        results = []
+        unavailable = []
+        for space, addr, length in regions:
+            if space in bases:
+                start = bases[space] + addr
+                results.append(bytes(memory[start:start + length]))
+                if start <= dwdr < start + length:
+                    unavailable.append((space, dwdr - bases[space]))
+            elif space == 'eeprom':
+                block = next(b for b in eeprom if b <= addr < b + len(eeprom[b]))
+                results.append(eeprom[block][addr - block:addr - block + length])
+            elif space == 'flash':
+                results.append(self.read_flash(addr, length))
+            else:
+                raise ValueError(f"Unknown memory space {space}")
+        return results, unavailable
+
+    @halted
+    @counted
+    @clobbers((REG_Y, 4), (0, 1))
     def read_eeprom(self, address: int, len: int):
         return self.device.read_eeprom(address, len)
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
-    @preserve_register(REG_X, 6)
-    @preserve_register(0)
+    @counted
+    @clobbers((REG_X, 6), (0, 1))
     def write_eeprom(self, address: int, data: bytes, length=None):
         return self.device.write_eeprom(data, address, length)
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
-    @preserve_register(REG_Z, 2)
+    @counted
+    @clobbers((REG_Z, 2))
+    def _read_flash_page(self, page_idx):
+        """
+        reads a page from the target (bypassing the cache) and caches it
+        """
+        page_size = self.device.dev.FLASH_PAGEEND
+        page = self.device.read_flash(page_idx * page_size, page_size)
+        self.flash_cache[page_idx] = page
+        return page
+
+    @halted
+    @counted
     def read_flash(self, address: int, len = None):
+        """
+        reads flash through the page cache: only the pages never read or written in this session are fetched
+        """
+        page_size = self.device.dev.FLASH_PAGEEND
         if len is None:
-            len = self.device.dev.FLASH_PAGEEND
-        return self.device.read_flash(address, len)
+            len = page_size
+        first, last = address // page_size, (address + len - 1) // page_size
+        data = b''.join(self.flash_cache[i] if i in self.flash_cache else self._read_flash_page(i) for i in range(first, last + 1))
+        offset = address - first * page_size
+        return data[offset:offset + len]
+
+    def invalidate_flash_cache(self):
+        """
+        to be called if the flash has been changed by someone else (e.g. an isp programmer)
+        """
+        self.flash_cache.clear()
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
-    @preserve_register(24, 8)
-    @preserve_register(0, 2)
-    def write_flash_page(self, address, data, progress=True):
+    @counted
+    @clobbers((24, 8), (0, 2))
+    def write_flash_page(self, address, data, shadow=True):
+        """
+        :param shadow: the page is firmware content, kept in the flash shadow. pages patched with breakpoints are
+        only cached: the shadow forgets them
+        """
         assert len(data) == self.device.dev.FLASH_PAGEEND
-        self.device.write_flash_page(data, address, progress=progress)
+        self.device.write_flash_page(data, address)
+        if shadow:
+            self._open_flash_shadow(check=False).update(address // self.device.dev.FLASH_PAGEEND, data)
+        else:
+            self._open_flash_shadow(check=False).forget(address // self.device.dev.FLASH_PAGEEND)
+        self.flash_cache[address // self.device.dev.FLASH_PAGEEND] = bytes(data)
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
-    @preserve_register(24, 8)
-    @preserve_register(0, 2)
+    @counted
+    @clobbers((24, 8), (0, 2))
     def clear_flash_page(self, address):
         self.device.clear_flash_page(address)
+        self._open_flash_shadow(check=False).update(address // self.device.dev.FLASH_PAGEEND,
+                                                    b'\xff' * self.device.dev.FLASH_PAGEEND)
+        self.flash_cache[address // self.device.dev.FLASH_PAGEEND] = b'\xff' * self.device.dev.FLASH_PAGEEND
 
     def close(self):
-        for k in list(self.sw_breakpoints.keys()):
-            self.remove_sw_breakpoint(k)
+        """
+        removes the breakpoints and restores the state clobbered by the debugger. a running target with breakpoints
+        is halted for that, then resumed
+        """
+        running = self.device.is_running
+        bp = self.breakpoints
+        if running and (bp.inserted or bp.hw is not None or bp.slot is not None):
+            log.info("Halting the target to remove the breakpoints")
+            self.halt()
+        bp.remove_all()
+        if not self.device.is_running:
+            bp.commit()
+        if log.isEnabledFor(logging.INFO):
+            log.info("%s", self.session_report())
+        if self._flash_shadow is not None:
+            self._flash_shadow.save()
+        if running and not self.device.is_running:
+            self.resume_execution() # writes back the clobbered state
+        elif not self.device.is_running:
+            self.context.commit()
         self.device.close()
 
+    def session_report(self):
+        """
+        :return: flash page writes caused by breakpoints and time spent halted before resuming
+        """
+        average = self.break_to_resume / self.resumes * 1000 if self.resumes else 0
+        report = (f"{self.breakpoints.page_writes} flash pages written for breakpoints, {self.resumes} resumes, "
+                  f"{self.break_to_resume:.3f}s break to resume ({average:.1f}ms average)")
+        if self.hit_to_resume:
+            report += (f", {len(self.hit_to_resume)} hits skipped by conditions or ignore counts "
+                       f"({sum(self.hit_to_resume) / len(self.hit_to_resume) * 1000:.1f}ms average hit to resume)")
+        return report
+
     def status(self):
         return self.device.is_running
 
     @halted
     def get_pc(self):
-        return int.from_bytes(self.device._dw_read_ctrl_reg_word(CTRL_REG_PC), 'big')
+        return int.from_bytes(self.cur_pc, 'big')
+
+    @halted
+    def get_instruction_address(self):
+        """
+        :return: the address of the halted instruction
+        """
+        return self.get_pc() - 1
 
     @halted
     def halt_reason(self):
         if (int.from_bytes(self.cur_pc, 'big')*2)-2 in self.sw_breakpoints:
             return "swbreak"
-        if int.from_bytes(self.device._dw_read_ctrl_reg_word(CTRL_REG_HWBP), 'big') == int.from_bytes(self.cur_pc, 'big') - 1:
+        if self.breakpoints.slot is not None and self.breakpoints.slot == (int.from_bytes(self.cur_pc, 'big')*2)-2:
+            return "swbreak" # sw breakpoint served by the hw breakpoint
+        if self.breakpoints.hw is not None and self.breakpoints.hw == int.from_bytes(self.cur_pc, 'big') - 1:
             #pc increments one more
             return "hwbreak"
         return "S05"
 
     @halted
-    @preserve_pc
-    @preserve_hwbp
-    @preserve_register(24, 8)
-    @preserve_register(0, 2)
-    def write_firmware(self, file, verify=True, erease_device=False, debug=False):
-        firmware_pages = []
-        with open(file, 'rb') as fw:
-            while True:
-                page = fw.read(self.device.dev.FLASH_PAGEEND)
-                if not page:
-                    break
-                page = page + bytes([0xff] * (self.device.dev.FLASH_PAGEEND - len(page)))
-                firmware_pages.append(page)
-
+    @counted
+    @clobbers((24, 8), (0, 2))
+    def write_firmware(self, file, verify=True, erease_device=False, debug=False, incremental=False, preload_cache=False,
+                       progress=None, check_shadow=False):
+        """
+        programs an ELF, Intel HEX or raw binary (from address 0) image. only the pages holding data are written,
+        the eeprom content of the image is written to the eeprom.
+        :param file: firmware path or FirmwareImage (see dwire.Firmware.load_firmware)
+        :param verify: reads back the written pages
+        :param erease_device: erases the pages not covered by the image
+        :param incremental: writes only the pages that differ from the flash shadow (checked against the target on a
+        few sampled pages when loaded)
+        :param preload_cache: fills the flash cache with the whole image (pages skipped by incremental included)
+        :param progress: callable(stage, done, total) called as pages (eeprom segments) are done, stage being
+        'write', 'erase', 'verify' or 'eeprom' (e.g. dwire.Progress.ConsoleProgress())
+        :param check_shadow: reads back the pages skipped by incremental too, and writes the ones that differ from
+        the shadow (flash changed by someone else, e.g. with an isp programmer)
+        :return: dict with the number of written, skipped and erased pages, the bytes saved and the eeprom bytes written
+        """
+        page_size = self.device.dev.FLASH_PAGEEND
+        image = file if isinstance(file, FirmwareImage) else load_firmware(file, page_size)
+        assert image.page_size == page_size
+        firmware_pages = {idx: bytes(page) for idx, page in image.pages.items()}
+        if progress is None:
+            progress = lambda stage, done, total: None
+
+        # without incremental the shadow is only kept up to date: no need to read back pages to check the saved one
+        shadow = self._open_flash_shadow(check=incremental)
+        written = []
+        skipped = []
+        for done, idx in enumerate(sorted(firmware_pages), 1):
+            page = firmware_pages[idx]
+            if incremental and shadow.page(idx) == page:
+                skipped.append(idx)
+            else:
+                if debug:
+                    log.info("Writing addr=%d\t\tdata=%s", idx * page_size, page)
+                self.device.write_flash_page(page, idx * page_size, clear_wrt_buf=False) # RWWSRE once, below
+                shadow.update(idx, page)
+                self.flash_cache.pop(idx, None)
+                written.append(idx)
+            progress('write', done, len(firmware_pages))
+
+        erased = 0
+        blank = b'\xff' * page_size
+        skipped_blank = []
         if erease_device:
-            print("Clearing device")
-            for i in tqdm(range(0, int(self.device.dev.FLASH_SIZE), self.device.dev.FLASH_PAGEEND)):
-                self.device.clear_flash_page(i)
-
-        addr = 0x00
-        for i in firmware_pages:
-            if debug:
-                print(f"Writing addr={addr}\t\tdata={i}")
-            print(f"page {int(addr/64)+1}/{len(firmware_pages)}", end='')
-            self.device.write_flash_page(i, addr, progress=True)
-            addr += self.device.dev.FLASH_PAGEEND
-
-        if verify:
-            addr = 0
-            print("Verifying...")
-            for i in tqdm(firmware_pages):
-                page = self.read_flash(addr)
-                addr += self.device.dev.FLASH_PAGEEND
-                assert i == page
-
+            uncovered = [idx for idx in range(shadow.pages) if idx not in firmware_pages]
+            for done, idx in enumerate(uncovered, 1):
+                if not incremental or shadow.page(idx) != blank:
+                    self.device.clear_flash_page(idx * page_size)
+                    shadow.update(idx, blank)
+                    self.flash_cache[idx] = blank
+                    erased += 1
+                else:
+                    skipped_blank.append(idx)
+                progress('erase', done, len(uncovered))
+        if written or erased:
+            self.device.enable_rww()
+
+        if verify or check_shadow:
+            expected = dict(firmware_pages)
+            expected.update((idx, blank) for idx in skipped_blank)
+            checks = (skipped + skipped_blank if check_shadow else []) + (written if verify else [])
+            stale = []
+            for done, idx in enumerate(checks, 1):
+                if self._read_flash_page(idx) != expected[idx]:
+                    if idx in written:
+                        self.flash_cache.pop(idx)
+                        shadow.forget(idx)
+                        shadow.save()
+                        assert False, f"verification failed on page {idx}"
+                    stale.append(idx)
+                progress('verify', done, len(checks))
+            if stale:
+                log.warning("%d pages differ from the flash shadow, writing them", len(stale))
+                for idx in stale:
+                    if expected[idx] == blank:
+                        self.device.clear_flash_page(idx * page_size)
+                        erased += 1
+                    else:
+                        self.device.write_flash_page(expected[idx], idx * page_size)
+                        written.append(idx)
+                        skipped.remove(idx)
+                    shadow.update(idx, expected[idx])
+                    if self._read_flash_page(idx) != expected[idx]:
+                        self.flash_cache.pop(idx)
+                        shadow.forget(idx)
+                        shadow.save()
+                        assert False, f"verification failed on page {idx}"
+
+        for idx in written if not preload_cache else firmware_pages:
+            self.flash_cache[idx] = firmware_pages[idx]
+
+        eeprom = 0
+        for done, (address, data) in enumerate(image.eeprom, 1):
+            eeprom += self.write_eeprom(address, data)
+            if verify:
+                assert self.read_eeprom(address, len(data)) == data, f"eeprom verification failed at {address:#x}"
+            progress('eeprom', done, len(image.eeprom))
+
+        shadow.save()
+        return {'written': len(written), 'skipped': len(skipped), 'erased': erased,
+                'bytes_saved': len(skipped) * page_size,
+                'eeprom': eeprom}
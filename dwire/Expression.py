@@ -0,0 +1,94 @@
+import ast
+import operator
+
+from dwire.avr import SPL
+
+SREG = 0x3F # io address
+
+_binary = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.FloorDiv: operator.floordiv,
+           ast.Div: operator.floordiv, ast.Mod: operator.mod, ast.LShift: operator.lshift, ast.RShift: operator.rshift,
+           ast.BitAnd: operator.and_, ast.BitOr: operator.or_, ast.BitXor: operator.xor}
+_compare = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+            ast.Gt: operator.gt, ast.GtE: operator.ge}
+_unary = {ast.Not: operator.not_, ast.USub: operator.neg, ast.Invert: operator.invert}
+_memory = {'mem': 1, 'mem16': 2, 'mem32': 4}
+
+
+class Expression:
+    """
+    Breakpoint condition in a small python-like language, evaluated on the host when the target halts:
+    r0-r31, sreg, sp, pc (instruction address), mem[a], mem16[a], mem32[a] (little endian, data space address a),
+    integer literals, arithmetic, bitwise, comparison and boolean operators.
+    e.g. "r24 == 3 and mem16[0x100] > 1000"
+    """
+    def __init__(self, source: str):
+        self.source = source
+        self.tree = ast.parse(source, mode='eval').body
+        self.reads = [] # (space, address, length) regions the condition reads, fetched upfront at each hit
+        for node in ast.walk(self.tree):
+            self._check(node)
+            region = self._static_region(node)
+            if region is not None and region not in self.reads:
+                self.reads.append(region)
+
+    def __repr__(self):
+        return self.source
+
+    @staticmethod
+    def _check(node):
+        allowed = (ast.BinOp, ast.BoolOp, ast.Compare, ast.UnaryOp, ast.Constant, ast.Name, ast.Subscript, ast.Load,
+                   ast.And, ast.Or, *_binary, *_compare, *_unary)
+        if not isinstance(node, allowed):
+            raise ValueError(f"Unsupported expression element {type(node).__name__}")
+        if isinstance(node, ast.Constant) and type(node.value) is not int:
+            raise ValueError(f"Unsupported constant {node.value!r}")
+        if isinstance(node, ast.Subscript) and (not isinstance(node.value, ast.Name) or node.value.id not in _memory):
+            raise ValueError("Memory is read with mem[], mem16[] or mem32[]")
+
+    @staticmethod
+    def _register(name):
+        if name == 'sreg':
+            return 'io', SREG, 1
+        if name == 'sp':
+            return 'io', SPL, 2
+        if name[0] == 'r' and name[1:].isdigit() and int(name[1:]) < 32:
+            return 'reg', int(name[1:]), 1
+        raise ValueError(f"Unknown register {name}")
+
+    def _static_region(self, node):
+        if isinstance(node, ast.Name) and node.id not in _memory and node.id != 'pc':
+            return self._register(node.id)
+        if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant):
+            return 'data', node.slice.value, _memory[node.value.id]
+        return None
+
+    def evaluate(self, read, pc):
+        """
+        :param read: callable (space, address, length) -> bytes reading the halted target
+        :param pc: address of the halted instruction
+        :return: the expression value
+        """
+        def value(node):
+            if isinstance(node, ast.Constant):
+                return node.value
+            if isinstance(node, ast.Name):
+                if node.id == 'pc':
+                    return pc
+                return int.from_bytes(read(*self._register(node.id)), 'little')
+            if isinstance(node, ast.Subscript):
+                return int.from_bytes(read('data', value(node.slice), _memory[node.value.id]), 'little')
+            if isinstance(node, ast.BinOp):
+                return _binary[type(node.op)](value(node.left), value(node.right))
+            if isinstance(node, ast.UnaryOp):
+                return int(_unary[type(node.op)](value(node.operand)))
+            if isinstance(node, ast.BoolOp):
+                values = (value(v) for v in node.values)
+                return int(all(values) if isinstance(node.op, ast.And) else any(values))
+            left = value(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = value(comparator)
+                if not _compare[type(op)](left, right):
+                    return 0
+                left = right
+            return 1
+        return value(self.tree)
@@ -0,0 +1,114 @@
+import logging
+import mmap
+import os
+import struct
+from binascii import unhexlify
+
+from dwire.Symbols import ELF_MAGIC, DATA_BASE, EEPROM_BASE, _elf_header
+
+_elf_program = struct.Struct('<IIIIIIII')
+PT_LOAD = 1
+EEPROM_END = 0x820000 # .fuse, .lock and .signature follow (0x820000, 0x830000, 0x840000)
+
+log = logging.getLogger(__name__)
+
+# intel hex record types
+HEX_DATA, HEX_EOF, HEX_SEGMENT, HEX_START_SEGMENT, HEX_LINEAR, HEX_START_LINEAR = range(6)
+
+
+class FirmwareImage:
+    """
+    Sparse flash image (page index -> page content, only the pages holding data) and the eeprom content to program.
+    Bytes of a page not covered by the image are 0xff (erased flash).
+    """
+    def __init__(self, page_size):
+        self.page_size = page_size
+        self.pages = {}
+        self.eeprom = [] # (address, data)
+
+    def add(self, address, data):
+        """
+        :param address: avr-gcc address: flash from 0, eeprom from 0x810000 (data space contents are ignored,
+        fuse, lock and signature sections are skipped: debugWIRE cannot program them)
+        """
+        if address >= EEPROM_END:
+            log.warning("Skipping %d bytes at %#x: fuse, lock and signature sections are not programmed", len(data), address)
+            return
+        if address >= EEPROM_BASE:
+            self.eeprom.append((address - EEPROM_BASE, bytes(data)))
+            return
+        if address >= DATA_BASE:
+            return
+        offset = 0
+        while offset < len(data):
+            idx, start = divmod(address + offset, self.page_size)
+            length = min(self.page_size - start, len(data) - offset)
+            page = self.pages.get(idx)
+            if page is None:
+                page = self.pages[idx] = bytearray(b'\xff' * self.page_size)
+            page[start:start + length] = data[offset:offset + length]
+            offset += length
+
+    @property
+    def size(self):
+        """
+        flash bytes up to the end of the last page
+        """
+        return (max(self.pages) + 1) * self.page_size if self.pages else 0
+
+
+def _load_elf(image, data):
+    header = _elf_header.unpack_from(data)
+    if header[0][4] != 1 or header[0][5] != 1:
+        raise ValueError("not a 32 bit little endian ELF file")
+    phoff, phentsize, phnum = header[5], header[9], header[10]
+    for i in range(phnum):
+        p_type, offset, _, paddr, filesz, _, _, _ = _elf_program.unpack_from(data, phoff + i * phentsize)
+        if p_type == PT_LOAD and filesz:
+            image.add(paddr, data[offset:offset + filesz]) # load address: .data initializers are in flash
+
+
+def _load_hex(image, data):
+    base = 0
+    for number, line in enumerate(iter(data.readline, b''), 1):
+        line = line.strip()
+        if not line:
+            continue
+        record = unhexlify(line[1:])
+        if line[:1] != b':' or len(record) != record[0] + 5 or sum(record) & 0xFF:
+            raise ValueError(f"bad intel hex record at line {number}")
+        length, address, kind = record[0], int.from_bytes(record[1:3], 'big'), record[3]
+        payload = record[4:4 + length]
+        if kind == HEX_DATA:
+            image.add(base + address, payload)
+        elif kind == HEX_EOF:
+            break
+        elif kind == HEX_SEGMENT:
+            base = int.from_bytes(payload, 'big') << 4
+        elif kind == HEX_LINEAR:
+            base = int.from_bytes(payload, 'big') << 16
+
+
+def load_firmware(path, page_size):
+    """
+    reads an ELF (PT_LOAD segments), Intel HEX or raw binary (from address 0) firmware.
+    the file is memory mapped, only the data of the segments is copied into the pages.
+    the eeprom contents (ELF .eeprom segment or hex records from 0x810000) are kept apart.
+    :return: FirmwareImage
+    """
+    if os.path.getsize(path) == 0:
+        raise ValueError(f"{path} is empty")
+    image = FirmwareImage(page_size)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        view = memoryview(data)
+        try:
+            if data[:4] == ELF_MAGIC:
+                _load_elf(image, view)
+            elif data[:1] == b':':
+                _load_hex(image, data)
+            else:
+                for address in range(0, len(data), page_size):
+                    image.add(address, view[address:address + page_size])
+        finally:
+            view.release()
+    return image
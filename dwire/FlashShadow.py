@@ -0,0 +1,83 @@
+import os
+import random
+import re
+from binascii import hexlify
+
+DEFAULT_SHADOW_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dwire")
+
+
+class FlashShadow:
+    """
+    Host side copy of the target flash memory, persisted on disk per device fingerprint and adapter (boards of the
+    same device are told apart by the port they are plugged in).
+    Each page is either known (same content as the target flash) or unknown.
+    The file holds the flash image followed by one "known" flag byte per page.
+    """
+    def __init__(self, fingerprint: bytes, flash_size: int, page_size: int, directory=DEFAULT_SHADOW_DIR, adapter=None):
+        self.fingerprint = fingerprint
+        self.page_size = page_size
+        self.pages = flash_size // page_size
+        name = hexlify(fingerprint).decode()
+        if adapter:
+            name += '-' + re.sub(r'\W', '_', str(adapter))
+        self.path = os.path.join(directory, f"{name}.flash")
+        self.image = bytearray(b'\xff' * flash_size)
+        self.known = bytearray(self.pages)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        if len(content) != len(self.image) + self.pages:
+            return False
+        self.image[:] = content[:len(self.image)]
+        self.known[:] = content[len(self.image):]
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary = self.path + '.tmp' # an interrupted save leaves the previous shadow in place
+        with open(temporary, 'wb') as f:
+            f.write(self.image)
+            f.write(self.known)
+        os.replace(temporary, self.path)
+
+    def invalidate(self):
+        self.known[:] = bytes(self.pages)
+
+    def is_known(self, page_idx):
+        return bool(self.known[page_idx])
+
+    def page(self, page_idx):
+        """
+        :return: the page content, None if unknown
+        """
+        if not self.known[page_idx]:
+            return None
+        return bytes(self.image[page_idx * self.page_size:(page_idx + 1) * self.page_size])
+
+    def update(self, page_idx, data):
+        assert len(data) == self.page_size
+        self.image[page_idx * self.page_size:(page_idx + 1) * self.page_size] = data
+        self.known[page_idx] = 1
+
+    def forget(self, page_idx):
+        self.known[page_idx] = 0
+
+    def verify(self, read_page, samples=4):
+        """
+        compares a random sample of known pages with the target. on mismatch the whole shadow is invalidated.
+        the sample is seeded from the fingerprint and the shadow content: the same shadow reads the same pages
+        (a recorded session replays)
+        :param read_page: callable(page_idx) -> page content read from the target
+        :param samples: number of pages to check
+        :return: True if the shadow matches the target
+        """
+        known = [i for i in range(self.pages) if self.known[i]]
+        sampler = random.Random(self.fingerprint + bytes(self.image) + bytes(self.known))
+        for page_idx in sampler.sample(known, min(samples, len(known))):
+            if read_page(page_idx) != self.page(page_idx):
+                self.invalidate()
+                return False
+        return True
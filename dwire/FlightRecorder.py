@@ -0,0 +1,85 @@
+import struct
+import time
+from itertools import count
+
+FLIGHT_MAGIC = b'DWFR'
+# perf_counter time, kind, length of the whole payload, first bytes of the payload
+PAYLOAD_SIZE = 40
+SLOT = struct.Struct(f'<dBH{PAYLOAD_SIZE}s')
+
+DW_WRITE, DW_READ, DW_BREAK, DW_ERROR, GDB_RECV, GDB_SEND, NOTE = range(1, 8)
+KIND_NAMES = {DW_WRITE: 'dw write', DW_READ: 'dw read', DW_BREAK: 'dw break', DW_ERROR: 'dw error',
+              GDB_RECV: 'gdb recv', GDB_SEND: 'gdb send', NOTE: 'note'}
+
+
+class FlightRecorder:
+    """
+    Always-on ring buffer of the last protocol events (commands sent to the target and their answers, breaks,
+    gdb packets), kept as fixed size binary slots in a preallocated buffer: recording is a single struct.pack_into,
+    with no formatting. Dumped for post-mortem when a command fails or the gdb session raises.
+    """
+    def __init__(self, capacity=512):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * SLOT.size)
+        self.recorded = 0 # events recorded since the start (the last capacity ones are kept)
+        self._slots = count() # atomic slot allocation across threads
+
+    def record(self, kind, payload=b''):
+        slot = next(self._slots)
+        SLOT.pack_into(self.buffer, slot % self.capacity * SLOT.size, time.perf_counter(), kind,
+                       min(len(payload), 0xFFFF), payload[:PAYLOAD_SIZE])
+        self.recorded = slot + 1
+
+    def events(self):
+        """
+        :return: list of (time, kind, length, payload) of the kept events, oldest first.
+        payloads longer than PAYLOAD_SIZE are truncated, length is the original one
+        """
+        first = max(0, self.recorded - self.capacity)
+        events = []
+        for slot in range(first, self.recorded):
+            when, kind, length, payload = SLOT.unpack_from(self.buffer, slot % self.capacity * SLOT.size)
+            events.append((when, kind, length, payload[:min(length, PAYLOAD_SIZE)]))
+        return events
+
+    def format(self, last=None):
+        """
+        :param last: number of events to format (all the kept ones if None)
+        :return: the events as text, times relative to the last event
+        """
+        events = self.events()
+        if last is not None:
+            events = events[-last:] if last > 0 else []
+        if not events:
+            return "(no events)"
+        end = events[-1][0]
+        lines = []
+        for when, kind, length, payload in events:
+            truncated = '...' if length > len(payload) else ''
+            lines.append(f"{(when - end) * 1000:>10.3f}ms {KIND_NAMES.get(kind, kind):<9}{length:>6} "
+                         f"{payload.hex()}{truncated}")
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        """
+        writes the kept events (oldest first) to a binary file, see load_flight_record
+        """
+        with open(path, 'wb') as f:
+            f.write(FLIGHT_MAGIC + struct.pack('<HI', PAYLOAD_SIZE, self.recorded))
+            for event in self.events():
+                f.write(SLOT.pack(*event))
+
+
+def load_flight_record(path):
+    """
+    :return: list of (time, kind, length, payload) from a FlightRecorder dump
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != FLIGHT_MAGIC or struct.unpack_from('<H', data, 4)[0] != PAYLOAD_SIZE:
+        raise ValueError(f"{path} is not a flight record")
+    events = []
+    for offset in range(10, len(data) - SLOT.size + 1, SLOT.size):
+        when, kind, length, payload = SLOT.unpack_from(data, offset)
+        events.append((when, kind, length, payload[:min(length, PAYLOAD_SIZE)]))
+    return events
@@ -0,0 +1,122 @@
+"""
+Gang programming: the same firmware on many boards at once, one debugWIRE adapter per board.
+run with `python -m dwire.Gang firmware.hex /dev/ttyUSB0 /dev/ttyUSB1 [--frequency 8000000] [--baud 62500]`
+"""
+import argparse
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from dwire.DWInterface import DWInterface
+from dwire.FlashShadow import DEFAULT_SHADOW_DIR
+from dwire.Firmware import load_firmware
+from dwire.Progress import GangProgress
+from dwire.SerialDW import SerialDW
+
+GangResult = namedtuple('GangResult', 'port ok stats error elapsed')
+
+
+class ImageCache:
+    """
+    Parses a firmware once per flash page size, for the boards programmed in parallel
+    """
+    def __init__(self, file):
+        self.file = file
+        self.images = {}
+        self.lock = threading.Lock()
+
+    def get(self, page_size):
+        with self.lock:
+            if page_size not in self.images:
+                self.images[page_size] = load_firmware(self.file, page_size)
+            return self.images[page_size]
+
+
+def baud_divisor(target_frequency, baud):
+    """
+    :return: exponent of the smallest power of two divisor (1 to 128) of the target frequency giving at most baud
+    """
+    for exponent in range(8):
+        if target_frequency / 2**exponent <= baud:
+            return exponent
+    return 7
+
+
+def program_board(port, images: ImageCache, target_frequency, verify=True, erease_device=False, progress=None,
+                  resume=True, baud=None, shadow_dir=DEFAULT_SHADOW_DIR):
+    """
+    programs one board: opens the adapter, writes (and verifies) the image and restarts the firmware.
+    :param baud: line speed used for programming (the connection starts at target_frequency / 128)
+    :return: GangResult, with the exception as error if the board failed
+    """
+    start = time.monotonic()
+    device = None
+    try:
+        device = SerialDW(port, target_frequency, True, True)
+        dw = DWInterface(device, shadow_dir=shadow_dir)
+        if baud:
+            dw.set_com_divisor(baud_divisor(target_frequency, baud))
+        stats = dw.write_firmware(images.get(device.dev.FLASH_PAGEEND), verify=verify, erease_device=erease_device,
+                                  progress=progress)
+        dw.restart_execution(resume)
+        return GangResult(port, True, stats, None, time.monotonic() - start)
+    except Exception as e:
+        return GangResult(port, False, None, e, time.monotonic() - start)
+    finally:
+        if device is not None and device.is_open:
+            device.close()
+
+
+def program_gang(ports, file, target_frequency, verify=True, erease_device=False, workers=None, resume=True,
+                 baud=None, shadow_dir=DEFAULT_SHADOW_DIR):
+    """
+    programs the same firmware on the boards of many debugWIRE adapters in parallel (the serial i/o releases
+    the gil). a failing board does not stop the others.
+    :param ports: serial ports of the adapters
+    :param file: ELF, Intel HEX or raw binary firmware
+    :param workers: threads, one per port by default
+    :param baud: line speed used for programming, see program_board
+    :return: list of GangResult, in the ports order
+    """
+    images = ImageCache(file)
+    progress = GangProgress(len(ports))
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=workers or len(ports)) as pool:
+            results = list(pool.map(lambda port: program_board(port, images, target_frequency, verify, erease_device,
+                                                               progress.board(port), resume, baud, shadow_dir), ports))
+    finally:
+        progress.close()
+    elapsed = time.monotonic() - start
+
+    for result in results:
+        if result.ok:
+            print(f"{result.port}: ok in {result.elapsed:.1f}s, {result.stats['written']} pages written")
+        else:
+            print(f"{result.port}: FAILED after {result.elapsed:.1f}s: {result.error!r}")
+    ok = sum(result.ok for result in results)
+    print(f"{ok}/{len(results)} boards programmed in {elapsed:.1f}s ({ok / elapsed * 60:.1f} boards per minute)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="programs the same firmware on many debugWIRE boards in parallel")
+    parser.add_argument('firmware', help="ELF, Intel HEX or raw binary firmware")
+    parser.add_argument('ports', nargs='+', help="serial ports of the adapters")
+    parser.add_argument('--frequency', type=int, default=8000000, help="target clock frequency in Hz")
+    parser.add_argument('--baud', type=int, help="line speed used for programming (target frequency / 128 by default)")
+    parser.add_argument('--no-verify', action='store_true', help="do not read back the written pages")
+    parser.add_argument('--erase', action='store_true', help="erase the pages not covered by the firmware")
+    parser.add_argument('--workers', type=int, help="parallel boards, all of them by default")
+    parser.add_argument('--halt', action='store_true', help="leave the boards halted instead of running the firmware")
+    args = parser.parse_args()
+
+    results = program_gang(args.ports, args.firmware, args.frequency, verify=not args.no_verify,
+                           erease_device=args.erase, workers=args.workers, resume=not args.halt, baud=args.baud)
+    sys.exit(0 if all(result.ok for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
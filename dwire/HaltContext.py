@@ -0,0 +1,125 @@
+import time
+
+from dwire import CTRL_REG_PC, CTRL_REG_HWBP
+
+
+class HaltContext:
+    """
+    Target state the debugger overwrites while the target is halted: PC, HWBP and the scratch registers
+    used by the memory access sequences.
+    Each value is saved the first time it is clobbered during a halt session and restored (only if dirty)
+    with a single transaction right before the target runs again.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.pc = b'\x00\x00'  # pc value read at halt
+        self.hwbp = None
+        self.reset()
+
+    def reset(self, pc=None, keep_hwbp=True):
+        """
+        starts a new halt session
+        :param pc: the pc value read at halt (None keeps the current one)
+        :param keep_hwbp: the hwbp value is still valid (the target does not change it while running)
+        """
+        if pc is not None:
+            self.pc = pc
+        self.pc_dirty = False
+        if not keep_hwbp:
+            self.hwbp = None
+        self.hwbp_dirty = False
+        self.registers = {}  # register -> saved value
+        self.dirty = set()
+
+    @property
+    def resume_pc(self):
+        """
+        the pc value to write to resume at the halted instruction: the value read is one instruction ahead
+        """
+        return int.to_bytes(int.from_bytes(self.pc, 'big') - 1, 2, 'big')
+
+    def get_hwbp(self):
+        if self.hwbp is None:
+            self.hwbp = self.device._dw_read_ctrl_reg_word(CTRL_REG_HWBP)
+        return self.hwbp
+
+    def set_hwbp(self, value: bytes):
+        self.hwbp = value
+        self.hwbp_dirty = True
+
+    def clobber(self, registers=()):
+        """
+        saves the state an operation is going to overwrite. register cycles and instruction execution
+        always overwrite PC and HWBP.
+        :param registers: iterable of the scratch registers used by the operation
+        """
+        self.pc_dirty = True
+        missing = [r for r in registers if r not in self.registers]
+        if self.hwbp_dirty and not missing:
+            self.dirty.update(registers)
+            return
+        metrics = self.device.metrics
+        began = time.perf_counter() if metrics is not None else None
+        if not self.hwbp_dirty:
+            self.get_hwbp()
+            self.hwbp_dirty = True
+        if missing:
+            start, end = min(missing), max(missing) + 1
+            values = self.device.read_registers(start, end)
+            for r in range(start, end):
+                if r not in self.registers:
+                    self.registers[r] = values[r - start]
+        self.dirty.update(registers)
+        if metrics is not None:
+            metrics.overhead('save', began)
+
+    def save(self, start: int, data: bytes):
+        """
+        records the original values of registers read by the caller right before clobbering them
+        """
+        for i, value in enumerate(data):
+            self.registers.setdefault(start + i, value)
+            self.dirty.add(start + i)
+
+    def overlay(self, start: int, data: bytes):
+        """
+        replaces the clobbered registers inside data (register file content from start) with their saved values
+        """
+        data = bytearray(data)
+        for r, value in self.registers.items():
+            if start <= r < start + len(data):
+                data[r - start] = value
+        return bytes(data)
+
+    def update(self, start: int, data: bytes):
+        """
+        registers written by the user: the saved values of the clobbered ones are replaced
+        """
+        for i, value in enumerate(data):
+            if start + i in self.registers:
+                self.registers[start + i] = value
+
+    def commit(self, restore_pc=True, txn=None):
+        """
+        restores the dirty state in one transaction and ends the halt session
+        :param restore_pc: writes back the pc (not needed when the caller sets it)
+        :param txn: queues the restore on txn instead of sending it
+        """
+        metrics = self.device.metrics
+        began = time.perf_counter() if metrics is not None else None
+        batch = self.device.transaction() if txn is None else txn
+        dirty = sorted(self.dirty)
+        while dirty:
+            start = end = dirty.pop(0)
+            while dirty and dirty[0] == end + 1:
+                end = dirty.pop(0)
+            self.device.write_registers(bytes(self.registers[r] for r in range(start, end + 1)), start, txn=batch)
+        if self.hwbp_dirty:
+            self.device._dw_wrt_ctrl_reg_word(CTRL_REG_HWBP, self.hwbp, txn=batch)
+        if restore_pc and self.pc_dirty:
+            self.device._dw_wrt_ctrl_reg_word(CTRL_REG_PC, self.resume_pc, txn=batch)
+        if txn is None:
+            batch.commit()
+        if metrics is not None:
+            metrics.overhead('restore', began) # queued on txn: host time only, the bytes go with the caller
+        self.reset()
@@ -0,0 +1,54 @@
+REGISTER_FILE_SIZE = 32
+IO_BASE = 0x20
+MAX_CYCLE_LENGTH = 128  # bytes per sram read cycle
+
+
+def merge_ranges(ranges, max_gap=0):
+    """
+    merges overlapping (start, end) ranges and the ones separated by at most max_gap addresses
+    :return: sorted list of (start, end)
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + max_gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_ranges(ranges, boundaries=(), forbidden=(), max_length=None):
+    """
+    splits (start, end) ranges at the given boundaries and at max_length, leaving out the forbidden addresses
+    :return: list of (start, end)
+    """
+    cuts = sorted(set(boundaries) | set(forbidden) | {a + 1 for a in forbidden})
+    ret = []
+    for start, end in ranges:
+        points = [start] + [c for c in cuts if start < c < end] + [end]
+        for lo, hi in zip(points, points[1:]):
+            if lo in forbidden:
+                continue
+            while max_length is not None and hi - lo > max_length:
+                ret.append((lo, lo + max_length))
+                lo += max_length
+            ret.append((lo, hi))
+    return ret
+
+
+def plan_data_reads(ranges, forbidden=(), max_gap=8, max_length=MAX_CYCLE_LENGTH):
+    """
+    plans the read cycles needed to fetch (start, end) data space ranges.
+    the register file is read with a register cycle (no pointer register involved), io and sram with
+    sram cycles of at most max_length bytes that skip the forbidden addresses.
+    ranges closer than max_gap are fetched together: a few extra bytes cost less than a round trip.
+    :return: list of ('reg' | 'sram', start, end)
+    """
+    merged = merge_ranges(ranges, max_gap)
+    plan = []
+    for start, end in split_ranges(merged, boundaries=(REGISTER_FILE_SIZE,)):
+        if end <= REGISTER_FILE_SIZE:
+            plan.append(('reg', start, end))
+        else:
+            plan += [('sram', lo, hi) for lo, hi in split_ranges([(start, end)], forbidden=forbidden, max_length=max_length)]
+    return plan
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+
+# first byte of a command stream -> name
+OPCODES = {0x06: 'disable', 0x07: 'reset', 0x20: 'mem cycle', 0x21: 'reg cycle', 0x23: 'exec', 0x30: 'continue',
+           0x31: 'step', 0x32: 'continue loaded', 0x33: 'exec slow', 0xC2: 'rw destination', 0xD0: 'write pc',
+           0xD1: 'write hwbp', 0xD2: 'load instruction', 0xF0: 'read pc', 0xF1: 'read hwbp', 0xF2: 'read ir',
+           0xF3: 'fingerprint'}
+
+
+def opcode_name(opcode):
+    if opcode in OPCODES:
+        return OPCODES[opcode]
+    if 0x40 <= opcode < 0x80:
+        return 'context'
+    if opcode & 0xF0 in (0x80, 0xA0):
+        return 'baud'
+    return f"{opcode:#04x}"
+
+
+class Histogram:
+    """
+    Latency histogram with power of two microsecond buckets
+    """
+    def __init__(self):
+        self.buckets = [0] * 32 # bucket i: latencies < 2^i us
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.buckets[min(int(seconds * 1e6).bit_length(), 31)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        :return: upper bound (s) of the bucket holding the given fraction of the samples
+        """
+        threshold = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= threshold:
+                return min((1 << i) / 1e6, self.max)
+        return 0.0
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else 0,
+                'p50': self.percentile(0.5), 'p99': self.percentile(0.99), 'max': self.max,
+                'buckets_us': {1 << i: n for i, n in enumerate(self.buckets) if n}}
+
+    def __str__(self):
+        if not self.count:
+            return "-"
+        return (f"n={self.count} mean={self.total / self.count * 1000:.3f}ms p50<{self.percentile(0.5) * 1000:.3f}ms "
+                f"p99<{self.percentile(0.99) * 1000:.3f}ms max={self.max * 1000:.3f}ms")
+
+
+class Metrics:
+    """
+    Driver instrumentation, enabled with SerialDW.enable_metrics (when disabled the driver only checks for None):
+    commands and bytes per opcode, echo wait, response wait and end-to-end latency, time per DWInterface operation
+    with the register save/restore overhead of the halt context attributed to it, and time per gdb packet type.
+    With trace=True every command, operation and packet is also kept as a Chrome trace event.
+    """
+    def __init__(self, trace=False):
+        self.start = time.perf_counter()
+        self.trace = trace
+        self.events = [] # chrome trace events
+        self.commands = {} # opcode name -> [commands, bytes out, bytes in]
+        self.latency = {'echo': Histogram(), 'response': Histogram(), 'total': Histogram()}
+        self.command_latency = {} # opcode name -> Histogram, end-to-end
+        self.operations = {} # operation -> [Histogram, save overhead s, restore overhead s]
+        self.packets = {} # rsp packet type -> Histogram
+        self.local = threading.local() # stack of the running operations, per thread
+
+    def _event(self, category, name, start, duration, args=None):
+        event = {'ph': 'X', 'cat': category, 'name': name, 'ts': (start - self.start) * 1e6, 'dur': duration * 1e6,
+                 'pid': 0, 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def command(self, cmd: bytes, response: int, start, echoed, end):
+        """
+        records a dw_cmd exchange
+        :param start, echoed, end: perf_counter times of the write, of the echo arrival and of the response arrival
+        """
+        name = opcode_name(cmd[0])
+        counts = self.commands.setdefault(name, [0, 0, 0])
+        counts[0] += 1
+        counts[1] += len(cmd)
+        counts[2] += response
+        self.latency['echo'].add(echoed - start)
+        if response:
+            self.latency['response'].add(end - echoed)
+        self.latency['total'].add(end - start)
+        self.command_latency.setdefault(name, Histogram()).add(end - start)
+        if self.trace:
+            self._event('dw', name, start, end - start, {'out': len(cmd), 'in': response})
+
+    def begin(self, operation):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(operation)
+        return time.perf_counter()
+
+    def end(self, operation, start):
+        end = time.perf_counter()
+        self.local.stack.pop()
+        self.operations.setdefault(operation, [Histogram(), 0.0, 0.0])[0].add(end - start)
+        if self.trace:
+            self._event('api', operation, start, end - start)
+
+    def overhead(self, kind, start):
+        """
+        time spent saving (kind 'save') or restoring ('restore') the halt context, attributed to the running
+        operation
+        """
+        end = time.perf_counter()
+        stack = getattr(self.local, 'stack', None)
+        operation = stack[-1] if stack else '(none)'
+        stats = self.operations.setdefault(operation, [Histogram(), 0.0, 0.0])
+        stats[1 if kind == 'save' else 2] += end - start
+        if self.trace:
+            self._event('context', kind, start, end - start, {'operation': operation})
+
+    def packet(self, kind, start):
+        end = time.perf_counter()
+        self.packets.setdefault(kind, Histogram()).add(end - start)
+        if self.trace:
+            self._event('rsp', kind, start, end - start)
+
+    def to_dict(self):
+        return {'commands': {name: {'count': c, 'bytes_out': o, 'bytes_in': i} for name, (c, o, i) in self.commands.items()},
+                'latency': {name: h.to_dict() for name, h in self.latency.items()},
+                'command_latency': {name: h.to_dict() for name, h in self.command_latency.items()},
+                'operations': {name: dict(h.to_dict(), save=s, restore=r) for name, (h, s, r) in self.operations.items()},
+                'packets': {name: h.to_dict() for name, h in self.packets.items()}}
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def save_chrome_trace(self, path):
+        """
+        writes the trace events (chrome://tracing, perfetto)
+        """
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        lines = [f"{'command':<18}{'count':>8}{'out':>9}{'in':>8}  latency"]
+        for name, (count, out, received) in sorted(self.commands.items(), key=lambda c: -c[1][0]):
+            lines.append(f"{name:<18}{count:>8}{out:>9}{received:>8}  {self.command_latency[name]}")
+        for name, histogram in self.latency.items():
+            lines.append(f"{name + ' wait' if name != 'total' else 'end to end':<18}{histogram}")
+        if self.operations:
+            lines.append(f"{'operation':<24}{'save ms':>9}{'restore ms':>11}  time")
+            for name, (histogram, save, restore) in sorted(self.operations.items(), key=lambda o: -o[1][0].total):
+                lines.append(f"{name:<24}{save * 1000:>9.2f}{restore * 1000:>11.2f}  {histogram}")
+        if self.packets:
+            lines.append("packet")
+            for name, histogram in sorted(self.packets.items(), key=lambda p: -p[1].total):
+                lines.append(f"{name:<18}{histogram}")
+        return '\n'.join(lines)
@@ -0,0 +1,116 @@
+import logging
+import random
+import time
+from collections import Counter
+
+from dwire.DWInterface import DWInterface
+from dwire.Symbols import SymbolTable
+from dwire.avr.Decoder import CALL, INDIRECT_CALL
+
+log = logging.getLogger(__name__)
+
+
+class Profiler:
+    """
+    Statistical profiler: halts the running target at a given rate, records the pc (and, optionally, the return
+    addresses found on the stack) and resumes it right away.
+    Each sample costs a break, the pc read and the resume (plus one sram read for the stack): the time the target
+    spends halted is measured and reported as the profiler intrusion.
+    """
+    def __init__(self, dw: DWInterface, symbols: SymbolTable = None, rate=100, stack_scan=0):
+        """
+        :param symbols: symbol table the pcs are resolved against (see SymbolTable.load)
+        :param rate: samples per second (the interval is jittered to avoid aliasing with periodic code)
+        :param stack_scan: bytes of stack scanned for return addresses (0 disables call stacks)
+        """
+        self.dw = dw
+        self.symbols = symbols if symbols is not None else SymbolTable([])
+        self.rate = rate
+        self.stack_scan = stack_scan
+        self.samples = Counter() # call stack (tuple of byte addresses, outermost first) -> samples
+        self.intrusion = [] # s, time halted per sample
+        self.elapsed = 0 # s, profiling time
+
+    def _return_addresses(self):
+        """
+        scans the stack for values that are the address following a call instruction (heuristic: data on the stack
+        can look like a return address)
+        :return: byte addresses, innermost first
+        """
+        sp = self.dw.get_sp()
+        ramend = self.dw.device.dev.SRAM_BASE + self.dw.device.dev.SRAM_SIZE - 1
+        stack = self.dw.read_ram(sp + 1, min(self.stack_scan, ramend - sp)) if sp < ramend else b''
+        addresses = []
+        for i in range(len(stack) - 1):
+            address = int.from_bytes(stack[i:i + 2], 'big') # pushed low byte first
+            if not 0 < address < self.dw.device.dev.FLASH_SIZE // 2:
+                continue
+            for length in (1, 2):
+                instruction, _ = self.dw.decode_instruction(address - length)
+                if instruction.kind in (CALL, INDIRECT_CALL) and instruction.length == length:
+                    addresses.append(address * 2)
+                    break
+        return addresses
+
+    def sample(self):
+        """
+        takes one sample of the running target
+        :return: False if the target was found halted (breakpoint): profiling stops
+        """
+        if self.dw.wait_hit(0):
+            return False
+        start = time.monotonic()
+        self.dw.halt()
+        pc = self.dw.get_instruction_address() * 2
+        stack = self._return_addresses() if self.stack_scan else []
+        self.dw.resume_execution() # loads the original instruction if halted on a BREAK
+        self.intrusion.append(time.monotonic() - start)
+        self.samples[tuple(reversed(stack)) + (pc,)] += 1
+        return True
+
+    def run(self, duration=None, samples=None):
+        """
+        profiles the running target for duration seconds or samples samples
+        """
+        assert duration is not None or samples is not None
+        start = time.monotonic()
+        taken = 0
+        while (duration is None or time.monotonic() - start < duration) and (samples is None or taken < samples):
+            time.sleep(random.uniform(0.5, 1.5) / self.rate)
+            if not self.sample():
+                log.warning("Target halted, profiling stopped")
+                break
+            taken += 1
+        self.elapsed += time.monotonic() - start
+
+    def flat_profile(self):
+        """
+        :return: list of (symbol, samples, fraction) sorted by samples
+        """
+        counts = Counter()
+        for stack, n in self.samples.items():
+            counts[self.symbols.name(stack[-1])] += n
+        total = sum(counts.values())
+        return [(name, n, n / total) for name, n in counts.most_common()]
+
+    def write_collapsed(self, path):
+        """
+        writes the samples as collapsed stacks ("outer;inner count" lines), the input of flamegraph.pl
+        and speedscope
+        """
+        counts = Counter()
+        for stack, n in self.samples.items():
+            counts[';'.join(self.symbols.name(address) for address in stack)] += n
+        with open(path, 'w') as f:
+            for line, n in sorted(counts.items()):
+                f.write(f"{line} {n}\n")
+
+    def report(self):
+        total = sum(self.samples.values())
+        lines = [f"{'samples':>8} {'%':>6}  symbol"]
+        lines += [f"{n:>8} {fraction * 100:>6.2f}  {name}" for name, n, fraction in self.flat_profile()]
+        if total:
+            halted = sum(self.intrusion)
+            lines.append(f"{total} samples in {self.elapsed:.2f}s, {halted / total * 1000:.2f}ms halted per sample "
+                         f"({halted / self.elapsed * 100:.1f}% of the time)")
+        return '\n'.join(lines)
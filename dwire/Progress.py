@@ -0,0 +1,57 @@
+import threading
+
+from tqdm import tqdm
+
+
+class ConsoleProgress:
+    """
+    write_firmware progress callback drawing a tqdm bar per stage
+    """
+    def __init__(self):
+        self.bar = None
+        self.stage = None
+
+    def __call__(self, stage, done, total):
+        """
+        :param stage: 'write', 'erase', 'verify' or 'eeprom'
+        :param done: pages (eeprom segments) done in the stage
+        :param total: units of the stage
+        """
+        if stage != self.stage:
+            self.close()
+            self.stage = stage
+            self.bar = tqdm(total=total, desc=stage)
+        self.bar.update(done - self.bar.n)
+        if done == total:
+            self.close()
+
+    def close(self):
+        if self.bar is not None:
+            self.bar.close()
+            self.bar = None
+        self.stage = None
+
+
+class GangProgress:
+    """
+    Aggregates the progress of many boards programmed in parallel into a single bar.
+    Each board reports through its own callback (GangProgress.board).
+    """
+    def __init__(self, boards):
+        self.lock = threading.Lock()
+        self.stages = {} # (board, stage) -> (done, total)
+        self.bar = tqdm(total=0, desc=f"{boards} boards", unit='units')
+
+    def board(self, name):
+        """
+        :return: the write_firmware progress callback of a board
+        """
+        def _progress(stage, done, total):
+            with self.lock:
+                self.stages[(name, stage)] = (done, total)
+                self.bar.total = sum(t for _, t in self.stages.values())
+                self.bar.update(sum(d for d, _ in self.stages.values()) - self.bar.n)
+        return _progress
+
+    def close(self):
+        self.bar.close()
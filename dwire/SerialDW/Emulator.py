@@ -0,0 +1,327 @@
+import time
+
+from dwire import CNTXT_GO_TO_HW_BREAKPOINT
+from dwire.SerialDW import _dw_baud_divisor_bytes
+from dwire.SerialDW.Transport import Transport
+from dwire.SerialDW.devices.ATTINY85 import DevATTINY85
+from dwire.avr import SPL
+from dwire.avr.Decoder import decode, JUMP, CALL, INDIRECT_JUMP, INDIRECT_CALL, RETURN
+
+SPM_OPCODE = 0x95E8
+SPMEN, PGERS, PGWRT, RWWSRE = 0x01, 0x02, 0x04, 0x10
+EERE, EEPE, EEMPE, EEPM = 0x01, 0x02, 0x04, 0x30
+IO_BASE = 0x20
+BREAK_OPCODE = 0x9598
+RUN_LIMIT = 100000 # instructions executed running to the hw breakpoint, then it is taken as reached
+
+_baud_divisors = {command[0]: 1 << i for i, command in enumerate(_dw_baud_divisor_bytes)}
+
+
+class EmulatedTarget:
+    """
+    In-process debugWIRE target (an ATtiny85 by default) answering the commands the driver sends:
+    break, baud rate, ctrl registers, register and memory cycles and the execution of the instructions the driver
+    uses (OUT, IN, SPM, ADIW, LDI, MOVW, PUSH, POP), with the flash page buffer and the eeprom controller.
+    Single steps execute the supported instructions and skip the others; jumps, calls and returns move the pc
+    (conditional branches and skips fall through). Resumed with CNTXT_GO_TO_HW_BREAKPOINT, the target steps until
+    the hw breakpoint or a BREAK (the hw breakpoint is taken as reached after RUN_LIMIT instructions), otherwise code
+    is not executed and the target runs until the host break.
+    The pc reads one instruction ahead, as on the real target.
+    """
+    def __init__(self, dev=DevATTINY85, target_frequency=8000000):
+        self.dev = dev
+        self.target_freq = target_frequency
+        self.flash = bytearray(b'\xff' * dev.FLASH_SIZE)
+        self.eeprom = bytearray(b'\xff' * dev.EEPROM_SIZE)
+        self.data = bytearray(dev.SRAM_BASE + dev.SRAM_SIZE) # registers, io, sram
+        self.page_buffer = bytearray(b'\xff' * dev.FLASH_PAGEEND)
+        self.pc = 0
+        self.hwbp = 0
+        self.ir = 0
+        self.context = 0
+        self.destination = 0
+        self.divisor = 128
+        self.running = False
+        self.output = bytearray() # bytes sent by the target
+        self.slow_time = 0 # s, modeled time of the spm and eeprom writes
+        self.sp = dev.SRAM_BASE + dev.SRAM_SIZE - 1
+        self._parser = None
+        self.on_break()
+
+    def on_break(self):
+        self.divisor = 128
+        self.running = False
+        self._parser = self._commands()
+        next(self._parser)
+        self.output += b'\x00\x55'
+
+    def receive(self, byte):
+        if not self.running:
+            self._parser.send(byte)
+
+    @property
+    def sp(self):
+        return self.data[IO_BASE + SPL] | self.data[IO_BASE + SPL + 1] << 8
+
+    @sp.setter
+    def sp(self, value):
+        self.data[IO_BASE + SPL], self.data[IO_BASE + SPL + 1] = value & 0xFF, value >> 8 & 0xFF
+
+    @property
+    def z(self):
+        return self.data[30] | self.data[31] << 8
+
+    @z.setter
+    def z(self, value):
+        self.data[30], self.data[31] = value & 0xFF, value >> 8 & 0xFF
+
+    def _commands(self):
+        """
+        command parser, fed one byte at a time
+        """
+        while True:
+            cmd = yield
+            if cmd & 0xF0 == 0xD0 or cmd & 0xF0 == 0xC0:
+                value = yield
+                if cmd & 0xF0 == 0xD0:
+                    value = value << 8 | (yield)
+                if cmd == 0xC2:
+                    self.destination = value
+                elif cmd & 0x0F == 0:
+                    self.pc = value if cmd & 0xF0 == 0xD0 else self.pc & 0xFF00 | value
+                elif cmd & 0x0F == 1:
+                    self.hwbp = value if cmd & 0xF0 == 0xD0 else self.hwbp & 0xFF00 | value
+                elif cmd & 0x0F == 2:
+                    self.ir = value
+            elif cmd & 0xE0 == 0xE0:
+                value = {0: self.pc + 1, 1: self.hwbp, 2: self.ir, 3: int.from_bytes(self.dev.FINGERPRINT, 'big')}.get(cmd & 0x0F, 0)
+                self.output += int.to_bytes(value, 2, 'big') if cmd & 0xF0 == 0xF0 else bytes([value & 0xFF])
+            elif 0x40 <= cmd < 0x80:
+                self.context = cmd & ~0x20
+            elif cmd in _baud_divisors:
+                self.divisor = _baud_divisors[cmd]
+            elif cmd == 0x20:
+                yield from self._memory_cycle()
+            elif cmd in (0x23, 0x33):
+                yield from self._execute(self.ir)
+                if cmd == 0x33:
+                    self.output += b'\x00\x55'
+            elif cmd == 0x31:
+                yield from self._step()
+            elif cmd in (0x30, 0x32):
+                if cmd == 0x32:
+                    yield from self._execute(self.ir)
+                if self.context == CNTXT_GO_TO_HW_BREAKPOINT:
+                    yield from self._run_to_hw_breakpoint()
+                    self.output += b'\x00\x55'
+                else:
+                    self.running = True
+            elif cmd == 0x07:
+                self.pc = 0
+                self.data[0:self.dev.SRAM_BASE] = bytes(self.dev.SRAM_BASE)
+                self.sp = self.dev.SRAM_BASE + self.dev.SRAM_SIZE - 1
+                self.output += b'\x00\x55'
+
+    def _step(self):
+        """
+        executes the instruction at the pc
+        """
+        word = self._flash_word(self.pc)
+        instruction = decode(word, self._flash_word(self.pc + 1), self.pc, self.dev.FLASH_SIZE // 2)
+        next_pc = self.pc + instruction.length
+        if instruction.kind in (CALL, INDIRECT_CALL):
+            self._push(next_pc & 0xFF)
+            self._push(next_pc >> 8)
+        if instruction.kind in (JUMP, CALL):
+            next_pc = instruction.target
+        elif instruction.kind in (INDIRECT_JUMP, INDIRECT_CALL):
+            next_pc = self.z
+        elif instruction.kind == RETURN:
+            next_pc = self._pop() << 8
+            next_pc |= self._pop()
+        yield from self._execute(word)
+        self.pc = next_pc % (self.dev.FLASH_SIZE // 2)
+
+    def _run_to_hw_breakpoint(self):
+        """
+        steps until the hw breakpoint (checked before each instruction: resuming on it stops right away) or a BREAK
+        """
+        for _ in range(RUN_LIMIT):
+            if self.pc == self.hwbp or self._flash_word(self.pc) == BREAK_OPCODE:
+                return
+            yield from self._step()
+        self.pc = self.hwbp
+
+    def _push(self, value):
+        self.data[self.sp] = value
+        self.sp -= 1
+
+    def _pop(self):
+        self.sp += 1
+        return self.data[self.sp]
+
+    def _flash_word(self, address):
+        address = address * 2 % self.dev.FLASH_SIZE
+        return self.flash[address] | self.flash[address + 1] << 8
+
+    def _memory_cycle(self):
+        start, end = self.pc & 0xFF, self.hwbp & 0xFF
+        if self.destination == 0x01: # registers read
+            self.output += self.data[start:end]
+        elif self.destination == 0x05: # registers write
+            for r in range(start, end):
+                self.data[r] = yield
+        elif self.destination in (0x00, 0x02): # sram or flash read from Z
+            length = self.hwbp // 2
+            source = self.data if self.destination == 0x00 else self.flash
+            address = self.z
+            self.output += source[address:address + length]
+            self.z = address + length
+        elif self.destination == 0x04: # sram write at Z
+            address = self.z
+            for i in range((self.hwbp - 1) // 2):
+                self.data[address + i] = yield
+            self.z = address + (self.hwbp - 1) // 2
+
+    def _execute(self, word):
+        if word & 0xF800 in (0xB000, 0xB800): # IN, OUT
+            r = word >> 4 & 0x1F
+            io = (word & 0x0F) | (word >> 5 & 0x30)
+            if word & 0x0800:
+                self._out(io, self.data[r])
+            elif io == self.dev.DWRD:
+                self.data[r] = yield # the host sends the byte right after the instruction
+            else:
+                self.data[r] = self.data[IO_BASE + io]
+        elif word & 0xF000 == 0xE000: # LDI
+            self.data[16 + (word >> 4 & 0x0F)] = (word >> 4 & 0xF0) | (word & 0x0F)
+        elif word & 0xFF00 == 0x0100: # MOVW
+            d, r = (word >> 4 & 0x0F) * 2, (word & 0x0F) * 2
+            self.data[d:d + 2] = self.data[r:r + 2]
+        elif word & 0xFF00 == 0x9600: # ADIW
+            d = 24 + (word >> 4 & 0x03) * 2
+            value = (self.data[d] | self.data[d + 1] << 8) + ((word >> 2 & 0x30) | (word & 0x0F))
+            self.data[d], self.data[d + 1] = value & 0xFF, value >> 8 & 0xFF
+        elif word & 0xFE0F == 0x920F: # PUSH
+            self._push(self.data[word >> 4 & 0x1F])
+        elif word & 0xFE0F == 0x900F: # POP
+            self.data[word >> 4 & 0x1F] = self._pop()
+        elif word == SPM_OPCODE:
+            self._spm()
+
+    def _out(self, io, value):
+        if io == self.dev.DWRD:
+            self.output.append(value)
+            return
+        previous = self.data[IO_BASE + io]
+        self.data[IO_BASE + io] = value
+        if io == self.dev.EECR:
+            self._eeprom(previous, value)
+
+    def _spm(self):
+        spmcsr = self.data[IO_BASE + self.dev.SPMCSR]
+        page_size = self.dev.FLASH_PAGEEND
+        page = self.z % self.dev.FLASH_SIZE // page_size * page_size
+        if spmcsr == SPMEN:
+            offset = self.z % page_size & ~1
+            self.page_buffer[offset:offset + 2] = self.data[0:2]
+        elif spmcsr == PGERS | SPMEN:
+            self.flash[page:page + page_size] = b'\xff' * page_size
+            self.slow_time += 0.0045
+        elif spmcsr == PGWRT | SPMEN:
+            self.flash[page:page + page_size] = bytes(a & b for a, b in zip(self.flash[page:page + page_size], self.page_buffer))
+            self.page_buffer[:] = b'\xff' * page_size
+            self.slow_time += 0.0045
+        elif spmcsr == RWWSRE | SPMEN:
+            self.page_buffer[:] = b'\xff' * page_size
+        self.data[IO_BASE + self.dev.SPMCSR] = 0
+
+    def _eeprom(self, previous, eecr):
+        address = (self.data[IO_BASE + self.dev.EEARL] | self.data[IO_BASE + self.dev.EEARH] << 8) % self.dev.EEPROM_SIZE
+        if eecr & EERE:
+            self.data[IO_BASE + self.dev.EEDR] = self.eeprom[address]
+        if eecr & EEPE and previous & EEMPE:
+            value = self.data[IO_BASE + self.dev.EEDR]
+            mode = eecr & EEPM
+            self.eeprom[address] = 0xFF if mode == 0x10 else self.eeprom[address] & value if mode == 0x20 else value
+            self.slow_time += 0.0018 if mode else 0.0034
+            eecr &= ~EEMPE
+        self.data[IO_BASE + self.dev.EECR] = eecr & (EEPM | EEMPE) # the write completes right away
+
+
+class EmulatedTransport(Transport):
+    """
+    Transport to an EmulatedTarget: echoes the written bytes as the single wire line does and models the wall time
+    of each exchange from the adapter latency per write, the baud rate (10 bits per byte) and the slow spm/eeprom
+    operations. With realtime=True the modeled time is actually waited.
+    A baud rate not matching the target divisor makes the target deaf, as a real one.
+    """
+    def __init__(self, target: EmulatedTarget = None, latency=0.004, realtime=False):
+        self.target = target if target is not None else EmulatedTarget()
+        self.port = 'emulator'
+        self.latency = latency
+        self.realtime = realtime
+        self.baudrate = 9600
+        self.timeout = None
+        self.is_open = True
+        self.writes = 0
+        self.bytes_on_wire = 0
+        self.modeled_time = 0 # s
+        self._rx = bytearray()
+
+    def reset_stats(self):
+        self.writes = 0
+        self.bytes_on_wire = 0
+        self.modeled_time = 0
+
+    def _elapse(self, seconds):
+        self.modeled_time += seconds
+        if self.realtime:
+            time.sleep(seconds)
+
+    def _in_sync(self):
+        baudrate = self.target.target_freq / self.target.divisor
+        return baudrate * 0.95 <= self.baudrate <= baudrate * 1.05
+
+    def _collect(self):
+        slow = self.target.slow_time
+        self.target.slow_time = 0
+        sent = len(self.target.output)
+        self._rx += self.target.output
+        self.target.output.clear()
+        self.bytes_on_wire += sent
+        self._elapse(slow + sent * 10 / self.baudrate)
+
+    def write(self, data: bytes):
+        self.writes += 1
+        self.bytes_on_wire += len(data)
+        self._elapse(self.latency + len(data) * 10 / self.baudrate)
+        for byte in data:
+            self._rx.append(byte) # echo
+            if self._in_sync():
+                self.target.receive(byte)
+        self._collect()
+        return len(data)
+
+    def read(self, size=1):
+        if len(self._rx) < size and self.timeout is None:
+            raise TimeoutError("the emulated target is running and nothing will come (read without timeout)")
+        if len(self._rx) < size:
+            self._elapse(self.timeout)
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def send_break(self, duration=0.25):
+        self._elapse(self.latency + duration)
+        if self.target.target_freq / 128 * 0.95 <= self.baudrate <= self.target.target_freq / 128 * 1.05:
+            self.target.on_break()
+            self._collect()
+        else:
+            self._rx += b'\x00\xff'
+
+    def close(self):
+        self.is_open = False
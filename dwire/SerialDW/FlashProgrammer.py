@@ -0,0 +1,78 @@
+from dwire import CTRL_REG_PC, CNTXT_WRT_FLASH
+from dwire.avr import OUT, IN, MOVW, SPM, ADIW, LDI
+
+BOOT_PC = b'\x1F\x00'  # pc inside the boot region (allows spm)
+SYNC = b'\x00\x55'  # answer of a slow (spm) step
+
+
+def EXEC(instruction, aux=b''):
+    """
+    command stream executing an instruction (load into IR + execute), aux is sent right after it
+    """
+    return b'\xD2' + instruction + b'\x23' + aux
+
+
+def EXEC_SLOW(instruction):
+    """
+    command stream executing a slow instruction (spm), the target answers with 0x00 0x55
+    """
+    return b'\xD2' + instruction + b'\x33'
+
+
+class FlashPageProgrammer:
+    """
+    Precomputes, for a device, the command streams used to erase and program a flash page.
+    A page is programmed with one stream for the erase, one for the buffer fill + page write and one for
+    the RWWSRE, each ending with an spm slow step where the target answers 0x00 0x55.
+    """
+    def __init__(self, dev):
+        self.dev = dev
+        set_pc = bytes([0xD0 | CTRL_REG_PC]) + BOOT_PC
+        cntxt = bytes([CNTXT_WRT_FLASH])
+        cntxt_no_timers = bytes([CNTXT_WRT_FLASH | (1 << 5)])
+
+        self.erase = set_pc + cntxt_no_timers \
+            + EXEC(MOVW(24, 30)) \
+            + EXEC(OUT(dev.SPMCSR, 26)) \
+            + EXEC_SLOW(SPM())  # SPMCSR = 0x03 -> flash page erase
+
+        # one word: r0 <- low byte, r1 <- high byte, SPMCSR = 1 (buffer fill at [Z]), Z += 2
+        word = set_pc \
+            + EXEC(IN(0, dev.DWRD), b'\x00') \
+            + EXEC(IN(1, dev.DWRD), b'\x00') \
+            + EXEC(OUT(dev.SPMCSR, 27)) \
+            + EXEC(SPM()) \
+            + EXEC(ADIW(3, 2))
+        self.word_len = len(word)
+        self.low_offset = len(set_pc) + 4
+        self.high_offset = self.low_offset + 5
+        self.fill = word * (dev.FLASH_PAGEEND // 2)
+
+        self.fill_prefix = cntxt
+        self.page_write = set_pc \
+            + EXEC(MOVW(30, 24)) \
+            + EXEC(OUT(dev.SPMCSR, 28)) \
+            + EXEC_SLOW(SPM())  # restore the page address, SPMCSR = 5 -> write page
+
+        self.rwwsre = set_pc \
+            + EXEC(LDI(28, 0x11)) \
+            + EXEC(OUT(dev.SPMCSR, 28)) \
+            + EXEC_SLOW(SPM())  # SPMCSR = 0x11 -> RWWSRE (clears the buffer)
+
+    def setup_registers(self, addr):
+        """
+        X, Y, Z register values needed by the streams: r26 = 0x03 (erase), r27 = 0x01 (fill), r28 = 0x05 (write),
+        r29 = 0x40, Z = page address
+        """
+        return b'\x03\x01\x05\x40' + int.to_bytes(addr, 2, 'little')
+
+    def fill_stream(self, data):
+        """
+        :param data: the page content
+        :return: the stream that fills the page buffer with data and writes the page
+        """
+        assert len(data) == self.dev.FLASH_PAGEEND
+        fill = bytearray(self.fill)
+        fill[self.low_offset::self.word_len] = data[0::2]
+        fill[self.high_offset::self.word_len] = data[1::2]
+        return self.fill_prefix + fill + self.page_write
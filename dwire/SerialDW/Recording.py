@@ -0,0 +1,248 @@
+import struct
+import threading
+import time
+
+from dwire.SerialDW.Transport import Transport
+
+RECORDING_MAGIC = b'DWRC'
+RECORDING_VERSION = 1
+# magic, version, wall clock time of the start
+HEADER = struct.Struct('<4sHd')
+# kind, start (s from the recording start), duration (s), value, payload length. the payload follows
+EVENT = struct.Struct('<BdfII')
+
+WRITE, READ, BREAK, BAUD, TIMEOUT, FLUSH, CLOSE, INPUT = range(1, 9)
+KIND_NAMES = {WRITE: 'write', READ: 'read', BREAK: 'break', BAUD: 'baud', TIMEOUT: 'timeout', FLUSH: 'flush',
+              CLOSE: 'close', INPUT: 'input'}
+NO_TIMEOUT = 0xFFFFFFFF
+
+
+class ReplayError(Exception):
+    """
+    the replayed host did not send what was recorded
+    """
+
+
+def load_recording(path):
+    """
+    :return: list of (kind, start, duration, value, payload)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, _ = HEADER.unpack_from(data)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError(f"{path} is not a recording")
+    events = []
+    offset = HEADER.size
+    while offset < len(data):
+        kind, start, duration, value, length = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+        events.append((kind, start, duration, value, data[offset:offset + length]))
+        offset += length
+    return events
+
+
+class RecordingReader:
+    """
+    Stream reader wrapper recording the data gdb sends (the server input) in the transport recording
+    """
+    def __init__(self, reader, transport):
+        self.reader = reader
+        self.transport = transport
+
+    async def read(self, n=-1):
+        data = await self.reader.read(n)
+        self.transport.record_input(data)
+        return data
+
+
+class RecordingTransport(Transport):
+    """
+    Transport wrapper logging every write, read, break, baud rate and timeout change, with monotonic timestamps
+    and the time spent in the call, to a binary file that ReplayTransport plays back.
+    The data gdb sends can be logged too (see RecordingReader), so that a whole gdb session can be replayed.
+    """
+    def __init__(self, transport: Transport, path):
+        self.transport = transport
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, time.time()))
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+        self.busy = 0 # calls to the transport in progress
+
+    def _record(self, kind, start, value=0, payload=b''):
+        end = time.monotonic()
+        with self.lock:
+            self.file.write(EVENT.pack(kind, start - self.start, end - start, value, len(payload)))
+            self.file.write(payload)
+
+    def _call(self, kind, function, *args, value=0, payload=None):
+        start = time.monotonic()
+        self.busy += 1
+        try:
+            result = function(*args)
+        finally:
+            self.busy -= 1
+        self._record(kind, start, value, result if payload is None else payload)
+        return result
+
+    @property
+    def baudrate(self):
+        return self.transport.baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self._record(BAUD, time.monotonic(), int(value))
+        self.transport.baudrate = value
+
+    @property
+    def timeout(self):
+        return self.transport.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._record(TIMEOUT, time.monotonic(), NO_TIMEOUT if value is None else int(value * 1e6))
+        self.transport.timeout = value
+
+    @property
+    def is_open(self):
+        return self.transport.is_open
+
+    @property
+    def port(self):
+        return self.transport.port
+
+    def write(self, data: bytes):
+        return self._call(WRITE, self.transport.write, data, payload=bytes(data))
+
+    def read(self, size=1):
+        return self._call(READ, self.transport.read, size, value=size)
+
+    def reset_input_buffer(self):
+        self._call(FLUSH, self.transport.reset_input_buffer, payload=b'')
+
+    def send_break(self, duration=0.25):
+        self._call(BREAK, self.transport.send_break, duration, value=int(duration * 1e6), payload=b'')
+
+    def record_input(self, data):
+        """
+        records data received by the gdb server. the value tells if a transport call was in progress
+        (the replay delivers it with the next call instead of when the server is idle)
+        """
+        self._record(INPUT, time.monotonic(), int(self.busy > 0), bytes(data))
+
+    def record_reader(self, reader):
+        return RecordingReader(reader, self)
+
+    def close(self):
+        self._call(CLOSE, self.transport.close, payload=b'')
+        with self.lock:
+            self.file.close()
+
+
+class ReplayTransport(Transport):
+    """
+    Plays back a RecordingTransport log: reads return the recorded data, writes and breaks are checked against
+    the recording (ReplayError on divergence). Baud rate and timeout changes are consumed as they come.
+    Runs as fast as possible, or with realtime=True waiting the recorded time of each event.
+    Recorded gdb input is handed to on_input (see gdb.Replay) in the recorded order.
+    NB replay needs the host state of the recording: the flash shadow verification reads pages picked from the
+    shadow content, so a session recorded with a saved shadow replays with a copy of it (see gdb.Replay).
+    """
+    def __init__(self, path, realtime=False):
+        self.events = load_recording(path)
+        self.realtime = realtime
+        self.cursor = 0
+        self.lock = threading.RLock()
+        self.on_input = None # callable(data)
+        self.start = time.monotonic()
+        self.wire_time = 0 # s, recorded time spent in the transport calls
+        self.is_open = True
+        self._baudrate = None
+        self._timeout = None
+
+    @property
+    def finished(self):
+        return self.cursor >= len(self.events)
+
+    def _wait(self, event):
+        if self.realtime:
+            delay = self.start + event[1] + event[2] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _deliver(self, idle_only=False):
+        """
+        hands the gdb input at the cursor to on_input
+        :return: True if some input has been delivered
+        """
+        delivered = False
+        while not self.finished and self.events[self.cursor][0] == INPUT:
+            kind, start, duration, busy, payload = self.events[self.cursor]
+            if idle_only and busy:
+                break
+            self._wait(self.events[self.cursor])
+            self.cursor += 1
+            if self.on_input is not None:
+                self.on_input(payload)
+            delivered = True
+        return delivered
+
+    def pump(self):
+        """
+        delivers the gdb input received while the server was idle, if it is next in the recording
+        """
+        with self.lock:
+            return self._deliver(idle_only=True)
+
+    def _next(self, kind):
+        with self.lock:
+            self._deliver()
+            if self.finished:
+                raise ReplayError(f"recording ended, {KIND_NAMES[kind]} requested")
+            event = self.events[self.cursor]
+            if event[0] != kind:
+                raise ReplayError(f"event {self.cursor}: {KIND_NAMES[kind]} requested, {KIND_NAMES[event[0]]} recorded")
+            self.cursor += 1
+            self._wait(event)
+            self.wire_time += event[2]
+            return event
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self._baudrate = self._next(BAUD)[3]
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._next(TIMEOUT)
+        self._timeout = value
+
+    def write(self, data: bytes):
+        event = self._next(WRITE)
+        if event[4] != bytes(data):
+            raise ReplayError(f"event {self.cursor - 1}: wrote {bytes(data).hex()}, recorded {event[4].hex()}")
+        return len(data)
+
+    def read(self, size=1):
+        event = self._next(READ)
+        if event[3] != size:
+            raise ReplayError(f"event {self.cursor - 1}: read of {size} bytes, recorded {event[3]}")
+        return event[4]
+
+    def reset_input_buffer(self):
+        self._next(FLUSH)
+
+    def send_break(self, duration=0.25):
+        self._next(BREAK)
+
+    def close(self):
+        self._next(CLOSE)
+        self.is_open = False
@@ -0,0 +1,44 @@
+import logging
+
+from serial import Serial
+
+log = logging.getLogger(__name__)
+
+
+class Transport:
+    """
+    Byte link to the debugWIRE line, what SerialDW needs of a serial port: the adapter echoes every written byte,
+    a break makes the target answer 0x00 0x55.
+    Implementations have baudrate and timeout (s, None waits forever) attributes and is_open.
+    """
+    port = None # name of the adapter (the flash shadow is kept per device and port)
+
+    def write(self, data: bytes):
+        raise NotImplementedError
+
+    def read(self, size=1):
+        """
+        :return: up to size bytes, less if the timeout expires
+        """
+        raise NotImplementedError
+
+    def reset_input_buffer(self):
+        raise NotImplementedError
+
+    def send_break(self, duration=0.25):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class SerialTransport(Serial, Transport):
+    """
+    debugWIRE adapter on a serial port (pyserial)
+    """
+    def __init__(self, port, baudrate):
+        Serial.__init__(self, port, baudrate=baudrate)
+
+    def open(self):
+        log.info("Opening serial port @ %s baud", self.baudrate)
+        Serial.open(self)
@@ -1,64 +1,229 @@
+import logging
 import math
+import os
+import tempfile
+import time
 from binascii import hexlify
 
-from serial import Serial
-from tqdm import tqdm
-
 from dwire import *
+from dwire.FlightRecorder import FlightRecorder, DW_WRITE, DW_READ, DW_BREAK, DW_ERROR
+from dwire.Metrics import Metrics
+from dwire.SerialDW.Transport import Transport, SerialTransport
+from dwire.SerialDW.FlashProgrammer import FlashPageProgrammer, SYNC, EXEC
 from dwire.SerialDW.devices import devices
-from dwire.avr import OUT, IN, MOVW, SPM, ADIW, LDI, REG_Z, REG_Y, REG_X
+from dwire.avr import OUT, IN, MOVW, SPM, ADIW, LDI, NOP, REG_Z, REG_Y, REG_X
+
+EECR_EEPE = 0x02
+EECR_EEMPE = 0x04
+EEPM_ATOMIC = 0x00
+EEPM_ERASE = 0x10
+EEPM_WRITE = 0x20
+EEPROM_WRITE_TIME = {EEPM_ATOMIC: 0.0034, EEPM_ERASE: 0.0018, EEPM_WRITE: 0.0018} # s, typical (datasheet)
+EEPROM_TIME_MARGIN = 1.25
+EEPROM_STREAM_CHUNK = 1024 # bytes of chained writes per transaction
+
+log = logging.getLogger(__name__)
 
 _dw_baud_divisor_bytes = [b'\xA3', b'\xA2', b'\xA1', b'\xA0', b'\x80', b'\x81', b'\x82', b'\x83']
 
 
-class SerialDW(Serial):
+class DWTransaction:
+    """
+    Queues debugWire commands and sends them with the minimum number of serial round trips.
+    Commands with no response are concatenated into a single write; a command expecting a response
+    closes the write, since the target answers on the same (half duplex) line and cannot be talked over.
+    Echo and responses of every write are collected and verified with one bulk read.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.commands = []  # list of (command, response_length)
+        self.results = None
+
+    def dw_cmd(self, cmd: bytes, response_length: int):
+        """
+        queues a command.
+        :return: the index of the command result inside the list returned by commit
+        """
+        self.commands.append((bytes(cmd), response_length))
+        return len(self.commands) - 1
+
+    def commit(self):
+        """
+        sends all the queued commands.
+        :return: a list with the response of each queued command (None for commands without response)
+        """
+        self.results = [None] * len(self.commands)
+        stream = bytearray()
+        for idx, (cmd, response_length) in enumerate(self.commands):
+            stream += cmd
+            if response_length > 0 or idx == len(self.commands) - 1:
+                self.results[idx] = self.device.dw_cmd(stream, response_length)
+                stream = bytearray()
+        self.commands = []
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+
+
+class SerialDW:
+    metrics = None # Metrics, when enabled
+    flight_dump_dir = tempfile.gettempdir() # where the flight recorder is dumped on failures (None: log only)
     def __init__(self, port, target_frequency, break_execution=True, reset_execution=False):
+        """
+        :param port: serial port of the adapter or a Transport (e.g. an EmulatedTransport)
+        """
         self.target_freq = target_frequency
         self.divisor = 128
         self.is_running = False
+        self.round_trips = 0 # number of write -> read exchanges with the target
+        self._flash_programmer = None
+        self.flight = FlightRecorder()
         baudrate = int(self.target_freq/self.divisor)
-        Serial.__init__(self, port, baudrate=baudrate)
+        self.transport = port if isinstance(port, Transport) else SerialTransport(port, baudrate)
+        self.baudrate = baudrate
 
-        if not self.isOpen():
-            self.open()
-        assert self.isOpen()
+        assert self.is_open
         assert baudrate * 0.95 <= self.baudrate <= baudrate * 1.05 # baud stability within 5%
         self.timeout = 4 #(s?)
 
-        print("Connecting to the device...")
+        log.info("Connecting to the device...")
         assert self._dw_cmd_break()
         self._dw_cmd_set_baud_rate(self.divisor)
         self.device_fingerprint = self._dw_cmd_fingerprint()
-        print(f"Connected to the device. DW ID is {hexlify(self.device_fingerprint)}")
+        log.info("Connected to the device. DW ID is %s", hexlify(self.device_fingerprint))
 
         if self.device_fingerprint in devices:
             self.dev = devices[self.device_fingerprint]
-            print(f"Device found:\n\t name: {self.dev.NAME}")
+            log.info("Device found:\n\t name: %s", self.dev.NAME)
 
         if reset_execution:
-            print("Resetting program execution")
+            log.info("Resetting program execution")
             self._dw_cmd_reset()
         if not break_execution:
             self._dw_cmd_continue()
             self.is_running = True
 
-    def open(self):
-        print(f"Opening serial port @ {self.baudrate} baud")
-        Serial.open(self)
+    @property
+    def baudrate(self):
+        return self.transport.baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self.transport.baudrate = value
+
+    @property
+    def timeout(self):
+        return self.transport.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.transport.timeout = value
+
+    @property
+    def is_open(self):
+        return self.transport.is_open
+
+    def write(self, data):
+        return self.transport.write(data)
+
+    def read(self, size=1):
+        return self.transport.read(size)
+
+    def reset_input_buffer(self):
+        self.transport.reset_input_buffer()
+
+    def send_break(self, duration=0.25):
+        self.transport.send_break(duration)
+
+    def close(self):
+        self.transport.close()
 
     def dw_cmd(self, cmd: bytes, response_length: int):
+        """
+        sends a command (or a stream of commands) and reads back its echo and the response in a single read.
+        :return: the response bytes or None if no response is expected
+        """
+        if self.metrics is not None:
+            return self._dw_cmd_measured(cmd, response_length)
         self.reset_input_buffer()
         self.write(cmd)
+        self.flight.record(DW_WRITE, cmd)
+        self.round_trips += 1
 
-        r = self.read(len(cmd))
-        if r != cmd:
-            print(f"ERROR: {cmd}, {r}")
-            assert False
+        r = self.read(len(cmd) + response_length)
+        self.flight.record(DW_READ, r)
+        if r[:len(cmd)] != cmd:
+            self._echo_failure(cmd, r[:len(cmd)])
 
+        returned = r[len(cmd):] if response_length > 0 else None
+        return returned
+
+    def _dw_cmd_measured(self, cmd: bytes, response_length: int):
+        """
+        dw_cmd reading the echo and the response separately, to time them
+        """
+        start = time.perf_counter()
+        self.reset_input_buffer()
+        self.write(cmd)
+        self.flight.record(DW_WRITE, cmd)
+        self.round_trips += 1
+        echo = self.read(len(cmd))
+        echoed = time.perf_counter()
         returned = self.read(response_length) if response_length > 0 else None
-        # print(f"{hexlify(cmd)} - answ: {hexlify(returned if returned is not None else b'')}")
+        self.metrics.command(cmd, response_length, start, echoed, time.perf_counter())
+        self.flight.record(DW_READ, echo + (returned or b''))
+        if echo != cmd:
+            self._echo_failure(cmd, echo)
         return returned
 
+    def _echo_failure(self, cmd, echo):
+        self.flight.record(DW_ERROR, echo)
+        self.dump_flight_record(f"echo mismatch: sent {hexlify(cmd).decode()}, got back {hexlify(echo).decode()}")
+        assert False, f"echo mismatch: sent {cmd}, got back {echo}"
+
+    def dump_flight_record(self, reason):
+        """
+        logs the last protocol events and saves them (binary, see dwire.FlightRecorder) to flight_dump_dir
+        :return: the path of the dump, or None
+        """
+        path = None
+        if self.flight_dump_dir is not None:
+            path = os.path.join(self.flight_dump_dir, f"dwire-flight-{os.getpid()}-{int(time.time())}.dwfr")
+            try:
+                self.flight.dump(path)
+            except OSError as e:
+                log.error("flight record not saved: %s", e)
+                path = None
+        log.error("%s. last protocol events (saved to %s):\n%s", reason, path, self.flight.format(64))
+        return path
+
+    def enable_metrics(self, trace=False):
+        """
+        starts collecting command latencies (see dwire.Metrics)
+        :param trace: keeps every command as a chrome trace event too
+        :return: the Metrics
+        """
+        self.metrics = Metrics(trace)
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def transaction(self):
+        """
+        creates a new command batch. use as a context manager or call commit() explicitly.
+        :return:
+        """
+        return DWTransaction(self)
+
+    def _sink(self, txn):
+        return self if txn is None else txn
+
     def _dw_cmd_break(self):
         """
         Sends a break command to the target. expects a 0x55 as an answer.
@@ -69,9 +234,13 @@ class SerialDW(Serial):
         baudrate = int(self.target_freq / self.divisor)
         self.baudrate = baudrate
         assert baudrate * 0.95 <= self.baudrate <= baudrate * 1.05  # baud stability within 5%
+        self.reset_input_buffer() # e.g. the rest of a break the target sent while running
         self.send_break(0)
+        self.flight.record(DW_BREAK)
         self.is_running = False
-        return self.read(2) == b'\x00\x55'
+        r = self.read(2)
+        self.flight.record(DW_READ, r)
+        return r == b'\x00\x55'
 
     def _dw_cmd_set_baud_rate(self, divisor):
         """
@@ -95,13 +264,13 @@ class SerialDW(Serial):
         """
         return self.dw_cmd(b'\xf3', 2)
 
-    def _dw_cmd_continue(self, cmd=CONTINUE):
+    def _dw_cmd_continue(self, cmd=CONTINUE, txn=None):
         """
         tells the target to continue the program execution from where the pc is set
         :return:
         """
         self.is_running = True
-        return self.dw_cmd(cmd, 0)
+        return self._sink(txn).dw_cmd(cmd, 0)
 
     def _dw_cmd_disable(self):
         """
@@ -117,12 +286,13 @@ class SerialDW(Serial):
         """
         return self.dw_cmd(b'\x07', 2) == b'\x00\x55'
 
-    def _dw_cmd_start_mem_cycle(self):
+    def _dw_cmd_start_mem_cycle(self, response_length=0, txn=None):
         """
         this is a command used to issue a memory (sram/flash) read/write cycle
+        :param response_length: number of bytes the cycle will send back (reads)
         :return:
         """
-        return self.dw_cmd(b'\x20', 0)
+        return self._sink(txn).dw_cmd(b'\x20', response_length)
 
     def _dw_cmd_start_reg_cycle(self):
         """
@@ -138,12 +308,12 @@ class SerialDW(Serial):
         """
         return self.dw_cmd(b'\x23', 0)
 
-    def _dw_cmd_single_step(self):
+    def _dw_cmd_single_step(self, txn=None):
         """
         single steps to the next instruction (PC increment twice?)
         :return:
         """
-        return self.dw_cmd(b'\x31', 0)
+        return self._sink(txn).dw_cmd(b'\x31', 0)
 
     def _dw_cmd_continue_inst_override(self):
         """
@@ -153,15 +323,17 @@ class SerialDW(Serial):
         """
         return self.dw_cmd(b'\x32', 0)
 
-    def _dw_cmd_single_step_slow(self):
+    def _dw_cmd_single_step_slow(self, txn=None):
         """
-        single step for slow loaded instruction (spm). wait for \x00\x55
-        :return:
+        single step for the loaded instruction (slow ones too, e.g. spm). wait for \x00\x55
+        :return: True when done (the result index if queued on txn)
         """
+        if txn is not None:
+            return txn.dw_cmd(b'\x33', 2)
         return self.dw_cmd(b'\x33', 2) == b'\x00\x55'
 
-    def _dw_set_cntxt(self, context, disable_timers=False):
-        self.dw_cmd(bytes([context | ((1 << 5) if disable_timers else 0)]), 0)
+    def _dw_set_cntxt(self, context, disable_timers=False, txn=None):
+        self._sink(txn).dw_cmd(bytes([context | ((1 << 5) if disable_timers else 0)]), 0)
 
     TRGT_SRAM_R = b'\x00'
     TRGT_SRAM_W = b'\x04'
@@ -169,73 +341,85 @@ class SerialDW(Serial):
     TRGT_REGS_W = b'\x05'
     TRGT_FLASH = b'\x02'
 
-    def _dw_set_rw_destination(self, target):
-        self.dw_cmd(b'\xC2' + target, 0)
+    def _dw_set_rw_destination(self, target, txn=None):
+        self._sink(txn).dw_cmd(b'\xC2' + target, 0)
 
-    def _dw_wrt_ctrl_reg_word(self, ctrl_reg, value: bytes):
-        self.dw_cmd(bytes([0xD0 | ctrl_reg]) + value, 0)
+    def _dw_wrt_ctrl_reg_word(self, ctrl_reg, value: bytes, txn=None):
+        self._sink(txn).dw_cmd(bytes([0xD0 | ctrl_reg]) + value, 0)
 
-    def _dw_wrt_ctrl_reg_low(self, ctrl_reg, value: bytes):
-        self.dw_cmd(bytes([0xC0 | ctrl_reg]) + bytes([value[0]]), 0)
+    def _dw_wrt_ctrl_reg_low(self, ctrl_reg, value: bytes, txn=None):
+        self._sink(txn).dw_cmd(bytes([0xC0 | ctrl_reg]) + bytes([value[0]]), 0)
 
-    def _dw_read_ctrl_reg_word(self, ctrl_reg):
-        return self.dw_cmd(bytes([0xF0 | ctrl_reg]), 2)
+    def _dw_read_ctrl_reg_word(self, ctrl_reg, txn=None):
+        return self._sink(txn).dw_cmd(bytes([0xF0 | ctrl_reg]), 2)
 
-    def _dw_read_ctrl_reg_low(self, ctrl_reg):
-        return self.dw_cmd(bytes([0xE0 | ctrl_reg]), 1)
+    def _dw_read_ctrl_reg_low(self, ctrl_reg, txn=None):
+        return self._sink(txn).dw_cmd(bytes([0xE0 | ctrl_reg]), 1)
 
-    def resume_execution(self, pc_address=None, context=CNTXT_GO_TO_HW_BREAKPOINT, disable_timers=False, cmd=CONTINUE):
+    def resume_execution(self, pc_address=None, context=CNTXT_GO_TO_HW_BREAKPOINT, disable_timers=False, cmd=CONTINUE, txn=None):
+        batch = self.transaction() if txn is None else txn
         if pc_address is not None:
-            self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, pc_address)
-        self._dw_set_cntxt(context, disable_timers)
-        self._dw_cmd_continue(cmd)
+            self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, pc_address, txn=batch)
+        self._dw_set_cntxt(context, disable_timers, txn=batch)
+        self._dw_cmd_continue(cmd, txn=batch)
+        if txn is None:
+            batch.commit()
 
-    def load_instruction(self, instruction):
-        self.dw_cmd(b'\xD2' + instruction, 0)
+    def load_instruction(self, instruction, txn=None):
+        self._sink(txn).dw_cmd(b'\xD2' + instruction, 0)
 
-    def exec(self, instruction, long_instruction=False, ret_len=0, aux=b''):
+    def exec(self, instruction, long_instruction=False, ret_len=0, aux=b'', txn=None):
         if type(instruction) is list:
             for i in instruction:
                 assert type(i) is bytes
                 return self.exec(instruction, long_instruction)
         assert len(instruction) == 2
 
-        return self.dw_cmd(b'\xD2' + instruction + (b'\x23' if not long_instruction else b'\x33') + aux, ret_len if not long_instruction else 2+ret_len)
+        return self._sink(txn).dw_cmd(b'\xD2' + instruction + (b'\x23' if not long_instruction else b'\x33') + aux, ret_len if not long_instruction else 2+ret_len)
 
-    def _setup_register_rw(self, start_register, end_register, target):
-        self._dw_set_cntxt(CNTXT_RW, disable_timers=True)  # 66
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x00' + bytes([start_register]))
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_HWBP, b'\x00' + bytes([end_register]))
-        self._dw_set_rw_destination(target)  # C2 01
-        self._dw_cmd_start_mem_cycle()  # registers are contiguous mem
-
-    def read_registers(self, start_register, end_register=None):
+    def _setup_register_rw(self, start_register, end_register, target, response_length=0, txn=None):
+        """
+        queues a register read/write cycle on txn (or a new transaction if None)
+        :return: the result index (txn given) or the cycle response
+        """
+        batch = self.transaction() if txn is None else txn
+        self._dw_set_cntxt(CNTXT_RW, disable_timers=True, txn=batch)  # 66
+        self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x00' + bytes([start_register]), txn=batch)
+        self._dw_wrt_ctrl_reg_word(CTRL_REG_HWBP, b'\x00' + bytes([end_register]), txn=batch)
+        self._dw_set_rw_destination(target, txn=batch)  # C2 01
+        idx = self._dw_cmd_start_mem_cycle(response_length, txn=batch)  # registers are contiguous mem
+        return idx if txn is not None else batch.commit()[idx]
+
+    def read_registers(self, start_register, end_register=None, txn=None):
         end_register = end_register if end_register is not None else start_register + 1
-        self._setup_register_rw(start_register, end_register, self.TRGT_REGS_R)
-        return self.read(end_register - start_register)
+        return self._setup_register_rw(start_register, end_register, self.TRGT_REGS_R, end_register - start_register, txn=txn)
 
-    def write_registers(self, data, start_register, length=None):
+    def write_registers(self, data, start_register, length=None, txn=None):
         end_register = start_register + len(data)
         if length is not None:
             data = data[:length]
             end_register = start_register + length
-        self._setup_register_rw(start_register, end_register, self.TRGT_REGS_W)
-        self.dw_cmd(data, 0)
+        batch = self.transaction() if txn is None else txn
+        self._setup_register_rw(start_register, end_register, self.TRGT_REGS_W, txn=batch)
+        batch.dw_cmd(data, 0)
+        if txn is None:
+            batch.commit()
 
-    def read_mem(self, addr, len, target):
+    def read_mem(self, addr, len, target, txn=None):
         """
         Do not read addresses 30, 31 or DWDR of sram as these interfere with the read process. should not exceed 128bytes at a time
         :param addr:
         :param len:
-        :return:
+        :return: the read bytes (or the result index if txn is given)
         """
         assert 1 <= len
-        self.write_registers(int.to_bytes(addr, 2, 'little'), REG_Z, 2)  # set address in Z reg - sends 66 too
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x00\x00')
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_HWBP, int.to_bytes(len * 2, 2, 'big'))
-        self._dw_set_rw_destination(target)
-        self._dw_cmd_start_mem_cycle()
-        return self.read(len)
+        batch = self.transaction() if txn is None else txn
+        self.write_registers(int.to_bytes(addr, 2, 'little'), REG_Z, 2, txn=batch)  # set address in Z reg - sends 66 too
+        self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x00\x00', txn=batch)
+        self._dw_wrt_ctrl_reg_word(CTRL_REG_HWBP, int.to_bytes(len * 2, 2, 'big'), txn=batch)
+        self._dw_set_rw_destination(target, txn=batch)
+        idx = self._dw_cmd_start_mem_cycle(len, txn=batch)
+        return idx if txn is not None else batch.commit()[idx]
 
     def read_sram(self, addr, len):
         return self.read_mem(addr, len, SerialDW.TRGT_SRAM_R)
@@ -251,106 +435,174 @@ class SerialDW(Serial):
         if length is not None:
             data = data[:length]
 
-        self.write_registers(int.to_bytes(addr, 2, 'little'), REG_Z, 2) # set address in Z reg - sends 66 too
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x00\x01')
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_HWBP, int.to_bytes(len(data)*2+1, 2, 'big'))
-        self._dw_set_rw_destination(SerialDW.TRGT_SRAM_W)
-        self._dw_cmd_start_mem_cycle()
-        self.dw_cmd(data, 0)
+        with self.transaction() as txn:
+            self.write_registers(int.to_bytes(addr, 2, 'little'), REG_Z, 2, txn=txn) # set address in Z reg - sends 66 too
+            self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x00\x01', txn=txn)
+            self._dw_wrt_ctrl_reg_word(CTRL_REG_HWBP, int.to_bytes(len(data)*2+1, 2, 'big'), txn=txn)
+            self._dw_set_rw_destination(SerialDW.TRGT_SRAM_W, txn=txn)
+            self._dw_cmd_start_mem_cycle(txn=txn)
+            txn.dw_cmd(data, 0)
 
     def read_flash(self, addr, len):
         return self.read_mem(addr, len, SerialDW.TRGT_FLASH)
 
-    def clear_flash_page(self, addr):
-        # write XYZ registers
-        self.write_registers(b'\x03\x01\x05\x40' + int.to_bytes(addr, 2, 'little'), REG_X)
+    @property
+    def flash_programmer(self):
+        if self._flash_programmer is None or self._flash_programmer.dev is not self.dev:
+            self._flash_programmer = FlashPageProgrammer(self.dev)
+        return self._flash_programmer
 
-        # set pc inside boot region (allows spm)
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00')
-
-        self._dw_set_cntxt(CNTXT_WRT_FLASH, True)  # change context 64 - code execution
-        self.exec(OUT(self.dev.SPMCSR, 26))  # SPMCSR = 0x03 -> flash page erase
-        self.exec(SPM(), True)
-
-        self._dw_cmd_set_baud_rate(self.divisor)
-        # Erased page @ address
-
-    def write_flash_page(self, data, addr, clear_wrt_buf=True, progress=False):
-        # write XYZ registers
-        self.write_registers(b'\x03\x01\x05\x40' + int.to_bytes(addr, 2, 'little'), REG_X)
-
-        # set pc inside boot region (allows spm)
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00')
-
-        self._dw_set_cntxt(CNTXT_WRT_FLASH, True)  # change context 64 - code execution
-        self.exec(MOVW(24, 30)) # saves a copy of the start address to r24:r25
-        self.exec(OUT(self.dev.SPMCSR, 26)) # SPMCSR = 0x03 -> flash page erase
-        self.exec(SPM(), True)
+    def clear_flash_page(self, addr):
+        programmer = self.flash_programmer
+        with self.transaction() as txn:
+            self.write_registers(programmer.setup_registers(addr), REG_X, txn=txn)
+            erased = txn.dw_cmd(programmer.erase, 2)
+        assert txn.results[erased] == SYNC
 
         self._dw_cmd_set_baud_rate(self.divisor)
         # Erased page @ address
 
-        self._dw_set_cntxt(CNTXT_WRT_FLASH)  # change context 44
-        # And then repeat the following until the page is full.
-        data = [data[i:i+2] for i in range(0, len(data), 2)]
-        for i in (tqdm(data) if progress else data):
-            self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00') # make spm possible
-            self.exec(IN(0, self.dev.DWRD), aux=bytes([i[0]])) # load r0 with low byte
-            self.exec(IN(1, self.dev.DWRD), aux=bytes([i[1]])) # load r1 with high byte
-            #written value in r0:r1
-            #address has been already set in Z before
-            self.exec(OUT(self.dev.SPMCSR, 27)) #write SPMCS = 1 --> prepare for buffer fill at [Z]
-            self.exec(SPM())
-            self.exec(ADIW(3, 2)) #increment Z + 2 (next word)
-
-        self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00')
-        self.exec(MOVW(30, 24)) # restore original address after buffer fill
-        self.exec(OUT(self.dev.SPMCSR, 28)) # SPMCSR = 5 -> write to page
-        self.exec(SPM(), True) #execute page write
-        #self._dw_cmd_set_baud_rate(self.divisor) #Just because i can...
+    def write_flash_page(self, data, addr, clear_wrt_buf=True):
+        """
+        erases and programs a flash page. the whole sequence is sent as a stream, syncing only on spm slow steps:
+        two round trips per page (the erase, then the baud resync, buffer fill and page write), three with RWWSRE.
+        the fill sends 25 bytes per flash word, so the page time is bound by the line speed rather than the round
+        trips below about 4ms of adapter latency (bench_flash, divisor 128: x21 over per command programming at 16ms,
+        x7 at 4ms, x2.5 at 1ms). on low latency adapters raise the line speed instead (see set_com_divisor).
+        :param data: page content (FLASH_PAGEEND bytes)
+        :param addr: page address
+        :param clear_wrt_buf: performs RWWSRE after the page write. not needed between the pages of a firmware:
+        the page buffer is cleared by the page write, the RWW section only has to be enabled before reading it
+        (see enable_rww)
+        :return:
+        """
+        programmer = self.flash_programmer
+        with self.transaction() as txn:
+            self.write_registers(programmer.setup_registers(addr), REG_X, txn=txn)
+            erased = txn.dw_cmd(programmer.erase, 2) # leaves the page address in Z and r24:r25
+            txn.dw_cmd(_dw_baud_divisor_bytes[int(math.log2(self.divisor))], 0) # resync after the erase
+            written = txn.dw_cmd(programmer.fill_stream(data), 2)
+            if clear_wrt_buf:
+                cleared = txn.dw_cmd(programmer.rwwsre, 2) # clears the buffer, enables reading the flash
+        assert txn.results[erased] == SYNC
+        assert txn.results[written] == SYNC
 
         if clear_wrt_buf:
-            #performs RWWSRE (clears the buffer) IS THIS NOT NECESSARY?
-            self._dw_wrt_ctrl_reg_word(CTRL_REG_PC, b'\x1F\x00')
-            self.exec(LDI(28, 0x11))
-            self.exec(OUT(self.dev.SPMCSR, 28))
-            self.exec(SPM(), True)
+            assert txn.results[cleared] == SYNC
             self._dw_cmd_set_baud_rate(self.divisor)
 
+    def enable_rww(self):
+        """
+        RWWSRE: enables reading the flash after a sequence of page writes and erases
+        """
+        with self.transaction() as txn:
+            cleared = txn.dw_cmd(self.flash_programmer.rwwsre, 2)
+        assert txn.results[cleared] == SYNC
+        self._dw_cmd_set_baud_rate(self.divisor)
+
     def read_eeprom(self, addr, len):
+        """
+        reads len bytes of eeprom. the address registers are set up once, then the target increments Z
+        and sends one byte per round trip.
+        uses r0, Y and Z
+        :return:
+        """
         assert len >= 1
-        #can be far more optimized =(
         # read EECR.EEPE to check no write is in progress
 
-        buf = b''
-        for i in range(len):
-            #set Z (r30 r31) as starting address
-            self.write_registers(b'\x01\x01' + int.to_bytes(addr + i, 2, 'little'), REG_Y)
-            self._dw_set_cntxt(CNTXT_WRT_FLASH, True) #change context
-            self.exec(OUT(self.dev.EEARH, 31))
-            self.exec(OUT(self.dev.EEARL, 30))
-                # ;EEAR EEPROM ADDR REGISTER = Z
-            self.exec(OUT(self.dev.EECR, 28))
-                # ; EEprom Ctrl Register = 01 YL ==> EERE (EEprom Read enable)
-            self.exec(IN(0, self.dev.EEDR))
-            self.exec(OUT(self.dev.DWRD, 0))
-                # ; send data over dw
-            buf += self.read(1)
-        return buf
+        # EEARL = ZL, EECR = YL (0x01 EERE: eeprom read enable), r0 <- EEDR, send r0 over dw
+        read_byte = EXEC(OUT(self.dev.EEARL, 30)) \
+            + EXEC(OUT(self.dev.EECR, 28)) \
+            + EXEC(IN(0, self.dev.EEDR)) \
+            + EXEC(OUT(self.dev.DWRD, 0))
+        set_high = EXEC(OUT(self.dev.EEARH, 31))  # EEARH = ZH, only when it changes
+        next_byte = EXEC(ADIW(3, 1)) + read_byte  # Z += 1
+        next_byte_high = EXEC(ADIW(3, 1)) + set_high + read_byte
+
+        buf = bytearray(len)
+        with self.transaction() as txn:
+            self.write_registers(b'\x01\x01' + int.to_bytes(addr, 2, 'little'), REG_Y, txn=txn)
+            self._dw_set_cntxt(CNTXT_WRT_FLASH, True, txn=txn) #change context
+            first = txn.dw_cmd(set_high + read_byte, 1)
+        buf[0] = txn.results[first][0]
+        for i in range(1, len):
+            buf[i] = self.dw_cmd(next_byte if (addr + i) & 0xFF else next_byte_high, 1)[0]
+        return bytes(buf)
+
+    def _eeprom_mode(self, old, new):
+        """
+        :return: the EEPM bits needed to turn old into new
+        """
+        if new == 0xFF:
+            return EEPM_ERASE  # erasing sets all the bits
+        if old & new == new:
+            return EEPM_WRITE  # writing can only clear bits
+        return EEPM_ATOMIC
+
+    def _eeprom_wait_ready(self, txn=None, timeout=0.1):
+        """
+        polls EECR.EEPE until no eeprom write is in progress. the first poll can be queued on txn
+        (the write stream that precedes it is flushed with it).
+        uses r0
+        """
+        poll = EXEC(IN(0, self.dev.EECR)) + EXEC(OUT(self.dev.DWRD, 0))
+        eecr = self._sink(txn).dw_cmd(poll, 1)
+        if txn is not None:
+            eecr = txn.commit()[eecr]
+        deadline = time.monotonic() + timeout
+        while eecr[0] & EECR_EEPE:
+            assert time.monotonic() < deadline, "eeprom write timed out"
+            eecr = self.dw_cmd(poll, 1)
 
     def write_eeprom(self, data, addr, length=None):
+        """
+        writes the eeprom bytes that differ from data. the current content is read first, then each
+        changed byte is written with erase-only, write-only or atomic mode depending on the bits to change.
+        the writes are chained in one stream and EECR.EEPE is polled only before the first and after the last:
+        the setup of the next byte (EEAR and EEDR are written last) is padded with nops so that its wire time
+        covers the write time of the previous one.
+        uses r0, X, Y and Z
+        :return: the number of written bytes
+        """
         if length is not None:
             data = data[:length]
-        # can be far more optimized =(
+        if len(data) == 0:
+            return 0
+        current = self.read_eeprom(addr, len(data))  # leaves the context set for code execution
+
+        self._eeprom_wait_ready()
+        byte_time = 10 / self.baudrate # s on the wire per byte
+        busy = 0 # s, write time of the previous byte still to cover
+        mode = None
+        high = None
+        written = 0
+        stream = b''
         for i in range(len(data)):
-            self.write_registers(b'\x04\x02\x01\x01' + int.to_bytes(addr + i, 2, 'little'), REG_X)
-            self._dw_set_cntxt(CNTXT_WRT_FLASH, True)  # change context
-            self.exec(OUT(self.dev.EEARH, 31))
-            self.exec(OUT(self.dev.EEARL, 30))
-            self.exec(IN(0, self.dev.DWRD), aux=bytes([data[i]]))
-            self.exec(OUT(self.dev.EEDR, 0))
-            self.exec(OUT(self.dev.EECR, 26))
-            self.exec(OUT(self.dev.EECR, 27))
-
-
-
+            if current[i] == data[i]:
+                continue
+            address = addr + i
+            setup = EXEC(LDI(30, address & 0xFF)) + EXEC(IN(0, self.dev.DWRD), aux=bytes([data[i]]))
+            store = EXEC(OUT(self.dev.EEARL, 30))
+            if address >> 8 != high:
+                high = address >> 8
+                setup += EXEC(LDI(31, high))
+                store += EXEC(OUT(self.dev.EEARH, 31))
+            byte_mode = self._eeprom_mode(current[i], data[i])
+            if byte_mode != mode:
+                mode = byte_mode
+                setup += EXEC(LDI(26, mode | EECR_EEMPE)) + EXEC(LDI(27, mode | EECR_EEPE))
+            missing = math.ceil(busy / byte_time) - len(setup)
+            if missing > 0:
+                setup += EXEC(NOP()) * math.ceil(missing / len(EXEC(NOP())))
+            stream += setup + store + EXEC(OUT(self.dev.EEDR, 0)) + EXEC(OUT(self.dev.EECR, 26)) + EXEC(OUT(self.dev.EECR, 27))
+            busy = EEPROM_WRITE_TIME[mode] * EEPROM_TIME_MARGIN
+            written += 1
+            if len(stream) >= EEPROM_STREAM_CHUNK:
+                self.dw_cmd(stream, 0)
+                stream = b''
+
+        txn = self.transaction()
+        if stream:
+            txn.dw_cmd(stream, 0)
+        self._eeprom_wait_ready(txn)
+        return written
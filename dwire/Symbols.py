@@ -0,0 +1,139 @@
+import re
+import struct
+from bisect import bisect_right
+
+DATA_BASE = 0x800000 # avr-gcc address of the data space: code symbols are below
+EEPROM_BASE = 0x810000
+
+ELF_MAGIC = b'\x7fELF'
+_elf_header = struct.Struct('<16sHHIIIIIHHHHHH')
+_elf_section = struct.Struct('<IIIIIIIIII')
+_elf_symbol = struct.Struct('<IIIBBH')
+SHT_SYMTAB = 2
+STT_OBJECT, STT_FUNC = 1, 2
+
+_map_section = re.compile(r'^ (\.\S+)(?:\s+0x([0-9a-fA-F]+)\s+0x([0-9a-fA-F]+)\s+\S.*)?$')
+_map_section_cont = re.compile(r'^\s+0x([0-9a-fA-F]+)\s+0x([0-9a-fA-F]+)\s+\S.*$')
+_map_symbol = re.compile(r'^\s+0x([0-9a-fA-F]+)\s+([A-Za-z_][\w.$]*)$')
+
+
+def _space_address(value, data):
+    """
+    :return: the address of a symbol value in the code (byte address) or data space, None if it is in the other one
+    """
+    if data:
+        return value - DATA_BASE if DATA_BASE <= value < EEPROM_BASE else None
+    return value if value < DATA_BASE else None
+
+
+class SymbolTable:
+    """
+    Code (or data) symbols as (start, end) byte address ranges sorted by start, looked up with bisect.
+    """
+    def __init__(self, symbols):
+        """
+        :param symbols: iterable of (name, start, end), end None if the size is unknown (the symbol ends where
+        the next one starts)
+        """
+        symbols = sorted(symbols, key=lambda s: (s[1], s[0]))
+        self.names = [name for name, _, _ in symbols]
+        self.starts = [start for _, start, _ in symbols]
+        self.ends = [end if end is not None else (symbols[i + 1][1] if i + 1 < len(symbols) else start + 2)
+                     for i, (_, start, end) in enumerate(symbols)]
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, address: int):
+        """
+        :param address: byte address
+        :return: the name of the symbol containing address, None if there is none
+        """
+        i = bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.ends[i]:
+            return self.names[i]
+        return None
+
+    def name(self, address: int):
+        """
+        :return: the symbol name or the hex address if no symbol contains it
+        """
+        return self.lookup(address) or f"{address:#06x}"
+
+    def find(self, name):
+        """
+        :return: (start, end) of the symbol called name
+        """
+        i = self.names.index(name)
+        return self.starts[i], self.ends[i]
+
+    @classmethod
+    def load(cls, path, data=False):
+        """
+        reads the symbols of an ELF file or of a linker map file (ld -Map)
+        :param data: load the data space symbols (variables, addresses relative to the data space) instead of the code ones
+        """
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+        return cls.from_elf(path, data) if magic == ELF_MAGIC else cls.from_map(path, data)
+
+    @classmethod
+    def from_elf(cls, path, data=False):
+        with open(path, 'rb') as f:
+            elf = f.read()
+        header = _elf_header.unpack_from(elf)
+        if header[0][:4] != ELF_MAGIC or header[0][4] != 1 or header[0][5] != 1:
+            raise ValueError(f"{path} is not a 32 bit little endian ELF file")
+        shoff, shentsize, shnum = header[6], header[11], header[12]
+        sections = [_elf_section.unpack_from(elf, shoff + i * shentsize) for i in range(shnum)]
+        symbols = []
+        for section in sections:
+            if section[1] != SHT_SYMTAB:
+                continue
+            strtab = sections[section[6]]
+            for offset in range(section[4], section[4] + section[5], _elf_symbol.size):
+                name, value, size, info, _, shndx = _elf_symbol.unpack_from(elf, offset)
+                address = _space_address(value, data)
+                if info & 0x0F not in (STT_FUNC, STT_OBJECT) or shndx == 0 or address is None:
+                    continue
+                name = elf[strtab[4] + name:elf.index(b'\0', strtab[4] + name)].decode()
+                symbols.append((name, address, address + size if size else None))
+        return cls(symbols)
+
+    @classmethod
+    def from_map(cls, path, data=False):
+        """
+        symbols of the code (or data) sections of a linker map (the map has no symbol sizes)
+        """
+        symbols = []
+        section_end = None
+        pending = None # input section name wrapped on its own line
+        with open(path) as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if pending is not None:
+                    match = _map_section_cont.match(line)
+                    pending = None
+                    if match:
+                        section_end = _space_address(int(match.group(1), 16) + int(match.group(2), 16), data)
+                        continue
+                match = _map_section.match(line)
+                if match:
+                    if match.group(2) is None:
+                        pending = match.group(1)
+                    else:
+                        section_end = _space_address(int(match.group(2), 16) + int(match.group(3), 16), data)
+                    continue
+                match = _map_symbol.match(line)
+                address = _space_address(int(match.group(1), 16), data) if match else None
+                if address is not None and section_end is not None:
+                    symbols.append([match.group(2), address, section_end])
+        # aliases (same address) are merged, a symbol ends at the next one or at the end of its input section
+        merged = []
+        for name, start, end in sorted(symbols, key=lambda s: s[1]):
+            if not merged or merged[-1][1] != start:
+                merged.append([name, start, end])
+        for current, following in zip(merged, merged[1:]):
+            if not current[1] < current[2] < following[1]:
+                current[2] = following[1] # empty input section (e.g. .init0) or overlapping the next symbol
+        return cls(merged)
@@ -0,0 +1,39 @@
+import mmap
+import struct
+import sys
+from array import array
+
+TRACE_MAGIC = b'DWTR'
+TRACE_VERSION = 1
+# magic, version, entry size, number of entries. entries follow: little endian uint16 instruction addresses
+HEADER = struct.Struct('<4sHHI')
+
+
+def save_trace(path, trace: array):
+    """
+    writes a trace (array('H') of instruction addresses) to a binary file that can be memory mapped
+    """
+    data = array('H', trace)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, data.itemsize, len(data)))
+        data.tofile(f)
+
+
+def load_trace(path):
+    """
+    memory maps a trace file
+    :return: sequence of the instruction addresses (a memoryview on the mapped file, a copy on big endian hosts)
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, size, count = HEADER.unpack_from(mapped)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION or size != 2:
+        raise ValueError(f"{path} is not a trace file")
+    entries = memoryview(mapped)[HEADER.size:HEADER.size + count * size]
+    if sys.byteorder != 'little':
+        data = array('H', entries.tobytes())
+        data.byteswap()
+        return data
+    return entries.cast('H')
@@ -0,0 +1,190 @@
+import logging
+import struct
+import threading
+import time
+from collections import namedtuple, deque
+
+log = logging.getLogger(__name__)
+
+Variable = namedtuple('Variable', 'name space address length')
+
+LOG_MAGIC = b'DWVL'
+LOG_VERSION = 1
+# magic, version, number of variables, record size. variables follow (name, space, address, length), then the
+# records: little endian double timestamp (s from the first sample) and the variables content
+LOG_HEADER = struct.Struct('<4sHHH')
+LOG_VARIABLE = struct.Struct('<32s4sHH')
+LOG_TIMESTAMP = struct.Struct('<d')
+
+
+def resolve_variables(variables, symbols=None):
+    """
+    :param variables: list of data symbol names (resolved in symbols), data space addresses (one byte) or
+    (space, address, length) regions, as read_regions
+    :param symbols: data SymbolTable (SymbolTable.load(path, data=True))
+    :return: list of Variable
+    """
+    resolved = []
+    for variable in variables:
+        if isinstance(variable, Variable):
+            resolved.append(variable)
+        elif isinstance(variable, str):
+            if symbols is None:
+                raise ValueError(f"No symbols to resolve {variable}")
+            start, end = symbols.find(variable)
+            resolved.append(Variable(variable, 'data', start, end - start))
+        elif isinstance(variable, int):
+            resolved.append(Variable(f"{variable:#06x}", 'data', variable, 1))
+        else:
+            space, address, length = variable
+            resolved.append(Variable(f"{space}:{address:#x}", space, address, length))
+    return resolved
+
+
+class SampleRing:
+    """
+    Fixed size buffer of (timestamp, data) samples between the sampling loop and the writer thread.
+    When the writer falls behind the oldest samples are overwritten and counted as dropped.
+    """
+    def __init__(self, capacity=4096):
+        self.samples = deque(maxlen=capacity)
+        self.ready = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, sample):
+        with self.ready:
+            if len(self.samples) == self.samples.maxlen:
+                self.dropped += 1
+            self.samples.append(sample)
+            self.ready.notify()
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+
+    def drain(self, timeout=None):
+        """
+        waits for samples
+        :return: the buffered samples, an empty list once closed and empty
+        """
+        with self.ready:
+            self.ready.wait_for(lambda: self.samples or self.closed, timeout)
+            samples = list(self.samples)
+            self.samples.clear()
+            return samples
+
+
+class LogWriter(threading.Thread):
+    """
+    Streams the samples of a ring to a csv (one column per variable, little endian unsigned values) or binary file
+    """
+    def __init__(self, ring: SampleRing, variables, path, binary=False):
+        super().__init__(name=f"log writer {path}", daemon=True)
+        self.ring = ring
+        self.variables = variables
+        self.path = path
+        self.binary = binary
+        self.written = 0
+
+    def _header(self, f):
+        if self.binary:
+            f.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, len(self.variables), sum(v.length for v in self.variables)))
+            for v in self.variables:
+                f.write(LOG_VARIABLE.pack(v.name.encode(), v.space.encode(), v.address, v.length))
+        else:
+            f.write(','.join(['time'] + [v.name for v in self.variables]) + '\n')
+
+    def _record(self, timestamp, data):
+        if self.binary:
+            return LOG_TIMESTAMP.pack(timestamp) + data
+        values = []
+        offset = 0
+        for v in self.variables:
+            values.append(str(int.from_bytes(data[offset:offset + v.length], 'little')))
+            offset += v.length
+        return f"{timestamp:.6f},{','.join(values)}\n"
+
+    def run(self):
+        with open(self.path, 'wb' if self.binary else 'w') as f:
+            self._header(f)
+            while True:
+                samples = self.ring.drain()
+                if not samples:
+                    break
+                f.write((b'' if self.binary else '').join(self._record(*sample) for sample in samples))
+                self.written += len(samples)
+
+
+class VariableLogger:
+    """
+    Samples variables of the running target: each sample halts it, reads all the variables with one planned
+    read (read_regions) and resumes it. The samples go to a ring buffer, written to a file by a background thread.
+    """
+    def __init__(self, dw, variables, rate=50, capacity=4096):
+        """
+        :param dw: DWInterface
+        :param variables: list of Variable (see resolve_variables)
+        :param rate: samples per second
+        """
+        self.dw = dw
+        self.variables = variables
+        self.rate = rate
+        self.ring = SampleRing(capacity)
+        self.intrusion = [] # s, time halted per sample
+        self.elapsed = 0 # s, logging time
+        self.start = None
+
+    def sample(self):
+        """
+        :return: False if the target was found halted (breakpoint): logging stops
+        """
+        if self.dw.wait_hit(0):
+            return False
+        start = time.monotonic()
+        self.dw.halt()
+        contents, _ = self.dw.read_regions([(v.space, v.address, v.length) for v in self.variables])
+        self.dw.resume_execution()
+        end = time.monotonic()
+        self.intrusion.append(end - start)
+        if self.start is None:
+            self.start = start
+        self.ring.put((start - self.start, b''.join(contents)))
+        return True
+
+    def run(self, duration=None, samples=None, path=None, binary=False):
+        """
+        logs for duration seconds or samples samples
+        :param path: file the samples are streamed to, if None they are left in the ring
+        """
+        assert duration is not None or samples is not None
+        writer = None
+        if path is not None:
+            writer = LogWriter(self.ring, self.variables, path, binary)
+            writer.start()
+        start = time.monotonic()
+        deadline = start
+        taken = 0
+        try:
+            while (duration is None or time.monotonic() - start < duration) and (samples is None or taken < samples):
+                deadline = max(deadline + 1 / self.rate, time.monotonic()) # no bursts after a late sample
+                time.sleep(max(0, deadline - time.monotonic()))
+                if not self.sample():
+                    log.warning("Target halted, logging stopped")
+                    break
+                taken += 1
+        finally:
+            self.elapsed += time.monotonic() - start
+            if writer is not None:
+                self.ring.close()
+                writer.join()
+
+    def report(self):
+        count = len(self.intrusion)
+        if count == 0:
+            return "no samples"
+        halted = sum(self.intrusion)
+        return (f"{count} samples in {self.elapsed:.2f}s ({count / self.elapsed:.1f}/s, target {self.rate}/s), "
+                f"{halted / count * 1000:.2f}ms halted per sample (max {max(self.intrusion) * 1000:.2f}ms, "
+                f"{halted / self.elapsed * 100:.1f}% of the time), {self.ring.dropped} dropped")
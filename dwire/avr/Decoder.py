@@ -0,0 +1,77 @@
+from collections import namedtuple
+
+# control flow kinds
+SEQUENTIAL = 'seq' # next instruction only
+BRANCH = 'branch' # conditional relative branch: next instruction or target
+JUMP = 'jump' # unconditional direct jump: target
+CALL = 'call' # direct call: target, returns to the next instruction
+SKIP = 'skip' # next instruction or the one after it
+INDIRECT_JUMP = 'ijmp' # unknown target (Z)
+INDIRECT_CALL = 'icall' # unknown target (Z), returns to the next instruction
+RETURN = 'ret' # unknown target (stack)
+BREAK = 'break'
+
+Instruction = namedtuple('Instruction', ['length', 'kind', 'target']) # length in words, target word address or None
+
+
+def _signed(value, bits):
+    return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+
+def instruction_length(word: int):
+    """
+    :return: the length in words of the instruction starting with word (LDS, STS, JMP and CALL are 2 words long)
+    """
+    if word & 0xFE0F in (0x9000, 0x9200) or word & 0xFE0C == 0x940C:
+        return 2
+    return 1
+
+
+def decode(word: int, next_word=0, pc=0, flash_words=0x10000):
+    """
+    decodes the control flow of an instruction
+    :param word: the instruction word
+    :param next_word: the following word (second word of 32 bit instructions)
+    :param pc: word address of the instruction, used to compute relative targets
+    :param flash_words: flash size of the device in words: relative jumps wrap around it
+    :return: Instruction
+    """
+    length = instruction_length(word)
+    if word & 0xF000 == 0xC000: # RJMP
+        return Instruction(1, JUMP, (pc + 1 + _signed(word & 0x0FFF, 12)) % flash_words)
+    if word & 0xF000 == 0xD000: # RCALL
+        return Instruction(1, CALL, (pc + 1 + _signed(word & 0x0FFF, 12)) % flash_words)
+    if word & 0xF800 == 0xF000: # BRBS / BRBC
+        return Instruction(1, BRANCH, (pc + 1 + _signed((word >> 3) & 0x7F, 7)) % flash_words)
+    if word & 0xFE0E == 0x940C: # JMP
+        return Instruction(2, JUMP, ((((word & 0x01F0) >> 3) | (word & 1)) << 16) | next_word)
+    if word & 0xFE0E == 0x940E: # CALL
+        return Instruction(2, CALL, ((((word & 0x01F0) >> 3) | (word & 1)) << 16) | next_word)
+    if word & 0xFC00 == 0x1000 or word & 0xFC08 == 0xFC00 or word & 0xFD00 == 0x9900: # CPSE, SBRC/SBRS, SBIC/SBIS
+        return Instruction(1, SKIP, None)
+    if word in (0x9409, 0x9419): # IJMP, EIJMP
+        return Instruction(1, INDIRECT_JUMP, None)
+    if word in (0x9509, 0x9519): # ICALL, EICALL
+        return Instruction(1, INDIRECT_CALL, None)
+    if word in (0x9508, 0x9518): # RET, RETI
+        return Instruction(1, RETURN, None)
+    if word == 0x9598:
+        return Instruction(1, BREAK, None)
+    return Instruction(length, SEQUENTIAL, None)
+
+
+def successors(instruction: Instruction, pc: int, next_length=1):
+    """
+    :param next_length: length of the instruction following this one (needed for skips)
+    :return: the list of the possible next pc values, None standing for an unknown one
+    """
+    following = pc + instruction.length
+    if instruction.kind == SEQUENTIAL:
+        return [following]
+    if instruction.kind == BRANCH:
+        return [following, instruction.target]
+    if instruction.kind in (JUMP, CALL):
+        return [instruction.target]
+    if instruction.kind == SKIP:
+        return [following, following + next_length]
+    return [None]
@@ -1,6 +1,7 @@
 REG_X = 0x1A
 REG_Y = 0x1C
 REG_Z = 0x1E
+SPL = 0x3D # io address, followed by SPH and SREG
 
 def OUT(A, r):
     return int.to_bytes(0b1011100000000000 | ((r & 0x1F) << 4) | (A & 0x0F) | ((A & 0x30) << 5), 2, 'big')
@@ -25,7 +26,11 @@ def ADIW(w, K):
 
 
 def LDI(rd, K):
-    return int.to_bytes(0b1110000000000000 | ((K & 0xF0) << 8) | (K & 0x0F) | ((rd & 0x0F) << 4), 2, 'big')
+    return int.to_bytes(0b1110000000000000 | ((K & 0xF0) << 4) | (K & 0x0F) | ((rd & 0x0F) << 4), 2, 'big')
+
+
+def NOP():
+    return b'\x00\x00'
 
 
 def BREAK():
@@ -0,0 +1,167 @@
+from dwire.Expression import SREG
+from dwire.avr import SPL
+from gdb.RegisterSnapshot import GDB_SREG, GDB_SP, GDB_PC
+
+MASK = (1 << 64) - 1
+
+# agent expression opcodes (gdb manual, "Bytecode Descriptions")
+ADD, SUB, MUL, DIV_SIGNED, DIV_UNSIGNED, REM_SIGNED, REM_UNSIGNED, LSH, RSH_SIGNED, RSH_UNSIGNED = range(0x02, 0x0c)
+TRACE, TRACE_QUICK, LOG_NOT, BIT_AND, BIT_OR, BIT_XOR, BIT_NOT, EQUAL, LESS_SIGNED, LESS_UNSIGNED = range(0x0c, 0x16)
+EXT, REF8, REF16, REF32, REF64 = range(0x16, 0x1b)
+IF_GOTO, GOTO, CONST8, CONST16, CONST32, CONST64, REG, END, DUP, POP, ZERO_EXT, SWAP = range(0x20, 0x2c)
+TRACE16, PICK, ROT = 0x30, 0x32, 0x33
+
+_refs = {REF8: 1, REF16: 2, REF32: 4, REF64: 8}
+_consts = {CONST8: 1, CONST16: 2, CONST32: 4, CONST64: 8}
+
+
+def _signed(value, bits=64):
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+
+def gdb_region(address, length):
+    """
+    maps an avr-gdb address to a read_regions region: flash from 0, data space from 0x800000, eeprom from 0x810000
+    """
+    if address >= 0x810000:
+        return 'eeprom', address - 0x810000, length
+    if address >= 0x800000:
+        return 'data', address - 0x800000, length
+    return 'flash', address, length
+
+
+def register_region(register):
+    if register < 32:
+        return 'reg', register, 1
+    if register == GDB_SREG:
+        return 'io', SREG, 1
+    if register == GDB_SP:
+        return 'io', SPL, 2
+    raise ValueError(f"Unknown register {register}")
+
+
+class AgentExpression:
+    """
+    gdb agent expression bytecode, sent with the breakpoint conditions gdb wants evaluated by the target.
+    Evaluated on the host at each hit: the registers and constant addresses it reads are fetched upfront.
+    Trace, variable and printf bytecodes are not supported (the evaluation fails and the target stops).
+    """
+    def __init__(self, bytecode: bytes):
+        self.bytecode = bytecode
+        self.reads = self._static_reads()
+
+    def __repr__(self):
+        return self.bytecode.hex()
+
+    def _static_reads(self):
+        reads = []
+        code = self.bytecode
+        i = 0
+        last_const = None
+        while i < len(code):
+            op = code[i]
+            size = _consts.get(op, 2 if op in (REG, IF_GOTO, GOTO, TRACE16) else 1 if op in (EXT, ZERO_EXT, TRACE_QUICK, PICK) else 0)
+            operand = int.from_bytes(code[i + 1:i + 1 + size], 'big')
+            region = None
+            if op == REG and operand != GDB_PC:
+                region = register_region(operand)
+            elif op in _refs and last_const is not None:
+                region = gdb_region(last_const, _refs[op])
+            if region is not None and region not in reads:
+                reads.append(region)
+            last_const = operand if op in _consts else None
+            i += 1 + size
+        return reads
+
+    def evaluate(self, read, pc):
+        """
+        :param read: callable (space, address, length) -> bytes reading the halted target
+        :param pc: address of the halted instruction
+        :return: the value on top of the stack at the end
+        """
+        code = self.bytecode
+        stack = []
+        i = 0
+        while True:
+            op = code[i]
+            i += 1
+            if op in _consts:
+                stack.append(int.from_bytes(code[i:i + _consts[op]], 'big'))
+                i += _consts[op]
+            elif op == REG:
+                register = int.from_bytes(code[i:i + 2], 'big')
+                i += 2
+                stack.append(pc * 2 if register == GDB_PC else int.from_bytes(read(*register_region(register)), 'little'))
+            elif op in _refs:
+                stack.append(int.from_bytes(read(*gdb_region(stack.pop(), _refs[op])), 'little'))
+            elif op == IF_GOTO:
+                target = int.from_bytes(code[i:i + 2], 'big')
+                i = target if stack.pop() else i + 2
+            elif op == GOTO:
+                i = int.from_bytes(code[i:i + 2], 'big')
+            elif op == END:
+                return stack.pop() if stack else 0
+            elif op in (EXT, ZERO_EXT):
+                bits = code[i]
+                i += 1
+                stack[-1] = _signed(stack[-1], bits) & MASK if op == EXT else stack[-1] & ((1 << bits) - 1)
+            elif op == LOG_NOT:
+                stack[-1] = int(not stack[-1])
+            elif op == BIT_NOT:
+                stack[-1] = ~stack[-1] & MASK
+            elif op == DUP:
+                stack.append(stack[-1])
+            elif op == POP:
+                stack.pop()
+            elif op == SWAP:
+                stack[-1], stack[-2] = stack[-2], stack[-1]
+            elif op == PICK:
+                stack.append(stack[-1 - code[i]])
+                i += 1
+            elif op == ROT:
+                stack[-3], stack[-2], stack[-1] = stack[-1], stack[-3], stack[-2]
+            elif op == TRACE:
+                stack.pop()
+                stack.pop()
+            elif op in (TRACE_QUICK, TRACE16):
+                i += 1 if op == TRACE_QUICK else 2
+            elif ADD <= op <= RSH_UNSIGNED or BIT_AND <= op <= LESS_UNSIGNED:
+                b, a = stack.pop(), stack.pop()
+                stack.append(self._binary(op, a, b) & MASK)
+            else:
+                raise ValueError(f"Unsupported agent expression bytecode {op:#04x}")
+
+    @staticmethod
+    def _binary(op, a, b):
+        if op == ADD:
+            return a + b
+        if op == SUB:
+            return a - b
+        if op == MUL:
+            return a * b
+        if op in (DIV_SIGNED, REM_SIGNED):
+            a, b = _signed(a), _signed(b)
+            quotient = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1) # truncating, as C
+            return quotient if op == DIV_SIGNED else a - quotient * b
+        if op == DIV_UNSIGNED:
+            return a // b
+        if op == REM_UNSIGNED:
+            return a % b
+        if op == LSH:
+            return a << b
+        if op == RSH_SIGNED:
+            return _signed(a) >> b
+        if op == RSH_UNSIGNED:
+            return a >> b
+        if op == BIT_AND:
+            return a & b
+        if op == BIT_OR:
+            return a | b
+        if op == BIT_XOR:
+            return a ^ b
+        if op == EQUAL:
+            return int(a == b)
+        if op == LESS_SIGNED:
+            return int(_signed(a) < _signed(b))
+        return int(a < b) # LESS_UNSIGNED
@@ -1,78 +1,266 @@
+import asyncio
+import logging
 import os
-import signal
-import socket
-import sys
+import re
 import threading
+import time
 from binascii import hexlify
-from functools import reduce, partial
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from dwire.DWInterface import DWInterface
-from gdb.GDBUtils import unescape, read_packet, answer
+from dwire.Expression import Expression
+from dwire.Profiler import Profiler
+from dwire.SerialDW.Recording import RecordingTransport
+from dwire.Symbols import SymbolTable
+from gdb.AgentExpression import AgentExpression
+from gdb.GDBUtils import PacketReader, answer, INTERRUPT, PACKET_SIZE
+from gdb.RegisterSnapshot import RegisterSnapshot
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.01 # s, how often a running target is checked for a break while waiting for gdb interrupts
+FEATURES = {b'target.xml': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'target.xml')}
 
 commands = {}
 def command(character):
     def _func(func):
         commands[character] = func
-        print(f'registered packet handler for {character}')
+        log.debug('registered packet handler for %s', character)
+        return func
     return _func
 
+def packet_kind(packet: bytes):
+    """
+    :return: the packet type: the command character, with the name for the q, Q and v packets (e.g. qRcmd, vCont)
+    """
+    if packet[:1] in (b'q', b'Q', b'v'):
+        return re.match(rb'[A-Za-z?]*', packet).group().decode()
+    return chr(packet[0])
+
+monitor_commands = {}
+def monitor(name):
+    """
+    registers a gdb monitor command (qRcmd). handlers take the argument string and return the text to print
+    """
+    def _func(func):
+        monitor_commands[name] = func
+        return func
+    return _func
+
+
+class DeferredAnswer:
+    """
+    answ for a handler running in the dw worker: the answers are queued and sent from the loop (flush), then
+    sent right away (a coroutine returned by the handler runs on the loop)
+    """
+    def __init__(self, answ):
+        self.answ = answ
+        self.pending = []
+        self.direct = False
+
+    def __call__(self, *args, **kwargs):
+        if self.direct:
+            self.answ(*args, **kwargs)
+        else:
+            self.pending.append((args, kwargs))
+
+    def flush(self):
+        self.direct = True
+        for args, kwargs in self.pending:
+            self.answ(*args, **kwargs)
+        self.pending = []
+
 
-class GDBServer(socket.socket):
+class GDBServer:
 
-    def __init__(self, bind_file, irq_handler, dw: DWInterface):
-        socket.socket.__init__(self, socket.AF_UNIX, socket.SOCK_STREAM)
-        self.bind_file = bind_file
+    def __init__(self, dw: DWInterface, unix_path=None, tcp_address=None):
+        """
+        :param unix_path: unix socket to listen on
+        :param tcp_address: (host, port) to listen on
+        """
+        self.unix_path = unix_path
+        self.tcp_address = tcp_address
         self.thread = None
-        self.keep_working = True
-        self.irq_handler = irq_handler
+        self.loop = None
+        self.stop_event = None
+        self.client_lock = None
         self.dw = dw
+        self.snapshot = RegisterSnapshot(dw)
+        # every debugWIRE exchange runs on this single worker (in order), the loop stays free for gdb and ctrl-c
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dw')
 
         self.ack = True
         self.extended = False
+        self.reader = None
+        self.features = {} # annex -> content, read once
+        self.stop_latencies = [] # s, from gdb interrupt to stop reply
+        self.agent_expressions = {} # bytecode -> AgentExpression, kept across the reinsertions of the breakpoints
+        self.step_mode = None # ('over', 0) or ('out', frame size): how the next single step runs (monitor stepover/stepout)
 
     def terminate(self, timeout=1):
-        self.keep_working = False
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
         self.thread.join(timeout)
-        print("Closed")
+        log.info("Closed")
 
     def start(self):
-        if os.path.exists("sock"):
-            os.remove("sock")
-        self.bind(self.bind_file)
-        self.listen(1)
-        self.thread = threading.Thread(target=GDBServer.gdb_thread, args=(self, *self.accept()))
+        """
+        serves gdb from a background thread running the asyncio loop
+        """
+        self.thread = threading.Thread(target=asyncio.run, args=(self.serve(),))
         self.thread.start()
         return self.thread
 
-    def gdb_thread(self, sok: socket.socket, addr_info):
+    def _setup_loop(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.client_lock = asyncio.Lock()
+
+    async def serve(self):
+        assert self.unix_path is not None or self.tcp_address is not None
+        self._setup_loop()
+        servers = []
+        if self.unix_path is not None:
+            if os.path.exists(self.unix_path):
+                os.remove(self.unix_path)
+            servers.append(await asyncio.start_unix_server(self.gdb_session, self.unix_path))
+            log.info("listening on %s", self.unix_path)
+        if self.tcp_address is not None:
+            servers.append(await asyncio.start_server(self.gdb_session, *self.tcp_address))
+            log.info("listening on %s:%s", *self.tcp_address)
+
+        await self.stop_event.wait()
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        self.cleanup()
+
+    async def serve_stream(self, reader, writer):
+        """
+        serves a single gdb session on the given streams (e.g. a recorded session, see gdb.Replay)
+        """
+        self._setup_loop()
+        await self.gdb_session(reader, writer)
+
+    async def gdb_session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        serves a gdb connection. one client at a time: others wait for it to disconnect
+        """
+        async with self.client_lock:
+            log.info("connected to %s", writer.get_extra_info('peername') or self.unix_path)
+            if isinstance(self.dw.device.transport, RecordingTransport):
+                reader = self.dw.device.transport.record_reader(reader)
+            flight = self.dw.device.flight
+            self.reader = PacketReader(reader, recorder=flight)
+            self.ack = True
+            try:
+                while not self.stop_event.is_set():
+                    packet = await self.reader.read_packet()
+                    answ = partial(answer, writer, self.ack, recorder=flight)
+                    if packet is None:
+                        answ(None, False)
+                    elif packet == INTERRUPT:
+                        answ(await self.call(self.stop_reply), None) # already halted
+                    else:
+                        metrics = self.dw.device.metrics
+                        began = time.perf_counter() if metrics is not None else None
+                        kind = packet_kind(packet)
+                        packet = [chr(packet[0]), packet[1:]]
+                        log.debug("Requested command %s", packet[0])
+                        handler = commands.get(packet[0])
+                        if handler is not None and asyncio.iscoroutinefunction(handler):
+                            await handler(self, answ, packet[1])
+                        elif handler is not None:
+                            deferred = DeferredAnswer(answ)
+                            try:
+                                result = await self.call(handler, self, deferred, packet[1])
+                            finally:
+                                deferred.flush()
+                            if asyncio.iscoroutine(result):
+                                await result
+                        else:
+                            log.debug("Unknown command %s", packet[0])
+                            answ()
+                        if metrics is not None:
+                            metrics.packet(kind, began)
+                    await writer.drain()
+            except (EOFError, ConnectionError, asyncio.IncompleteReadError):
+                log.info("gdb disconnected")
+            except Exception as e:
+                log.exception("Exception threw: %s", e)
+                self.dw.device.dump_flight_record(f"gdb session failed: {e!r}")
+            finally:
+                if log.isEnabledFor(logging.INFO):
+                    log.info("%s", self.dw.session_report())
+                self.reader = None
+                writer.close()
+
+    async def call(self, function, *args, **kwargs):
+        """
+        runs a blocking (debugWIRE) call on the dw worker
+        """
+        return await self.loop.run_in_executor(self.executor, partial(function, *args, **kwargs))
+
+    def cleanup(self):
+        log.info("Stopping execution")
+        self.executor.shutdown(wait=False)
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.remove(self.unix_path)
+
+    def stop_reply(self, signal=5, report_reason=True):
+        """
+        T stop reply with the halt reason and the expedited SREG, SP and PC
+        :param report_reason: reports swbreak/hwbreak (not wanted when the hw breakpoint was set by the server)
+        """
+        self.snapshot.invalidate()
+        reason = self.dw.halt_reason() if report_reason else None
+        reply = b'T%02x' % signal + self.snapshot.expedite()
+        if reason in ('swbreak', 'hwbreak'):
+            reply += f"{reason}:;".encode()
+        return reply
+
+    async def wait_stop(self):
+        """
+        waits for the running target to break, racing it against a gdb interrupt (0x03), which halts the target.
+        :return: the stop reply
+        """
+        received = [] # time of arrival of the interrupt
+        def arm():
+            future = asyncio.ensure_future(self.reader.read_byte())
+            future.add_done_callback(lambda f: received.append(time.monotonic()))
+            return future
+
+        interrupt = arm()
         try:
-            print(f"connected to {addr_info}")
-            while self.keep_working:
-                packet = read_packet(sok, self.irq_handler)
-                packet = [chr(packet[0]), packet[1:]]
-                print(f"Requested command {packet[0]}")
-                if packet[0] in commands:
-                    commands[packet[0]](self, partial(answer, sok, self.ack), packet[1])
-                else:
-                    print(f"Unknown command {packet[0]}")
-                    pass
-
-            self.cleanup(sok)
-        except Exception as e:
-            print("Exception threw:", e)
-            self.cleanup(sok)
-
-    def cleanup(self, sok):
-        print("Stopping execution")
-        sok.close()
-        self.close()
+            while True:
+                if await self.call(self.dw.wait_hit, POLL_INTERVAL):
+                    return await self.call(self.stop_reply)
+                if interrupt.done() and interrupt.result() in (b'+', b'-'):
+                    interrupt = arm() # late ack
+                elif interrupt.done():
+                    if interrupt.result() != INTERRUPT:
+                        raise EOFError("unexpected data from gdb while the target was running")
+                    await self.call(self.dw.halt)
+                    reply = await self.call(self.stop_reply, signal=2)
+                    self.stop_latencies.append(time.monotonic() - received[-1])
+                    log.debug("Stop latency %.1fms", self.stop_latencies[-1] * 1000)
+                    return reply
+        finally:
+            interrupt.cancel()
+            try:
+                await interrupt # the stream reader accepts a new read once the cancelled one is gone
+            except asyncio.CancelledError:
+                pass
 
     @command('q')
     def cmd_query(self, answ, data):
-        if b"Supported:" in data:
+        if data.startswith(b'Rcmd,'):
+            return self.rcmd(answ, bytes.fromhex(data[5:].decode()).decode())
+        elif b"Supported:" in data:
             #list supported features
-            print("GDB SERVER SUPPORTED FUNCTIONS", data)
-            answ(b"PacketSize=48ff;qXfer:features:read+;hwbreak+;swbreak+")
+            log.debug("GDB SERVER SUPPORTED FUNCTIONS %s", data)
+            answ(f"PacketSize={PACKET_SIZE:x};qXfer:features:read+;hwbreak+;swbreak+;QStartNoAckMode+;ConditionalBreakpoints+".encode())
         elif b'Xfer:' in data:
             #transfer somenthing from target
             data = data[5:]
@@ -80,13 +268,13 @@ class GDBServer(socket.socket):
                 #transfer features
                 data = data[14:]
                 annex, offset, length = data.replace(b',', b':').split(b':')
-                with open(annex, "rb") as file:
-                    file.seek(int(offset))
-                    read = file.read(int(length))
-                    if len(read) < int(length):
-                        answ(b'l' + read)
-                    else:
-                        answ(b'm' + read)
+                if annex not in FEATURES:
+                    answ(b'E00')
+                    return
+                if annex not in self.features:
+                    with open(FEATURES[annex], "rb") as file:
+                        self.features[annex] = file.read()
+                self.xfer(answ, self.features[annex], int(offset, 16), int(length, 16))
         elif b"TStatus" in data:
             #Trace experiment status (no trace suopported)
             answ()
@@ -104,11 +292,83 @@ class GDBServer(socket.socket):
         else:
             answ()
 
-    @command('v')
-    def empty(self, answ, data):
-        if data == b"MustReplyEmpty":
+    async def rcmd(self, answ, line):
+        """
+        runs a monitor command, sending its text output as console output
+        """
+        name, _, args = line.strip().partition(' ')
+        if name in monitor_commands:
+            function = monitor_commands[name]
+            if asyncio.iscoroutinefunction(function):
+                output = await function(self, args.strip())
+            else:
+                output = await self.call(function, self, args.strip())
+        else:
+            output = f"Unknown monitor command {name}. Available: {', '.join(sorted(monitor_commands))}\n"
+        if output:
+            answ(b'O' + hexlify(output.encode()))
+        answ(b'OK', None)
+
+    def xfer(self, answ, content, offset, length):
+        """
+        answers a qXfer read with a chunk of content no longer than the packet size
+        """
+        length = min(length, PACKET_SIZE - 1)
+        chunk = content[offset:offset + length]
+        answ((b'l' if offset + length >= len(content) else b'm') + chunk)
+
+    @command('Q')
+    def cmd_set(self, answ, data):
+        if data == b'StartNoAckMode':
+            answ(b'OK') # still acked
+            self.ack = False
+        else:
             answ()
 
+    @command('v')
+    async def cmd_v(self, answ, data):
+        if data == b'Cont?':
+            answ(b'vCont;c;C;s;S;t;r')
+        elif data.startswith(b'Cont;'):
+            await self.vcont(answ, data[5:])
+        else:
+            answ() # MustReplyEmpty and the unsupported v packets
+
+    async def vcont(self, answ, data):
+        """
+        vCont;action[:thread]... single threaded target: the first action applies, signals are ignored
+        """
+        action = data.split(b';')[0].split(b':')[0]
+        if action[:1] in (b'c', b'C'):
+            await self.call(self.resume)
+            answ(await self.wait_stop())
+        elif action[:1] in (b's', b'S'):
+            answ(await self.single_step_stop())
+        elif action[:1] == b'r':
+            start, end = [int(x, 16) for x in action[1:].split(b',')]
+            await self.range_step(answ, start, end)
+        elif action[:1] == b't':
+            answ(await self.call(self.stop_reply, signal=0)) # already halted
+        else:
+            answ(b'E00')
+
+    async def range_step(self, answ, start, end):
+        """
+        steps while the pc is in [start, end) (byte addresses), running to the range exit with the hw breakpoint
+        wherever there is a single one. breakpoint hits and interrupts inside the range are reported as they are.
+        """
+        await self.call(self.snapshot.write_back)
+        start, end = start // 2, end // 2
+        while start <= await self.call(self.dw.get_instruction_address) < end:
+            target = await self.call(self.dw.advance_in_range, start, end)
+            if target is None:
+                continue
+            reply = await self.wait_stop()
+            if not reply.startswith(b'T05') or await self.call(self.dw.get_instruction_address) != target:
+                answ(reply)
+                return
+        answ(await self.call(self.stop_reply, report_reason=False))
+
     @command('!')
     def begin_extended_remote(self, answ, data):
         self.extended = True
@@ -120,17 +380,335 @@ class GDBServer(socket.socket):
 
     @command('?')
     def query_halt_reason(self, answ, data):
-        answ(self.dw.halt_reason().encode())
+        answ(self.stop_reply())
+
+    def resume(self, pc=None):
+        """
+        resumes the target with the registers changed by gdb. runs on the dw worker
+        :param pc: byte address to resume from
+        """
+        if pc is not None:
+            self.snapshot.pc = pc
+        self.snapshot.write_back()
+        self.dw.resume_execution()
+
+    def step(self, pc=None):
+        """
+        single steps (see resume). runs on the dw worker
+        :return: the stop reply
+        """
+        if pc is not None:
+            self.snapshot.pc = pc
+        self.snapshot.write_back()
+        self.dw.step()
+        return self.stop_reply()
+
+    @command('c')
+    async def continue_execution(self, answ, data):
+        await self.call(self.resume, int(data, 16) if data else None)
+        answ(await self.wait_stop())
+
+    def return_point(self, mode, pc=None):
+        """
+        writes back the registers changed by gdb and finds where a step over (or out) stops. runs on the dw worker
+        :return: (return address, stack pointer), None if stepping over an instruction that is not a call
+        """
+        if pc is not None:
+            self.snapshot.pc = pc
+        self.snapshot.write_back()
+        kind, frame_size = mode
+        return self.dw.call_return_point() if kind == 'over' else self.dw.frame_return_point(frame_size)
+
+    async def single_step_stop(self, pc=None):
+        """
+        single steps for gdb (s, vCont;s). after monitor stepover or stepout, the step runs to the return point
+        with the hw breakpoint instead, and gdb gets the stop reply of where it ended
+        :return: the stop reply
+        """
+        mode, self.step_mode = self.step_mode, None
+        point = None if mode is None else await self.call(self.return_point, mode, pc)
+        if point is None:
+            return await self.call(self.step, pc)
+        reply = await self.run_to_return_point(*point)
+        return reply if reply is not None else await self.call(self.stop_reply, report_reason=False)
+
+    @command('s')
+    async def single_step(self, answ, data):
+        answ(await self.single_step_stop(int(data, 16) if data else None))
+
+    @command('D')
+    def detach(self, answ, data):
+        answ(b'OK')
+        if not self.dw.status():
+            self.snapshot.write_back()
+            self.dw.resume_execution()
+        raise EOFError("gdb detached")
+
+    @command('k')
+    def kill(self, answ, data):
+        raise EOFError("gdb killed the session") # the target is left halted, ready for a new connection
 
     @command('g')
     def get_registers(self, answ, data):
-        #reg 0-31 SREG SP(16bit) PC2(16bit) PC(16bit)
-        gpreg = hexlify(self.dw.read_registers(0, 32))
-        sreg = hexlify(self.dw.read_io_space(0x3F, 1))
-        sp = hexlify(self.dw.read_io_space(0x3D, 2))
-        pc2 = b'0000'
-        pc = hexlify(int.to_bytes(self.dw.get_pc()-1, 2, 'little'))
-        answ(gpreg + sreg + sp + pc + pc2)
+        #reg 0-31 SREG SP(16bit) PC(32bit)
+        answ(hexlify(self.snapshot.get_all()))
+
+    @command('G')
+    def set_registers(self, answ, data):
+        self.snapshot.set_all(bytes.fromhex(data.decode()))
+        answ(b'OK')
+
+    @command('p')
+    def get_register(self, answ, data):
+        try:
+            answ(hexlify(self.snapshot.get(int(data, 16))))
+        except ValueError:
+            answ(b'E00')
+
+    @command('P')
+    def set_register(self, answ, data):
+        register, value = data.split(b'=')
+        try:
+            self.snapshot.set(int(register, 16), bytes.fromhex(value.decode()))
+            answ(b'OK')
+        except ValueError:
+            answ(b'E00')
+
+    def conditions(self, data):
+        """
+        parses the breakpoint conditions of a Z packet (;X<len>,<agent expression>...)
+        """
+        conditions = []
+        for parameter in data.split(b';'):
+            if parameter.startswith(b'X'):
+                bytecode = bytes.fromhex(parameter.split(b',')[1].decode())
+                if bytecode not in self.agent_expressions:
+                    self.agent_expressions[bytecode] = AgentExpression(bytecode)
+                conditions.append(self.agent_expressions[bytecode])
+        return conditions
+
+    @command('Z')
+    def insert_breakpoint(self, answ, data):
+        data, _, parameters = data.partition(b';')
+        kind, addr, _ = data.split(b',', 2)
+        addr = int(addr, 16)
+        if kind not in (b'0', b'1'):
+            answ() # watchpoints are not supported
+        elif addr >= self.dw.device.dev.FLASH_SIZE:
+            answ(b'E01')
+        elif kind == b'0' or self.dw.breakpoints.insert_hw(addr // 2):
+            if kind == b'0':
+                self.dw.set_sw_breakpoint(addr) # written when the target resumes
+            self.dw.breakpoints.set_conditions(addr, self.conditions(parameters), source='gdb') # evaluated at each hit
+            answ(b'OK')
+        else:
+            answ(b'E01')
+
+    @command('z')
+    def remove_breakpoint(self, answ, data):
+        kind, addr, _ = data.split(b',', 2)
+        addr = int(addr, 16)
+        if kind in (b'0', b'1'):
+            self.dw.breakpoints.set_conditions(addr, [], source='gdb')
+        if kind == b'0':
+            self.dw.remove_sw_breakpoint(addr)
+            answ(b'OK')
+        elif kind == b'1':
+            self.dw.breakpoints.remove_hw(addr // 2)
+            answ(b'OK')
+        else:
+            answ()
+
+    def write_memory(self, addr, data):
+        """
+        writes gdb memory space: flash (page read-modify-write), data space or eeprom
+        """
+        if 0x800000 <= addr < 0x800060:
+            self.snapshot.write_back() # registers and io are memory mapped
+        if addr >= 0x810000:
+            self.dw.write_eeprom(addr - 0x810000, data)
+        elif addr >= 0x800000:
+            self.dw.write_ram(addr - 0x800000, data)
+        else:
+            page_size = self.dw.device.dev.FLASH_PAGEEND
+            end = addr + len(data)
+            for page_addr in range(addr - addr % page_size, end, page_size):
+                page = bytearray(self.dw.read_flash(page_addr, page_size))
+                lo, hi = max(addr, page_addr), min(end, page_addr + page_size)
+                page[lo - page_addr:hi - page_addr] = data[lo - addr:hi - addr]
+                self.dw.write_flash_page(page_addr, bytes(page))
+
+    @command('M')
+    def write_memory_hex(self, answ, data):
+        location, content = data.split(b':')
+        addr, length = [int(x, 16) for x in location.split(b',')]
+        self.write_memory(addr, bytes.fromhex(content.decode())[:length])
+        answ(b'OK')
+
+    @command('X')
+    def write_memory_binary(self, answ, data):
+        location, content = data.split(b':', 1)
+        addr, length = [int(x, 16) for x in location.split(b',')]
+        if length > 0:
+            self.write_memory(addr, content[:length])
+        answ(b'OK')
+
+    @command('m')
+    def read_memory(self, answ, data):
+        #avr-gdb memory map: flash from 0, data space (registers, io, sram) from 0x800000, eeprom from 0x810000
+        addr, length = [int(x, 16) for x in data.split(b',')]
+        if addr < 0x800000:
+            answ(hexlify(self.dw.breakpoints.overlay(addr, self.dw.read_flash(addr, length)))) # gdb sees no BREAKs
+        elif addr < 0x810000:
+            if addr < 0x800060:
+                self.snapshot.write_back()
+            answ(hexlify(self.dw.read_regions([('data', addr - 0x800000, length)])[0][0]))
+        else:
+            answ(hexlify(self.dw.read_eeprom(addr - 0x810000, length)))
+
+    async def run_to_return_point(self, address, sp):
+        """
+        runs to address (with the hw breakpoint) until it is reached with the stack of the caller
+        :return: None if reached, else the stop reply of the other halt (breakpoint or interrupt)
+        """
+        while True:
+            await self.call(self.dw.run_to, address)
+            reply = await self.wait_stop()
+            if not reply.startswith(b'T05') or await self.call(self.dw.get_instruction_address) != address:
+                return reply
+            if await self.call(self.dw.get_sp) >= sp:
+                return None
+            await self.call(self.dw.step) # a deeper call of the same code: leave the address before running to it again
+
+    @monitor('breakpoints')
+    def monitor_breakpoints(self, args):
+        """
+        lists the breakpoints, where they are, and the session page writes and break to resume time
+        """
+        bp = self.dw.breakpoints
+        def state(a):
+            return 'hw slot' if a == bp.slot else 'flash' if a in bp.inserted else 'pending'
+        def conditions(a):
+            text = ''.join(f", if {' or '.join(map(repr, c))} ({source})" for source, c in bp.conditions.get(a, {}).items())
+            return text + (f", ignore {bp.ignore_counts[a]}" if a in bp.ignore_counts else '')
+        lines = [f"sw {a:#06x} {state(a)}, {bp.hits.get(a, 0)} hits, {bp.toggles.get(a, 0)} toggles{conditions(a)}"
+                 for a in sorted(bp.requested - bp.temporary)]
+        lines += [f"sw {a:#06x} pending removal" for a in sorted(set(bp.inserted) - bp.requested)]
+        if bp.hw is not None:
+            lines.append(f"hw {bp.hw * 2:#06x}")
+        lines.append(self.dw.session_report())
+        return "\n".join(lines) + "\n"
+
+    @monitor('condition')
+    def monitor_condition(self, args):
+        """
+        condition <address> [expression]: the breakpoint at address stops the target only when the expression
+        (see dwire.Expression) is true. evaluated by the server at each hit, without involving gdb.
+        """
+        address, _, source = args.partition(' ')
+        try:
+            conditions = [Expression(source)] if source.strip() else []
+        except (SyntaxError, ValueError) as e:
+            return f"Invalid condition: {e}\n"
+        self.dw.breakpoints.set_conditions(int(address, 16), conditions)
+        return f"condition of {int(address, 16):#06x}: {source.strip() or 'none'}\n"
+
+    @monitor('ignore')
+    def monitor_ignore(self, args):
+        """
+        ignore <address> <count>: the next count hits of the breakpoint at address are resumed by the server
+        """
+        address, count = args.split()
+        self.dw.breakpoints.set_ignore_count(int(address, 16), int(count, 0))
+        return f"next {int(count, 0)} hits of {int(address, 16):#06x} ignored\n"
+
+    @monitor('trace')
+    def monitor_trace(self, args):
+        """
+        trace <steps> [file] [stop address]: single steps recording the executed instruction addresses
+        """
+        args = args.split()
+        stop = int(args[2], 16) // 2 if len(args) > 2 else None
+        self.snapshot.write_back()
+        start = self.dw.device.round_trips
+        trace = self.dw.trace(int(args[0], 0), stop=None if stop is None else stop.__eq__, path=args[1] if len(args) > 1 else None)
+        self.snapshot.invalidate()
+        output = f"{len(trace)} steps traced with {self.dw.device.round_trips - start} round trips, pc={self.snapshot.pc:#x}\n"
+        if len(trace):
+            output += f"last: {' '.join(f'{a * 2:#x}' for a in trace[-8:])}\n"
+        return output + "registers changed behind gdb: run 'maint flush register-cache'\n"
+
+    @monitor('stepover')
+    def monitor_step_over(self, args):
+        """
+        the next stepi runs a call to its return with the hw breakpoint (a single step for other instructions).
+        gdb gets a regular stop reply: a user defined command running `monitor stepover` then `stepi` steps over calls
+        """
+        self.step_mode = ('over', 0)
+        return "next stepi steps over calls\n"
+
+    @monitor('stepout')
+    def monitor_step_out(self, args):
+        """
+        the next stepi runs until the current function returns. optional argument: bytes pushed since the call
+        """
+        self.step_mode = ('out', int(args, 0) if args else 0)
+        return "next stepi runs to the return of the current function\n"
+
+    @monitor('profile')
+    def monitor_profile(self, args):
+        """
+        profile <seconds> [symbols (elf or map)] [collapsed stacks file]: runs the target sampling the pc, then halts it
+        """
+        args = args.split()
+        profiler = Profiler(self.dw, SymbolTable.load(args[1]) if len(args) > 1 else None, stack_scan=32)
+        self.snapshot.write_back()
+        self.dw.resume_execution()
+        profiler.run(duration=float(args[0])) # on the dw worker, as every monitor command
+        if self.dw.device.is_running:
+            self.dw.halt()
+        self.snapshot.invalidate()
+        if len(args) > 2:
+            profiler.write_collapsed(args[2])
+        return profiler.report() + "\nregisters changed behind gdb: run 'maint flush register-cache'\n"
+
+    @monitor('metrics')
+    def monitor_metrics(self, args):
+        """
+        metrics on [trace] | off | json <file> | trace <file>: driver and packet latency instrumentation,
+        without arguments prints the summary
+        """
+        args = args.split()
+        device = self.dw.device
+        if args and (args[0] not in ('on', 'off', 'json', 'trace') or args[0] in ('json', 'trace') and len(args) != 2):
+            return "usage: monitor metrics [on [trace] | off | json <file> | trace <file>]\n"
+        if args[:1] == ['on']:
+            device.enable_metrics(trace=args[1:] == ['trace'])
+            return "metrics enabled\n"
+        if args[:1] == ['off']:
+            device.disable_metrics()
+            return "metrics disabled\n"
+        if device.metrics is None:
+            return "metrics are disabled: monitor metrics on\n"
+        if args[:1] == ['json']:
+            device.metrics.save_json(args[1])
+            return f"saved {args[1]}\n"
+        if args[:1] == ['trace']:
+            device.metrics.save_chrome_trace(args[1])
+            return f"saved {len(device.metrics.events)} events to {args[1]}\n"
+        return device.metrics.summary() + "\n"
+
+    @monitor('flight')
+    def monitor_flight(self, args):
+        """
+        flight [events | file]: prints the last protocol events (64 by default) or saves them to a file
+        """
+        flight = self.dw.device.flight
+        args = args.strip()
+        if args and not args.isdigit():
+            flight.dump(args)
+            return f"saved {min(flight.recorded, flight.capacity)} events to {args}\n"
+        return flight.format(int(args) if args else 64) + "\n"
 
     #@command('v')
     #def
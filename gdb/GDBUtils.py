@@ -1,65 +1,138 @@
-from socket import socket
+import logging
+import re
+from asyncio import StreamReader, StreamWriter
 
-def escape(data: bytes):
-    ret = b''
-    checksum = 0
-    for c in data:
-        if bytes([c]) in [b'#', b'$', b'}']:
-            ret += b'}' + bytes([c ^ 0x20])
-            checksum += 125 + c ^ 0x20
-        else:
-            ret += bytes([c])
-            checksum += c
-    return ret, checksum % 256
+from dwire.FlightRecorder import GDB_RECV, GDB_SEND
+
+log = logging.getLogger(__name__)
+
+INTERRUPT = b'\x03'
+PACKET_SIZE = 0x48ff # advertised in qSupported: max packet we accept and send (payload)
+
+_escaped = re.compile(rb'[#$}*]')
+_encoded = re.compile(rb'(\}.|[^}])\*(.)|\}(.)', re.S)
+_runs = re.compile(rb'(?<!\})([^#$}*])\1{3,97}', re.S)
+
+
+def _escape_char(match):
+    return b'}' + bytes([match.group()[0] ^ 0x20])
+
+
+def _run_length(match):
+    run = match.group()
+    repeat = len(run) - 1
+    if repeat in (6, 7): # '#' and '$' can't be used as counts
+        return run[0:1] + b'*' + bytes([5 + 29]) + run[6:]
+    return run[0:1] + b'*' + bytes([repeat + 29])
+
+
+def _decode_char(match):
+    if match.group(3) is not None:
+        return bytes([match.group(3)[0] ^ 0x20])
+    char = match.group(1)
+    if len(char) == 2:
+        char = bytes([char[1] ^ 0x20])
+    return char * (match.group(2)[0] - 29 + 1)
+
+
+def escape(data: bytes, rle=False):
+    """
+    encodes packet data: escapes #, $, } and * and, if rle, run length encodes repeated characters
+    :return: (encoded data, checksum)
+    """
+    encoded = _escaped.sub(_escape_char, data)
+    if rle:
+        encoded = _runs.sub(_run_length, encoded)
+    return encoded, sum(encoded) % 256
 
 
 def unescape(data: bytes):
-    ret = b''
-    escape = False
-    checksum = 0
-    data_checksum = 0
-    for c in data:
-        checksum += c
-        if bytes([c]) == b'}':
-            escape = True
-            continue
-        if escape:
-            c = c ^ 0x20
-            escape = False
-        ret += bytes([c])
-        data_checksum += c
-    return ret, checksum % 256, data_checksum % 256
-
-
-def read_packet(sok: socket, interrupt):
-    r = sok.recv(1)
-    while r != b'$':
-        if r == b'\x03' and interrupt is not None:
-            interrupt(sok)
-            return None
-        r = sok.recv(1)
-    data = sok.recv(1)
-    while not data.endswith(b'#'):
-        data += sok.recv(1)
-    checksum = int(sok.recv(2), 16)
-    data, packet_checksum, data_checksum = unescape(data[:-1])
-    if checksum != packet_checksum:
-        print(f"Wrong packet checksum {data} {checksum} {packet_checksum}")
-        answer(sok, None, False)
-        return None
-    print(f"recv <- {data}")
-    return data
-
-
-def answer(sok: socket, ack, data=b"", success=True):
+    """
+    decodes packet data (escapes and run length encoding)
+    :return: (decoded data, checksum of the encoded data, checksum of the decoded data)
+    """
+    decoded = _encoded.sub(_decode_char, data)
+    return decoded, sum(data) % 256, sum(decoded) % 256
+
+
+class PacketReader:
+    """
+    Buffered reader of gdb packets: the stream is read in chunks and packets are parsed from the buffer.
+    """
+    def __init__(self, reader: StreamReader, chunk_size=4096, recorder=None):
+        """
+        :param recorder: FlightRecorder the received packets are recorded to
+        """
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.recorder = recorder
+        self.buffer = bytearray()
+        self.scanned = 0 # buffer bytes already searched for the end of the current packet
+
+    async def _fill(self):
+        chunk = await self.reader.read(self.chunk_size)
+        if not chunk:
+            raise EOFError("gdb disconnected")
+        self.buffer += chunk
+
+    async def read_byte(self):
+        """
+        reads a single byte out of packets (acks and interrupts while the target is running)
+        """
+        if not self.buffer:
+            await self._fill()
+        byte = bytes(self.buffer[:1])
+        del self.buffer[:1]
+        self.scanned = 0
+        return byte
+
+    async def read_packet(self):
+        """
+        reads the next packet from gdb, skipping acks.
+        :return: the packet data, INTERRUPT if gdb sent a break (ctrl-c), None on a corrupted packet
+        :raises EOFError: when the connection is closed
+        """
+        while True:
+            start = self.buffer.find(b'$')
+            interrupt = self.buffer.find(INTERRUPT, 0, start if start >= 0 else len(self.buffer))
+            if interrupt >= 0:
+                del self.buffer[:interrupt + 1]
+                self.scanned = 0
+                return INTERRUPT
+            if start < 0:
+                self.buffer.clear() # acks
+            else:
+                end = self.buffer.find(b'#', max(start, self.scanned))
+                if end >= 0 and len(self.buffer) >= end + 3:
+                    raw = bytes(self.buffer[start + 1:end])
+                    checksum = int(self.buffer[end + 1:end + 3], 16)
+                    del self.buffer[:end + 3]
+                    self.scanned = 0
+                    data, packet_checksum, data_checksum = unescape(raw)
+                    if self.recorder is not None:
+                        self.recorder.record(GDB_RECV, raw)
+                    if checksum != packet_checksum:
+                        log.warning("Wrong packet checksum %d %d", checksum, packet_checksum)
+                        return None
+                    log.debug("recv <- %.64s", data)
+                    return data
+                self.scanned = len(self.buffer) if end < 0 else end
+            await self._fill()
+
+
+def answer(writer: StreamWriter, ack, data=b"", success=True, recorder=None):
+    """
+    sends the ack (if ack mode is on) and the answer packet (if data is not None)
+    :param recorder: FlightRecorder the packet is recorded to
+    """
     packet = b''
-    if success is not None:
-        sok.send(b'+' if success else b'-')
-    if not ack:
-        success = None
+    if success is not None and ack:
+        writer.write(b'+' if success else b'-')
 
     if data is not None:
-        send_data, checksum = escape(data)
-        packet = b'$' + send_data + b'#' + ('0' + hex(checksum)[2:])[-2:].encode()
-        sok.send(packet)
-    print(f"answ -> {'+' if success else '-' if success is not None else ''} {packet}")
\ No newline at end of file
+        send_data, checksum = escape(data, rle=True)
+        packet = b'$' + send_data + b'#' + b'%02x' % checksum
+        writer.write(packet)
+        if recorder is not None:
+            recorder.record(GDB_SEND, packet)
+    log.debug("answ -> %s %.64s", '+' if success else '-' if success is not None else '', packet)
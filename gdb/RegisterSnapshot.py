@@ -0,0 +1,106 @@
+from dwire.DWInterface import DWInterface
+from dwire.avr import SPL
+
+# avr-gdb register numbers
+GDB_SREG = 32
+GDB_SP = 33
+GDB_PC = 34
+
+
+class RegisterSnapshot:
+    """
+    The registers gdb sees (r0-r31, SREG, SP, PC) read from the target once per halt with a single planned read.
+    Registers written by gdb are kept here and written back before the target runs again.
+    """
+    def __init__(self, dw: DWInterface):
+        self.dw = dw
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        to be called when the target ran or its registers have been changed elsewhere
+        """
+        self.regs = None # r0-r31, SPL, SPH, SREG
+        self.dirty = set()
+
+    def fetch(self):
+        if self.regs is None:
+            (regs, io), _ = self.dw.read_regions([('reg', 0, 32), ('io', SPL, 3)])
+            self.regs = bytearray(regs + io)
+        return self.regs
+
+    @property
+    def pc(self):
+        """
+        byte address of the current instruction (the pc read from the target is one instruction ahead)
+        """
+        return (int.from_bytes(self.dw.cur_pc, 'big') - 1) * 2
+
+    @pc.setter
+    def pc(self, value):
+        self.dw.cur_pc = int.to_bytes(value // 2 + 1, 2, 'big')
+
+    def get(self, register):
+        """
+        :return: the register value in gdb byte order
+        """
+        if register == GDB_PC:
+            return int.to_bytes(self.pc, 4, 'little')
+        regs = self.fetch()
+        if register < 32:
+            return bytes(regs[register:register + 1])
+        if register == GDB_SREG:
+            return bytes(regs[34:35])
+        if register == GDB_SP:
+            return bytes(regs[32:34])
+        raise ValueError(f"Unknown register {register}")
+
+    def set(self, register, value: bytes):
+        if register == GDB_PC:
+            self.pc = int.from_bytes(value, 'little')
+            return
+        regs = self.fetch()
+        if register < 32:
+            regs[register] = value[0]
+        elif register == GDB_SREG:
+            regs[34] = value[0]
+        elif register == GDB_SP:
+            regs[32:34] = value[:2]
+        else:
+            raise ValueError(f"Unknown register {register}")
+        self.dirty.add(register)
+
+    def get_all(self):
+        """
+        :return: the g packet register block: r0-r31, SREG, SP, PC
+        """
+        return b''.join(self.get(r) for r in range(GDB_PC + 1))
+
+    def set_all(self, data: bytes):
+        offset = 0
+        for register, size in [(r, 1) for r in range(32)] + [(GDB_SREG, 1), (GDB_SP, 2), (GDB_PC, 4)]:
+            if offset + size > len(data):
+                break
+            if data[offset:offset + size] != self.get(register):
+                self.set(register, data[offset:offset + size])
+            offset += size
+
+    def expedite(self):
+        """
+        :return: the registers sent in a T stop reply (SREG, SP, PC) so gdb does not need a g packet
+        """
+        return b''.join(b'%02x:%s;' % (r, self.get(r).hex().encode()) for r in (GDB_SREG, GDB_SP, GDB_PC))
+
+    def write_back(self):
+        """
+        writes the registers changed by gdb to the target and invalidates the snapshot
+        """
+        dirty = sorted(r for r in self.dirty if r < 32)
+        while dirty:
+            start = end = dirty.pop(0)
+            while dirty and dirty[0] == end + 1:
+                end = dirty.pop(0)
+            self.dw.write_register(start, bytes(self.regs[start:end + 1]))
+        if self.dirty & {GDB_SREG, GDB_SP}:
+            self.dw.write_io_space(SPL, bytes(self.regs[32:35]), 3)
+        self.invalidate()
@@ -0,0 +1,118 @@
+"""
+Replays a gdb session recorded with a RecordingTransport (dwire.SerialDW.Recording): the server gets the recorded
+gdb input and the driver the recorded target answers, so the host side cost of a field capture can be profiled
+apart from the wire time.
+run with `python -m gdb.Replay session.dwrec [--realtime] [--shadow file.flash] [--profile out.prof]`
+"""
+import argparse
+import asyncio
+import cProfile
+import shutil
+import tempfile
+import time
+
+from dwire.DWInterface import DWInterface
+from dwire.FlashShadow import FlashShadow
+from dwire.SerialDW import SerialDW
+from dwire.SerialDW.Recording import ReplayTransport, ReplayError
+from gdb.GDBServer import GDBServer
+
+STALL_TIMEOUT = 5 # s without replay progress before giving up (the server diverged from the recording)
+
+
+class ReplayWriter:
+    """
+    Stands in for the gdb connection writer, collecting the server answers
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def get_extra_info(self, name, default=None):
+        return 'replay'
+
+
+def _feed(reader: asyncio.StreamReader, data):
+    if data:
+        reader.feed_data(data)
+    else:
+        reader.feed_eof()
+
+
+async def _replay(server: GDBServer, transport: ReplayTransport, writer: ReplayWriter):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport.on_input = lambda data: loop.call_soon_threadsafe(_feed, reader, data)
+    session = asyncio.ensure_future(server.serve_stream(reader, writer))
+    cursor, progress = transport.cursor, time.monotonic()
+    while not session.done():
+        if transport.finished:
+            if not reader.at_eof():
+                reader.feed_eof()
+        elif not transport.pump():
+            await asyncio.sleep(0.001)
+        if transport.cursor != cursor:
+            cursor, progress = transport.cursor, time.monotonic()
+        elif not transport.realtime and time.monotonic() - progress > STALL_TIMEOUT:
+            session.cancel()
+            raise ReplayError(f"replay stalled at event {cursor} of {len(transport.events)}")
+    await session
+
+
+def replay_gdb_session(path, realtime=False, target_frequency=8000000, break_execution=True, reset_execution=True,
+                       shadow=None):
+    """
+    replays a recorded gdb session. the SerialDW arguments have to be the ones of the recorded session.
+    :param realtime: waits the recorded time of each event, else runs as fast as possible
+    :param shadow: flash shadow file the session was recorded with (copied, it is left untouched), None if empty
+    :return: dict with the events replayed, the recorded wire time and the host time (s, not measured in realtime)
+    """
+    transport = ReplayTransport(path, realtime)
+    with tempfile.TemporaryDirectory() as shadow_dir:
+        start = time.perf_counter()
+        device = SerialDW(transport, target_frequency, break_execution, reset_execution)
+        if shadow is not None:
+            dev = device.dev
+            copy = FlashShadow(device.device_fingerprint, dev.FLASH_SIZE, dev.FLASH_PAGEEND, shadow_dir, transport.port)
+            shutil.copyfile(shadow, copy.path)
+        dw = DWInterface(device, shadow_dir=shadow_dir)
+        server = GDBServer(dw)
+        writer = ReplayWriter()
+        asyncio.run(_replay(server, transport, writer))
+        if not transport.finished:
+            dw.close() # the recording ends with the driver shutdown
+        elapsed = time.perf_counter() - start
+    return {'events': transport.cursor, 'recorded_events': len(transport.events), 'wire_time': transport.wire_time,
+            'elapsed': elapsed, 'host_time': None if realtime else elapsed,
+            'answer_bytes': len(writer.data)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('recording')
+    parser.add_argument('--realtime', action='store_true', help="waits the recorded wire time")
+    parser.add_argument('--shadow', help="flash shadow file the session was recorded with")
+    parser.add_argument('--profile', help="file the cProfile stats of the replay are saved to")
+    args = parser.parse_args()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    stats = replay_gdb_session(args.recording, args.realtime, shadow=args.shadow)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    print(f"{stats['events']}/{stats['recorded_events']} events replayed in {stats['elapsed']:.3f}s, "
+          f"{stats['wire_time']:.3f}s on the wire when recorded, {stats['answer_bytes']} bytes answered")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,14 @@
+import logging
 import signal
 from binascii import hexlify
 
 from dwire import CNTXT_GO_TO_HW_BREAKPOINT
 from dwire.DWInterface import DWInterface, INST_ADDR
+from dwire.Progress import ConsoleProgress
 from dwire.SerialDW import SerialDW
 from gdb.GDBServer import GDBServer
 
 
-def irq(sok):
-    print("irq called... i don't know what to do!")
-
-
 def terminate(dw, srv, sig):
     print(f"terminating gdb server signal {sig}")
     srv.terminate()
@@ -20,9 +18,10 @@ def terminate(dw, srv, sig):
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s') # DEBUG logs every packet and command
     dw = DWInterface(SerialDW('/dev/ttyUSB0', 8000000, True, True))
 
-    #srv = GDBServer('sock', irq, dw)
+    #srv = GDBServer(dw, unix_path='sock', tcp_address=('localhost', 1234))
     #srv.start()
     #signal.signal(signal.SIGINT, lambda sig, frame: terminate(None, srv, sig))
     
@@ -38,7 +37,7 @@ if __name__ == '__main__':
     
     #f = dw.get_fingerprint()
     #dw.halt()
-    #dw.write_firmware("./avrtest/main.flash.bin", erease_device=False)
+    #dw.write_firmware("./avrtest/main.flash.bin", erease_device=False, progress=ConsoleProgress())
     #dw.restart_execution()
     
     #dw.reset()
@@ -0,0 +1,21 @@
+import pytest
+
+from dwire.DWInterface import DWInterface
+from dwire.SerialDW import SerialDW
+from dwire.SerialDW.Emulator import EmulatedTransport
+
+
+@pytest.fixture
+def transport():
+    return EmulatedTransport(latency=0)
+
+
+@pytest.fixture
+def dw(transport, tmp_path):
+    """
+    DWInterface connected to a halted emulated ATtiny85, with an empty flash shadow
+    """
+    interface = DWInterface(SerialDW(transport, 8000000, True, True), shadow_dir=str(tmp_path / 'shadow'))
+    yield interface
+    if transport.is_open:
+        interface.close()
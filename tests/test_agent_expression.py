@@ -0,0 +1,29 @@
+from gdb.AgentExpression import AgentExpression, REG, CONST8, CONST32, ADD, EQUAL, REF16, END, IF_GOTO, GOTO, \
+    LESS_UNSIGNED
+from gdb.RegisterSnapshot import GDB_PC
+
+
+def reader(memory):
+    return lambda space, address, length: memory[(space, address, length)]
+
+
+def test_register_plus_constant_equals():
+    code = AgentExpression(bytes([REG, 0, 24, CONST8, 5, ADD, CONST8, 7, EQUAL, END]))
+    assert code.reads == [('reg', 24, 1)]
+    assert code.evaluate(reader({('reg', 24, 1): b'\x02'}), pc=0) == 1
+    assert code.evaluate(reader({('reg', 24, 1): b'\x03'}), pc=0) == 0
+
+
+def test_memory_reference_and_branches():
+    # *(uint16_t *)0x800060 < 0x100 ? 10 : 20
+    code = AgentExpression(bytes([CONST32, 0x00, 0x80, 0x00, 0x60, REF16, CONST8, 0xFF, CONST8, 1, ADD,
+                                  LESS_UNSIGNED, IF_GOTO, 0, 20, CONST8, 20, GOTO, 0, 22, CONST8, 10, END]))
+    assert ('data', 0x60, 2) in code.reads
+    assert code.evaluate(reader({('data', 0x60, 2): b'\xff\x00'}), pc=0) == 10
+    assert code.evaluate(reader({('data', 0x60, 2): b'\x00\x01'}), pc=0) == 20
+
+
+def test_pc_register_is_the_byte_address():
+    code = AgentExpression(bytes([REG, 0, GDB_PC, END]))
+    assert code.reads == []
+    assert code.evaluate(reader({}), pc=0x20) == 0x40
@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+from dwire.BreakpointManager import BreakpointManager
+from dwire.Firmware import FirmwareImage
+
+PAGE = 64
+LDI_R16_42 = b'\x02\xe4' # ldi r16, 0x42
+
+
+class FlashDW:
+    """
+    the DWInterface calls BreakpointManager makes, on a flash bytearray
+    """
+    def __init__(self, pages=4):
+        self.device = SimpleNamespace(dev=SimpleNamespace(FLASH_PAGEEND=PAGE))
+        self.flash = bytearray(PAGE * pages)
+        self.hw_breakpoint = None
+
+    def read_flash(self, address, length):
+        return bytes(self.flash[address:address + length])
+
+    def write_flash_page(self, address, data, shadow=True):
+        self.flash[address:address + len(data)] = data
+
+    def set_hw_breakpoint(self, address):
+        self.hw_breakpoint = address
+
+
+def flash(dw, code):
+    image = FirmwareImage(PAGE)
+    image.add(0, code)
+    dw.write_firmware(image)
+
+
+def test_resume_steps_over_the_user_hw_breakpoint(dw):
+    flash(dw, LDI_R16_42 + b'\x00\x00' * 4)
+    dw.write_register(16, b'\x00')
+    assert dw.breakpoints.insert_hw(dw.get_instruction_address())
+    dw.resume_execution()
+    assert dw.wait_hit(1)
+    assert dw.read_registers(16, 1) == b'\x42' # the halted instruction ran before stopping again
+
+
+
+def test_breakpoints_are_written_lazily():
+    dw = FlashDW()
+    bp = BreakpointManager(dw)
+    bp.insert(4)
+    bp.remove(4)
+    bp.insert(6)
+    assert bp.page_writes == 0 # nothing is written before resuming
+    bp.commit(arm_hw=False)
+    assert bp.page_writes == 1 and bp.original(6) == b'\x00\x00'
+    bp.insert(8)
+    bp.insert(PAGE + 2)
+    bp.commit(arm_hw=False)
+    assert bp.page_writes == 3 # one write per page
+    bp.commit(arm_hw=False)
+    assert bp.page_writes == 3
+    assert dw.read_flash(0, 10) == b'\x00' * 6 + b'\x98\x95' * 2
+    assert bp.overlay(0, dw.read_flash(0, 10)) == b'\x00' * 10
+    bp.remove_all()
+    bp.commit(arm_hw=False)
+    assert dw.flash == bytes(len(dw.flash)) and bp.inserted == {}
+
+
+def test_single_breakpoint_uses_the_hw_slot():
+    dw = FlashDW()
+    bp = BreakpointManager(dw)
+    bp.insert(10)
+    assert bp.commit()
+    assert bp.page_writes == 0
+    assert bp.slot == 10 and dw.hw_breakpoint == 5 and dw.flash[10:12] == b'\x00\x00'
+
+
+def test_most_volatile_breakpoint_takes_the_slot():
+    dw = FlashDW()
+    bp = BreakpointManager(dw)
+    bp.insert(10)
+    bp.insert(PAGE + 4)
+    bp.commit()
+    for _ in range(3):
+        bp.hit(PAGE + 4)
+    bp.insert(PAGE + 8) # page 1 is written anyway: PAGE + 4 leaves it for free
+    bp.commit()
+    assert bp.slot == PAGE + 4 and dw.hw_breakpoint == (PAGE + 4) // 2
+    assert dw.flash[PAGE + 4:PAGE + 6] == b'\x00\x00' and dw.flash[10:12] == b'\x98\x95'
+
+
+def test_user_hw_breakpoint_frees_the_slot():
+    dw = FlashDW()
+    bp = BreakpointManager(dw)
+    bp.insert(10)
+    assert bp.insert_hw(40)
+    assert not bp.insert_hw(41)
+    assert bp.commit()
+    assert bp.slot is None and dw.hw_breakpoint == 40 and dw.flash[10:12] == b'\x98\x95'
+
+
+def test_close_removes_breakpoints_from_a_running_target(dw, transport):
+    flash(dw, b'\x00\x00' * PAGE)
+    dw.breakpoints.insert(4)
+    dw.breakpoints.commit(arm_hw=False) # in flash
+    dw.resume_execution()
+    assert dw.device.is_running and transport.target.flash[4:6] == b'\x98\x95'
+    dw.close()
+    assert transport.target.flash[4:6] == b'\x00\x00'
+    assert transport.target.running # resumed after the cleanup
@@ -0,0 +1,49 @@
+import pytest
+
+from dwire.avr.Decoder import decode, successors, instruction_length, Instruction, SEQUENTIAL, BRANCH, JUMP, CALL, \
+    SKIP, INDIRECT_JUMP, INDIRECT_CALL, RETURN, BREAK
+
+PC = 0x100
+
+
+@pytest.mark.parametrize('word, next_word, expected', [
+    (0xC000, 0, Instruction(1, JUMP, PC + 1)), # rjmp .+0
+    (0xCFFF, 0, Instruction(1, JUMP, PC)), # rjmp .-2
+    (0xD005, 0, Instruction(1, CALL, PC + 6)), # rcall
+    (0xF7F1, 0, Instruction(1, BRANCH, PC - 1)), # brne .-4
+    (0xF009, 0, Instruction(1, BRANCH, PC + 2)), # breq .+2
+    (0x940C, 0x1234, Instruction(2, JUMP, 0x1234)), # jmp
+    (0x940E, 0x0042, Instruction(2, CALL, 0x0042)), # call
+    (0x1001, 0, Instruction(1, SKIP, None)), # cpse
+    (0xFC00, 0, Instruction(1, SKIP, None)), # sbrc
+    (0x9B00, 0, Instruction(1, SKIP, None)), # sbis
+    (0x9409, 0, Instruction(1, INDIRECT_JUMP, None)), # ijmp
+    (0x9509, 0, Instruction(1, INDIRECT_CALL, None)), # icall
+    (0x9508, 0, Instruction(1, RETURN, None)), # ret
+    (0x9518, 0, Instruction(1, RETURN, None)), # reti
+    (0x9598, 0, Instruction(1, BREAK, None)), # break
+    (0x9100, 0x0060, Instruction(2, SEQUENTIAL, None)), # lds
+    (0x9300, 0x0060, Instruction(2, SEQUENTIAL, None)), # sts
+    (0x0000, 0, Instruction(1, SEQUENTIAL, None)), # nop
+])
+def test_decode(word, next_word, expected):
+    assert decode(word, next_word, PC) == expected
+
+
+def test_instruction_length():
+    assert [instruction_length(w) for w in (0x9000, 0x9200, 0x940C, 0x940E, 0x9001, 0xE000)] == [2, 2, 2, 2, 1, 1]
+
+
+def test_successors():
+    assert successors(decode(0x0000, 0, PC), PC) == [PC + 1]
+    assert successors(decode(0xF7F1, 0, PC), PC) == [PC + 1, PC - 1]
+    assert successors(decode(0x1001, 0, PC), PC, next_length=2) == [PC + 1, PC + 3]
+    assert successors(decode(0x9508, 0, PC), PC) == [None]
+
+
+def test_relative_jumps_wrap_around_the_device_flash():
+    words = 4096 # attiny85
+    assert decode(0xCFFE, 0, 0, words).target == words - 1 # rjmp .-4 from the reset vector
+    assert decode(0xDFFF, 0, 0, words).target == 0 # rcall .-2 ... to itself
+    assert decode(0xC001, 0, words - 1, words).target == 1 # rjmp .+2 from the last word
+    assert decode(0xF7F1, 0, 0, words).target == words - 1 # brne .-4
@@ -0,0 +1,78 @@
+from dwire import CTRL_REG_PC
+from dwire.SerialDW import EEPROM_WRITE_TIME
+from dwire.SerialDW.FlashProgrammer import EXEC
+from dwire.avr import OUT
+from dwire.SerialDW.devices.ATTINY85 import DevATTINY85
+
+
+def test_commands_without_response_share_a_write(dw, transport):
+    device = dw.device
+    writes = transport.writes
+    with device.transaction() as txn:
+        txn.dw_cmd(bytes([0xD0 | CTRL_REG_PC]) + b'\x00\x10', 0)
+        txn.dw_cmd(b'\x66', 0)
+        pc = txn.dw_cmd(b'\xf0', 2)
+    assert transport.writes == writes + 1
+    assert txn.results[pc] == b'\x00\x11' # read one instruction ahead
+
+
+def test_each_response_closes_a_write(dw, transport):
+    device = dw.device
+    writes, round_trips = transport.writes, device.round_trips
+    txn = device.transaction()
+    first = txn.dw_cmd(b'\xf3', 2)
+    second = txn.dw_cmd(b'\xf3', 2)
+    results = txn.commit()
+    assert transport.writes == writes + 2 and device.round_trips == round_trips + 2
+    assert results[first] == results[second] == device.device_fingerprint
+
+
+def test_trailing_commands_are_sent(dw, transport):
+    txn = dw.device.transaction()
+    txn.dw_cmd(b'\xf0', 2)
+    last = txn.dw_cmd(bytes([0xD0 | CTRL_REG_PC]) + b'\x00\x20', 0)
+    assert txn.commit()[last] is None
+    assert transport.target.pc == 0x20
+
+
+def test_streamed_page_lands_in_flash(dw, transport):
+    page_size = DevATTINY85.FLASH_PAGEEND
+    data = bytes(range(255, 255 - page_size, -1))
+    dw.write_flash_page(3 * page_size, data)
+    assert transport.target.flash[3 * page_size:4 * page_size] == data
+    assert transport.target.flash[2 * page_size:3 * page_size] == b'\xff' * page_size
+    assert dw.device.read_flash(3 * page_size, page_size) == data
+
+
+def test_read_regions_on_target(dw, transport):
+    dw.write_ram(0x60, b'\x11\x22\x33\x44')
+    dw.write_register(5, b'\x55')
+    round_trips = dw.device.round_trips
+    contents, unreadable = dw.read_regions([('data', 0x61, 2), ('reg', 5, 1), ('data', 0x60, 1), ('sram', 3, 1)])
+    assert contents == [b'\x22\x33', b'\x55', b'\x11', b'\x44']
+    assert unreadable == []
+    assert dw.device.round_trips - round_trips <= 3
+    dwdr = 0x20 + dw.device.dev.DWRD
+    _, unreadable = dw.read_regions([('data', dwdr - 1, 3)])
+    assert len(unreadable) == 1
+
+
+def test_eeprom_writes_are_chained(dw, transport, monkeypatch):
+    device = dw.device
+    transport.target.eeprom[250:254] = b'\x12\x34\xff\x00'
+    data = b'\x12\x30\x5a\xff' + b'\xa5' * 16 # keeps an unchanged byte, write-only, atomic, erase-only across 0x100
+    sent = []
+    write = transport.write
+    monkeypatch.setattr(transport, 'write', lambda d: sent.append(bytes(d)) or write(d))
+    round_trips = device.round_trips
+    assert device.write_eeprom(data, 250) == len(data) - 1
+    assert transport.target.eeprom[250:250 + len(data)] == data
+    # a read per byte, a poll before the first write, then the chained stream with the final poll
+    assert device.round_trips - round_trips == len(data) + 2
+    stream = sent[-1]
+    start, store = EXEC(OUT(device.dev.EECR, 27)), EXEC(OUT(device.dev.EEARL, 30))
+    gap = min(EEPROM_WRITE_TIME.values()) * device.baudrate / 10 # bytes on the wire during a write
+    end = stream.find(start)
+    while stream.find(start, end + 1) > 0:
+        assert stream.find(store, end) - (end + len(start)) >= gap
+        end = stream.find(start, end + 1)
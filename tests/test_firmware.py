@@ -0,0 +1,74 @@
+import struct
+
+import pytest
+
+from dwire.Firmware import FirmwareImage, load_firmware
+from dwire.Symbols import ELF_MAGIC, _elf_header
+
+PAGE = 64
+
+
+def hex_record(kind, address, payload=b''):
+    record = bytes([len(payload)]) + address.to_bytes(2, 'big') + bytes([kind]) + payload
+    return b':' + (record + bytes([-sum(record) & 0xFF])).hex().upper().encode() + b'\n'
+
+
+def elf(segments):
+    """
+    minimal 32 bit little endian ELF with one PT_LOAD program header per (paddr, data)
+    """
+    phoff = _elf_header.size
+    data_offset = phoff + 32 * len(segments)
+    header = _elf_header.pack(ELF_MAGIC + b'\x01\x01\x01' + bytes(9), 2, 83, 1, 0, phoff, 0, 0, _elf_header.size,
+                              32, len(segments), 40, 0, 0)
+    programs, contents = b'', b''
+    for paddr, data in segments:
+        programs += struct.pack('<IIIIIIII', 1, data_offset + len(contents), paddr, paddr, len(data), len(data), 5, 1)
+        contents += data
+    return header + programs + contents
+
+
+def test_add_routes_flash_eeprom_and_skips_fuses():
+    image = FirmwareImage(PAGE)
+    image.add(PAGE - 2, b'\x01\x02\x03\x04') # across two pages
+    image.add(0x800060, b'\x00') # data space
+    image.add(0x810004, b'\xaa')
+    image.add(0x820000, b'\x62\xdf\xff') # .fuse
+    image.add(0x840000, b'\x0b\x93\x1e') # .signature
+    assert image.pages[0][-2:] == b'\x01\x02' and image.pages[1][:2] == b'\x03\x04'
+    assert image.pages[1][2:] == b'\xff' * (PAGE - 2)
+    assert image.eeprom == [(4, b'\xaa')]
+    assert image.size == 2 * PAGE
+
+
+def test_hex_sections(tmp_path):
+    path = tmp_path / 'fw.hex'
+    path.write_bytes(hex_record(0, 0x0000, b'\x0c\x94') + hex_record(4, 0, b'\x00\x81') + hex_record(0, 0x0002, b'\x55')
+                     + hex_record(4, 0, b'\x00\x84') + hex_record(0, 0x0000, b'\x0b\x93\x1e') + hex_record(1, 0))
+    image = load_firmware(str(path), PAGE)
+    assert list(image.pages) == [0] and image.pages[0][:2] == b'\x0c\x94'
+    assert image.eeprom == [(2, b'\x55')]
+
+
+def test_elf_segments(tmp_path):
+    path = tmp_path / 'fw.elf'
+    path.write_bytes(elf([(0x0000, b'\x0c\x94\x34\x00'), (0x0080, b'\x11\x22'), (0x810000, b'\x42'),
+                          (0x830000, b'\xfc')]))
+    image = load_firmware(str(path), PAGE)
+    assert sorted(image.pages) == [0, 2]
+    assert image.pages[2][:2] == b'\x11\x22'
+    assert image.eeprom == [(0, b'\x42')]
+
+
+def test_raw_binary(tmp_path):
+    path = tmp_path / 'fw.bin'
+    path.write_bytes(bytes(range(PAGE + 1)))
+    image = load_firmware(str(path), PAGE)
+    assert image.pages[0] == bytes(range(PAGE)) and image.pages[1][:1] == bytes([PAGE])
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.hex'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError, match='empty'):
+        load_firmware(str(path), PAGE)
@@ -0,0 +1,14 @@
+from dwire.SerialDW.FlashProgrammer import FlashPageProgrammer
+from dwire.SerialDW.devices.ATTINY85 import DevATTINY85
+
+
+def test_fill_stream_places_each_byte_after_its_in():
+    programmer = FlashPageProgrammer(DevATTINY85)
+    data = bytes(range(DevATTINY85.FLASH_PAGEEND))
+    stream = programmer.fill_stream(data)
+    fill = stream[len(programmer.fill_prefix):len(stream) - len(programmer.page_write)]
+    assert len(fill) == programmer.word_len * len(data) // 2
+    assert fill[programmer.low_offset::programmer.word_len] == data[0::2]
+    assert fill[programmer.high_offset::programmer.word_len] == data[1::2]
+    assert stream.endswith(programmer.page_write)
+
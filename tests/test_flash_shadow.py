@@ -0,0 +1,97 @@
+from dwire.DWInterface import DWInterface
+from dwire.Firmware import FirmwareImage
+from dwire.FlashShadow import FlashShadow
+from dwire.SerialDW import SerialDW
+from dwire.SerialDW.Emulator import EmulatedTransport
+from dwire.avr import BREAK, FLASH_INSTRUCTION
+
+PAGE = 64
+
+
+def image(*pages):
+    firmware = FirmwareImage(PAGE)
+    for idx, content in pages:
+        firmware.add(idx * PAGE, content)
+    return firmware
+
+
+def test_incremental_rewrites_stale_shadow_pages(dw, transport):
+    firmware = image((0, bytes(range(PAGE))), (1, bytes(range(PAGE, 2 * PAGE))))
+    assert dw.write_firmware(firmware)['written'] == 2
+    transport.target.flash[PAGE:2 * PAGE] = b'\xff' * PAGE # changed behind the shadow (e.g. isp)
+    stats = dw.write_firmware(firmware, incremental=True, check_shadow=True)
+    assert stats['written'] == 1 and stats['skipped'] == 1
+    assert transport.target.flash[:2 * PAGE] == bytes(range(2 * PAGE))
+    assert dw.flash_shadow.page(1) == bytes(range(PAGE, 2 * PAGE))
+
+
+def test_incremental_skips_matching_pages(dw, transport):
+    firmware = image((0, bytes(range(PAGE))))
+    dw.write_firmware(firmware)
+    writes = transport.writes
+    stats = dw.write_firmware(firmware, incremental=True)
+    assert stats['written'] == 0 and stats['skipped'] == 1
+    assert transport.writes == writes # skipped pages are not read back
+
+
+def test_breakpoint_pages_stay_out_of_the_shadow(dw, transport):
+    dw.write_firmware(image((0, b'\x00\x00' * (PAGE // 2))))
+    dw.breakpoints.insert(4)
+    dw.breakpoints.commit(arm_hw=False) # no hw slot: the BREAK goes to flash
+    assert transport.target.flash[4:6] == FLASH_INSTRUCTION(BREAK())
+    assert not dw.flash_shadow.is_known(0)
+    dw.breakpoints.remove(4)
+    dw.breakpoints.commit(arm_hw=False)
+    assert dw.flash_shadow.page(0) == b'\x00' * PAGE
+
+
+def test_full_write_skips_the_shadow_check(transport, tmp_path):
+    firmware = image((0, bytes(range(PAGE))), (1, bytes(range(PAGE, 2 * PAGE))))
+    shadow_dir = str(tmp_path / 'shadow')
+    round_trips = []
+    for link in (transport, EmulatedTransport(transport.target, latency=0)):
+        dw = DWInterface(SerialDW(link, 8000000, True, True), shadow_dir=shadow_dir)
+        link.reset_stats()
+        dw.write_firmware(firmware, verify=False)
+        round_trips.append(link.writes)
+        dw.close() # saves the shadow
+    assert round_trips[0] == round_trips[1] # no page read back to check the saved shadow
+
+
+def test_shadow_is_kept_per_adapter(tmp_path):
+    shadows = [FlashShadow(b'\x93\x0b', 4 * PAGE, PAGE, str(tmp_path), port) for port in ('/dev/ttyUSB0', '/dev/ttyUSB1')]
+    shadows[0].update(1, bytes(range(PAGE)))
+    shadows[0].save()
+    assert shadows[0].path != shadows[1].path
+    assert not shadows[1].load()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['930b-_dev_ttyUSB0.flash'] # no temporary file left
+    reloaded = FlashShadow(b'\x93\x0b', 4 * PAGE, PAGE, str(tmp_path), '/dev/ttyUSB0')
+    assert reloaded.load() and reloaded.page(1) == bytes(range(PAGE)) and not reloaded.is_known(0)
+
+
+def test_incremental_after_a_full_write_uses_the_saved_shadow(transport, tmp_path):
+    shadow_dir = str(tmp_path / 'shadow')
+    first = image((0, bytes(range(PAGE))), (1, bytes(range(PAGE, 2 * PAGE))))
+    dw = DWInterface(SerialDW(transport, 8000000, True, True), shadow_dir=shadow_dir)
+    dw.write_firmware(first)
+    dw.close()
+    dw = DWInterface(SerialDW(EmulatedTransport(transport.target, latency=0), 8000000, True, True),
+                     shadow_dir=shadow_dir)
+    dw.write_firmware(image((2, b'\x00' * PAGE)))
+    stats = dw.write_firmware(first, incremental=True)
+    assert stats['written'] == 0 and stats['skipped'] == 2
+    dw.close()
+    saved = FlashShadow(dw.device.device_fingerprint, len(transport.target.flash), PAGE, shadow_dir, 'emulator')
+    assert saved.load() and all(saved.is_known(idx) for idx in range(3))
+
+
+def test_shadow_check_reads_the_same_pages(tmp_path):
+    checked = []
+    for _ in range(2):
+        shadow = FlashShadow(b'\x93\x0b', 32 * PAGE, PAGE, str(tmp_path))
+        for idx in range(0, 32, 2):
+            shadow.update(idx, bytes([idx]) * PAGE)
+        pages = []
+        assert shadow.verify(lambda idx: pages.append(idx) or shadow.page(idx))
+        checked.append(pages)
+    assert len(checked[0]) == 4 and checked[0] == checked[1] # a recorded session replays
@@ -0,0 +1,29 @@
+from dwire.FlightRecorder import FlightRecorder, load_flight_record, DW_WRITE, DW_READ, PAYLOAD_SIZE
+
+
+def test_ring_keeps_the_last_events():
+    recorder = FlightRecorder(capacity=4)
+    for i in range(10):
+        recorder.record(DW_WRITE if i % 2 else DW_READ, bytes([i]))
+    events = recorder.events()
+    assert recorder.recorded == 10
+    assert [payload for _, _, _, payload in events] == [b'\x06', b'\x07', b'\x08', b'\x09']
+    assert [kind for _, kind, _, _ in events] == [DW_READ, DW_WRITE, DW_READ, DW_WRITE]
+    assert [when for when, _, _, _ in events] == sorted(when for when, _, _, _ in events)
+
+
+def test_long_payloads_are_truncated(tmp_path):
+    recorder = FlightRecorder(capacity=2)
+    recorder.record(DW_WRITE, bytes(range(100)))
+    assert recorder.events()[0][2:] == (100, bytes(range(PAYLOAD_SIZE)))
+    assert '...' in recorder.format()
+    path = tmp_path / 'flight.dwfr'
+    recorder.dump(str(path))
+    assert load_flight_record(str(path)) == recorder.events()
+
+
+def test_dw_commands_are_recorded(dw):
+    dw.device.dw_cmd(b'\xf3', 2)
+    (_, write, _, sent), (_, read, _, received) = dw.device.flight.events()[-2:]
+    assert (write, sent) == (DW_WRITE, b'\xf3')
+    assert (read, received) == (DW_READ, b'\xf3' + dw.device.device_fingerprint)
@@ -0,0 +1,21 @@
+from dwire.Gang import ImageCache, baud_divisor, program_board
+from dwire.SerialDW.Emulator import EmulatedTransport
+
+
+def test_baud_divisor():
+    assert baud_divisor(8000000, 62500) == 7
+    assert baud_divisor(8000000, 500000) == 4
+    assert baud_divisor(8000000, 10 ** 7) == 0
+    assert baud_divisor(8000000, 1000) == 7
+
+
+def test_program_board_at_higher_baud(tmp_path):
+    firmware = tmp_path / 'firmware.bin'
+    firmware.write_bytes(bytes(range(256)))
+    transport = EmulatedTransport(latency=0)
+    result = program_board(transport, ImageCache(str(firmware)), 8000000, resume=False, baud=500000,
+                           shadow_dir=str(tmp_path))
+    assert result.ok, result.error
+    assert result.stats['written'] == 4
+    assert transport.target.divisor == 16
+    assert transport.target.flash[:256] == bytes(range(256))
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from binascii import hexlify
+
+from dwire.Firmware import FirmwareImage
+from gdb.GDBServer import GDBServer
+from gdb.GDBUtils import escape, unescape
+
+
+class Writer:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_extra_info(self, name, default=None):
+        return 'test'
+
+
+def packet(data):
+    encoded, checksum = escape(data)
+    return b'$' + encoded + b'#%02x' % checksum
+
+
+def replies(data):
+    found = []
+    for chunk in bytes(data).split(b'$')[1:]:
+        found.append(unescape(chunk[:chunk.index(b'#')])[0])
+    return found
+
+
+def test_session_runs_dw_calls_off_the_loop(dw, transport):
+    server = GDBServer(dw)
+    threads = set()
+    dw_cmd = dw.device.dw_cmd
+    def tracked(*args):
+        threads.add(threading.current_thread())
+        return dw_cmd(*args)
+    dw.device.dw_cmd = tracked
+
+    async def session():
+        reader = asyncio.StreamReader()
+        writer = Writer()
+        task = asyncio.ensure_future(server.serve_stream(reader, writer))
+        reader.feed_data(packet(b'g') + packet(b'm800060,4') + packet(b'c'))
+        await asyncio.sleep(0.1) # running: the loop still serves the interrupt
+        assert not task.done()
+        reader.feed_data(b'\x03')
+        await asyncio.sleep(0.1)
+        reader.feed_eof()
+        await task
+        return writer.data
+
+    answers = replies(asyncio.run(session()))
+    assert len(answers[0]) == 39 * 2 # 32 registers, sreg, sp and pc
+    assert answers[1] == b'00000000'
+    assert answers[2].startswith(b'T02')
+    assert threads and threading.main_thread() not in threads
+
+
+def test_wait_hit_keeps_a_partial_break(dw, transport):
+    dw.resume_execution()
+    transport._rx += b'\x00' # first byte of the break answer
+    assert not dw.wait_hit(0)
+    transport.target.running = False
+    transport._rx += b'\x55'
+    assert dw.wait_hit(0)
+
+
+def test_monitor_arguments(dw, tmp_path):
+    server = GDBServer(dw)
+    assert server.monitor_metrics('on') == "metrics enabled\n"
+    assert server.monitor_metrics('json').startswith('usage')
+    assert server.monitor_metrics('trace').startswith('usage')
+    assert server.monitor_metrics('bogus').startswith('usage')
+    assert server.monitor_metrics(f"json {tmp_path / 'm.json'}").startswith('saved')
+    assert server.monitor_flight('0') == "(no events)\n"
+    assert len(server.monitor_flight('2').splitlines()) == 2
+
+
+def test_step_over_and_out_answer_gdb_steps(dw):
+    image = FirmwareImage(64)
+    image.add(0, b''.join(w.to_bytes(2, 'little') for w in (0xD003, 0, 0, 0, 0x930F, 0x910F, 0x9508))) # rcall 4 ... ret
+    dw.write_firmware(image)
+    server = GDBServer(dw)
+
+    async def session():
+        reader = asyncio.StreamReader()
+        writer = Writer()
+        task = asyncio.ensure_future(server.serve_stream(reader, writer))
+        for data in (b'qRcmd,' + hexlify(b'stepover'), b's', b'p22', b'P22=00000000', b's', b's',
+                     b'qRcmd,' + hexlify(b'stepout 1'), b'vCont;s', b'p22'):
+            reader.feed_data(packet(data))
+            await asyncio.sleep(0.05) # gdb waits for the stop reply before sending more
+        reader.feed_eof()
+        await task
+        return writer.data
+
+    answers = replies(asyncio.run(session()))
+    assert answers[2].startswith(b'T05') and b'break' not in answers[2] # stop reply of the step over
+    assert answers[3] == b'02000000' # pc after the call
+    assert answers[9].startswith(b'T05') and answers[10] == b'02000000' # back from the function
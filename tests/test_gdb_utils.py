@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from gdb.GDBUtils import PacketReader, escape, unescape, INTERRUPT
+
+
+@pytest.mark.parametrize('data', [b'', b'OK', b'#$}*', b'\x00' * 200, b'a' * 7, b'a' * 8, b'}}}}}', bytes(range(256))])
+def test_escape_round_trip(data):
+    for rle in (False, True):
+        encoded, checksum = escape(data, rle)
+        assert b'#' not in encoded.replace(b'}\x03', b'') and b'$' not in encoded.replace(b'}\x04', b'')
+        decoded, packet_checksum, _ = unescape(encoded)
+        assert decoded == data and packet_checksum == checksum
+
+
+def test_rle_shortens_runs():
+    encoded, _ = escape(b'0' * 100, rle=True)
+    assert len(encoded) < 10
+
+
+def read_all(data, chunk_size=3):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        packets = PacketReader(reader, chunk_size=chunk_size)
+        found = []
+        try:
+            while True:
+                found.append(await packets.read_packet())
+        except EOFError:
+            return found
+    return asyncio.run(run())
+
+
+def test_packet_reader_splits_chunks_skips_acks():
+    first, c1 = escape(b'qSupported:swbreak+')
+    second, c2 = escape(b'm0,4')
+    stream = b'+$' + first + b'#%02x' % c1 + b'+-$' + second + b'#%02x' % c2
+    assert read_all(stream) == [b'qSupported:swbreak+', b'm0,4']
+
+
+def test_packet_reader_interrupt_and_bad_checksum():
+    assert read_all(b'\x03$g#00$g#67') == [INTERRUPT, None, b'g']
@@ -0,0 +1,21 @@
+from dwire.MemoryPlanner import merge_ranges, split_ranges, plan_data_reads
+
+
+def test_merge_ranges():
+    assert merge_ranges([(10, 12), (0, 4), (3, 6)]) == [(0, 6), (10, 12)]
+    assert merge_ranges([(0, 4), (8, 10)], max_gap=4) == [(0, 10)]
+
+
+def test_split_ranges():
+    assert split_ranges([(0, 10)], boundaries=(4,)) == [(0, 4), (4, 10)]
+    assert split_ranges([(0, 10)], forbidden=(5,)) == [(0, 5), (6, 10)]
+    assert split_ranges([(0, 10)], max_length=4) == [(0, 4), (4, 8), (8, 10)]
+
+
+def test_plan_data_reads():
+    assert plan_data_reads([(30, 34)]) == [('reg', 30, 32), ('sram', 32, 34)]
+    assert plan_data_reads([(0x60, 0x62), (0x66, 0x68)]) == [('sram', 0x60, 0x68)]
+    assert plan_data_reads([(0x60, 0x62), (0x80, 0x82)]) == [('sram', 0x60, 0x62), ('sram', 0x80, 0x82)]
+    assert plan_data_reads([(0x40, 0x44)], forbidden=(0x42,)) == [('sram', 0x40, 0x42), ('sram', 0x43, 0x44)]
+    assert plan_data_reads([(0x60, 0x160)], max_length=128) == [('sram', 0x60, 0xE0), ('sram', 0xE0, 0x160)]
+
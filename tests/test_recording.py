@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+import gdb.Replay
+from dwire.DWInterface import DWInterface
+from dwire.FlashShadow import FlashShadow
+from dwire.SerialDW import SerialDW
+from dwire.SerialDW.Emulator import EmulatedTransport
+from dwire.SerialDW.Recording import RecordingTransport, load_recording, WRITE, READ, INPUT
+from gdb.GDBServer import GDBServer
+from gdb.GDBUtils import escape
+from gdb.Replay import ReplayWriter, replay_gdb_session
+
+
+def packet(data):
+    encoded, checksum = escape(data)
+    return b'$' + encoded + b'#%02x' % checksum
+
+
+def test_recorded_session_replays_identically(tmp_path, monkeypatch):
+    path = str(tmp_path / 'session.dwrec')
+    recording = RecordingTransport(EmulatedTransport(latency=0), path)
+    dw = DWInterface(SerialDW(recording, 8000000, True, True), shadow_dir=str(tmp_path / 'shadow'))
+    writer = ReplayWriter()
+
+    async def client(reader):
+        for data, delay in [(packet(b'qSupported:swbreak+'), 0.02), (packet(b'g'), 0.02), (packet(b'm0,10'), 0.02),
+                            (packet(b'Z0,4,2'), 0.02), (packet(b'c'), 0.1), (b'\x03', 0.05), (packet(b's'), 0.02),
+                            (packet(b'D'), 0.05)]:
+            reader.feed_data(data)
+            await asyncio.sleep(delay)
+        reader.feed_eof()
+
+    async def session():
+        reader = asyncio.StreamReader()
+        feeding = asyncio.ensure_future(client(reader))
+        await GDBServer(dw).serve_stream(reader, writer)
+        await feeding
+
+    asyncio.run(session())
+    dw.close()
+    events = load_recording(path)
+    assert {WRITE, READ, INPUT} <= {event[0] for event in events}
+
+    replayed = []
+    class Writer(ReplayWriter):
+        def __init__(self):
+            super().__init__()
+            replayed.append(self)
+    monkeypatch.setattr(gdb.Replay, 'ReplayWriter', Writer)
+    stats = replay_gdb_session(path)
+    assert stats['events'] == stats['recorded_events'] == len(events)
+    assert bytes(replayed[0].data) == bytes(writer.data)
+    assert b'swbreak' in writer.data # the continue stopped at the breakpoint
+
+
+def test_replay_works_on_a_copy_of_the_recorded_shadow(tmp_path, monkeypatch):
+    path = str(tmp_path / 'session.dwrec')
+    recording = RecordingTransport(EmulatedTransport(latency=0), path)
+    dw = DWInterface(SerialDW(recording, 8000000, True, True), shadow_dir=str(tmp_path / 'shadow'))
+    writer = ReplayWriter()
+
+    async def session():
+        reader = asyncio.StreamReader()
+        reader.feed_data(packet(b'g') + packet(b'D'))
+        reader.feed_eof()
+        await GDBServer(dw).serve_stream(reader, writer)
+
+    asyncio.run(session())
+    dw.close()
+
+    recorded = FlashShadow(b'\x93\x0b', 8192, 64, str(tmp_path / 'shadow'), 'emulator')
+    recorded.update(3, bytes(range(64)))
+    recorded.save()
+    shadows = []
+    class Interface(DWInterface):
+        def __init__(self, device, shadow_dir):
+            super().__init__(device, shadow_dir)
+            shadows.append(FlashShadow(device.device_fingerprint, 8192, 64, shadow_dir))
+            assert shadows[-1].load()
+    monkeypatch.setattr(gdb.Replay, 'DWInterface', Interface)
+    stats = replay_gdb_session(path, shadow=recorded.path)
+    assert stats['events'] == stats['recorded_events']
+    assert shadows[0].page(3) == bytes(range(64))
+    assert not os.path.exists(os.path.dirname(shadows[0].path)) # the temporary shadow directory is removed
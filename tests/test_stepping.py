@@ -0,0 +1,67 @@
+import pytest
+
+from dwire.Firmware import FirmwareImage
+
+PAGE = 64
+NOP, RET, ICALL = 0x0000, 0x9508, 0x9509
+LDI_R16_42, PUSH_R16, POP_R16 = 0xE402, 0x930F, 0x910F
+
+
+def rcall(pc, target):
+    return 0xD000 | (target - pc - 1) & 0x0FFF
+
+
+def flash(dw, *words):
+    image = FirmwareImage(PAGE)
+    image.add(0, b''.join(word.to_bytes(2, 'little') for word in words))
+    dw.write_firmware(image)
+
+
+FUNCTION = [NOP] * 6 + [LDI_R16_42, RET] # at word 6
+CALLS = {
+    'call': ([0x940E, 6, NOP], 2),
+    'rcall': ([rcall(0, 6), NOP], 1),
+    'icall': ([ICALL, NOP], 1),
+}
+
+
+@pytest.mark.parametrize('kind', sorted(CALLS))
+def test_step_over_runs_the_call(dw, kind):
+    code, returns_to = CALLS[kind]
+    flash(dw, *(code + FUNCTION[len(code):]))
+    dw.write_register(16, b'\x00')
+    dw.write_register(30, b'\x06') # Z, for icall
+    dw.write_register(31, b'\x00')
+    sp = dw.get_sp()
+    assert dw.call_return_point() == (returns_to, sp)
+    assert dw.step_over()
+    assert dw.get_instruction_address() == returns_to and dw.get_sp() == sp
+    assert dw.read_registers(16, 1) == b'\x42' # the function ran
+
+
+def test_step_over_single_steps_other_instructions(dw):
+    flash(dw, NOP, NOP)
+    assert dw.call_return_point() is None
+    assert dw.step_over()
+    assert dw.get_instruction_address() == 1
+
+
+def test_step_over_a_call_reaching_its_return_address_deeper(dw):
+    # the function calls the code at the return address: the first hit there is one frame deeper
+    flash(dw, rcall(0, 4), NOP, RET, NOP, rcall(4, 1), RET)
+    sp = dw.get_sp()
+    resumes = dw.resumes
+    assert dw.step_over()
+    assert dw.get_instruction_address() == 1 and dw.get_sp() == sp
+    assert dw.resumes - resumes == 2
+
+
+def test_step_out_reads_the_return_address_through_sp(dw):
+    flash(dw, rcall(0, 4), NOP, NOP, NOP, PUSH_R16, POP_R16, RET)
+    sp = dw.get_sp()
+    dw.step() # into the function
+    dw.step() # push r16
+    assert dw.get_instruction_address() == 5 and dw.get_sp() == sp - 3
+    assert dw.frame_return_point(1) == (1, sp)
+    assert dw.step_out(1)
+    assert dw.get_instruction_address() == 1 and dw.get_sp() == sp
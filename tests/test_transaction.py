@@ -0,0 +1,56 @@
+from dwire.SerialDW import DWTransaction
+
+
+class Device:
+    """
+    answers each dw_cmd with its length in bytes, records the streams written
+    """
+    def __init__(self):
+        self.writes = []
+
+    def dw_cmd(self, cmd, response_length):
+        self.writes.append((bytes(cmd), response_length))
+        return bytes([len(cmd)]) * response_length if response_length else None
+
+
+def test_commands_without_response_share_a_write():
+    device = Device()
+    with DWTransaction(device) as txn:
+        txn.dw_cmd(b'\xd0\x00\x10', 0)
+        txn.dw_cmd(b'\x66', 0)
+        pc = txn.dw_cmd(b'\xf0', 2)
+    assert device.writes == [(b'\xd0\x00\x10\x66\xf0', 2)]
+    assert txn.results[pc] == b'\x05\x05'
+    assert txn.results[:pc] == [None, None]
+
+
+def test_each_response_closes_a_write():
+    device = Device()
+    txn = DWTransaction(device)
+    first = txn.dw_cmd(b'\xf3', 2)
+    second = txn.dw_cmd(b'\xf3', 2)
+    results = txn.commit()
+    assert device.writes == [(b'\xf3', 2), (b'\xf3', 2)]
+    assert results[first] == results[second] == b'\x01\x01'
+    assert txn.commands == []
+
+
+def test_trailing_commands_are_sent():
+    device = Device()
+    txn = DWTransaction(device)
+    txn.dw_cmd(b'\xf0', 2)
+    txn.dw_cmd(b'\xd0\x00', 0)
+    last = txn.dw_cmd(b'\x20', 0)
+    assert txn.commit()[last] is None
+    assert device.writes == [(b'\xf0', 2), (b'\xd0\x00\x20', 0)]
+
+
+def test_failed_transaction_sends_nothing():
+    device = Device()
+    try:
+        with DWTransaction(device) as txn:
+            txn.dw_cmd(b'\xf0', 2)
+            raise ValueError
+    except ValueError:
+        pass
+    assert device.writes == []
@@ -0,0 +1,21 @@
+from dwire.VariableLogger import VariableLogger, resolve_variables
+
+
+def test_logger_keeps_sampling_when_late(dw):
+    dw.write_ram(0x60, b'\x12\x34')
+    dw.resume_execution()
+    logger = VariableLogger(dw, resolve_variables([('data', 0x60, 2)]), rate=100000) # unreachable rate
+    logger.run(samples=20)
+    samples = logger.ring.drain(0)
+    assert len(samples) == 20
+    assert all(data == b'\x12\x34' for _, data in samples)
+
+
+def test_logger_streams_csv(dw, tmp_path):
+    dw.write_ram(0x60, b'\x05')
+    dw.resume_execution()
+    logger = VariableLogger(dw, resolve_variables([0x60]), rate=1000)
+    logger.run(samples=5, path=str(tmp_path / 'log.csv'))
+    lines = (tmp_path / 'log.csv').read_text().splitlines()
+    assert lines[0] == 'time,0x0060'
+    assert len(lines) == 6 and all(line.endswith(',5') for line in lines[1:])